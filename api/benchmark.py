@@ -0,0 +1,249 @@
+# Offline benchmark of the inference pipeline, with synthetic models (no EOTDL needed).
+#
+#   python -m api.benchmark --output report.json
+#   python -m api.benchmark --compare baseline.json report.json
+#
+# Each request goes through the same stages as POST /{model}: decode, preprocess, batching wait,
+# inference and encode, which are timed separately for every combination of task, batch size,
+# image size and concurrency. Comparing two reports fails (exit code 1) if a stage got slower
+# than the given threshold.
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import rasterio as rio
+from rasterio.io import MemoryFile
+from fastapi.concurrency import run_in_threadpool
+
+from api.src.synthetic import make_model, make_index, BANDS
+from api.src.eotdl_wrapper import ModelWrapper
+from api.src.batch import BatchProcessor
+from api.src.executor import InferenceExecutor
+from api.src.decode import spool_upload, open_raster
+from api.src.encode import cog_file
+
+STAGES = ["decode", "preprocess", "batch_wait", "inference", "encode", "total"]
+
+
+class TimedBatchProcessor(BatchProcessor):
+	# records how long each request waits to be batched and how long each batch takes to run
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.waits = {}  # id of the submitted array -> seconds waiting in the queue
+		self.inference_times = []
+
+	def _dispatch(self, key, bucket, timed_out):
+		now = time.monotonic()
+		for request in list(bucket)[:self.batch_size]:
+			self.waits[id(request.data)] = now - request.enqueued_at
+		super()._dispatch(key, bucket, timed_out)
+
+	async def _predict(self, batch_data, out=None):
+		start = time.perf_counter()
+		try:
+			return await super()._predict(batch_data, out)
+		finally:
+			self.inference_times.append(time.perf_counter() - start)
+
+
+def encode_image(size, seed=0):
+	# random RGB image, encoded as a client would send it
+	image = np.random.default_rng(seed).integers(0, 256, (len(BANDS), size, size), dtype=np.uint8)
+	with MemoryFile() as memfile:
+		with memfile.open(driver="PNG", width=size, height=size, count=len(BANDS), dtype="uint8") as dst:
+			dst.write(image)
+		return memfile.read()
+
+
+def summarize(values):
+	if not values:
+		return None
+	values = np.asarray(values) * 1000  # ms
+	return {
+		"count": len(values),
+		"mean_ms": float(values.mean()),
+		"p50_ms": float(np.percentile(values, 50)),
+		"p90_ms": float(np.percentile(values, 90)),
+		"p99_ms": float(np.percentile(values, 99)),
+	}
+
+
+async def run_config(model, task, data, batch_size, concurrency, requests, timeout, directory):
+	executor = InferenceExecutor(model.model_name, kind="thread", max_workers=1)
+	processor = TimedBatchProcessor(model, executor=executor, batch_size=batch_size, timeout=timeout)
+	timings = {stage: [] for stage in STAGES}
+
+	def decode():
+		with spool_upload(io.BytesIO(data), directory) as path, open_raster(path) as source:
+			return source.read(), source.band_names, source.profile
+
+	def encode(outputs, original_size, profile):
+		if task == "classification":
+			return json.dumps(outputs.tolist())
+		mask = model.pipeline.restore_size(outputs[0] if outputs.ndim == 3 else outputs, original_size)
+		os.remove(cog_file(mask.astype("float32", copy=False), profile=profile, directory=directory))
+
+	async def request(record=True):
+		start = time.perf_counter()
+		image, band_names, profile = await run_in_threadpool(decode)
+		decoded = time.perf_counter()
+		x, original_size = await executor.preprocess(model, image, band_names)
+		preprocessed = time.perf_counter()
+		outputs = await processor.submit(x)
+		predicted = time.perf_counter()
+		wait = processor.waits.pop(id(x))
+		await run_in_threadpool(encode, outputs, original_size, profile)
+		end = time.perf_counter()
+		if record:
+			timings["decode"].append(decoded - start)
+			timings["preprocess"].append(preprocessed - decoded)
+			timings["batch_wait"].append(wait)
+			timings["encode"].append(end - predicted)
+			timings["total"].append(end - start)
+
+	async def client(count):
+		for _ in range(count):
+			await request()
+
+	try:
+		await asyncio.gather(*[request(record=False) for _ in range(batch_size)])  # warm up
+		processor.inference_times.clear()
+		start = time.perf_counter()
+		await asyncio.gather(*[
+			client(requests // concurrency + (i < requests % concurrency)) for i in range(concurrency)
+		])
+		elapsed = time.perf_counter() - start
+	finally:
+		executor.shutdown()
+	timings["inference"] = processor.inference_times
+	return {
+		"requests": requests,
+		"seconds": elapsed,
+		"throughput_rps": requests / elapsed,
+		"batches": len(processor.inference_times),
+		"stages": {stage: summarize(values) for stage, values in timings.items()},
+	}
+
+
+def environment():
+	try:
+		commit = subprocess.run(
+			["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(__file__)
+		).stdout.strip() or None
+	except OSError:
+		commit = None
+	import onnxruntime as ort
+	return {
+		"commit": commit,
+		"timestamp": time.time(),
+		"python": platform.python_version(),
+		"onnxruntime": ort.__version__,
+		"numpy": np.__version__,
+		"rasterio": rio.__version__,
+		"machine": platform.machine(),
+		"cpus": os.cpu_count(),
+	}
+
+
+def run(tasks, batch_sizes, image_sizes, concurrencies, requests, timeout, layers, width):
+	results = []
+	with tempfile.TemporaryDirectory() as path:
+		make_index(path, tasks)
+		for task in tasks:
+			make_model(path, task, task, layers=layers, width=width)
+			model = ModelWrapper(task, path=path, verbose=False)
+			model.load()
+			for image_size in image_sizes:
+				data = encode_image(image_size)
+				for batch_size in batch_sizes:
+					for concurrency in concurrencies:
+						config = {"task": task, "batch_size": batch_size, "image_size": image_size, "concurrency": concurrency}
+						print(f"Running {config}", file=sys.stderr)
+						result = asyncio.run(run_config(model, task, data, batch_size, concurrency, requests, timeout, path))
+						results.append({**config, **result})
+	return results
+
+
+def compare(baseline, report, threshold=0.1, stat="p50_ms"):
+	# stages that got slower than `threshold` (relative) between two reports
+	def key(result):
+		return (result["task"], result["batch_size"], result["image_size"], result["concurrency"])
+	previous = {key(result): result for result in baseline["results"]}
+	regressions = []
+	for result in report["results"]:
+		old = previous.get(key(result))
+		if old is None:
+			continue
+		for stage, summary in result["stages"].items():
+			old_summary = old["stages"].get(stage)
+			if not summary or not old_summary or not old_summary[stat]:
+				continue
+			change = summary[stat] / old_summary[stat] - 1
+			if change > threshold:
+				regressions.append({"config": key(result), "stage": stage, "before": old_summary[stat], "after": summary[stat], "change": change})
+	return regressions
+
+
+def parse_list(value, cast=int):
+	return [cast(item) for item in value.split(",") if item]
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the inference pipeline with synthetic models.")
+	parser.add_argument("--tasks", default="classification,segmentation")
+	parser.add_argument("--batch-sizes", default="1,4,8")
+	parser.add_argument("--image-sizes", default="64,256")
+	parser.add_argument("--concurrency", default="1,8")
+	parser.add_argument("--requests", type=int, default=32, help="requests per configuration")
+	parser.add_argument("--timeout", type=float, default=0.01, help="batch timeout in seconds")
+	parser.add_argument("--layers", type=int, default=2, help="convolutional layers of the synthetic models")
+	parser.add_argument("--width", type=int, default=16, help="channels of the convolutional layers")
+	parser.add_argument("--output", default=None, help="write the JSON report here (default stdout)")
+	parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "REPORT"), help="compare two reports")
+	parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+	args = parser.parse_args(argv)
+
+	if args.compare:
+		with open(args.compare[0]) as f:
+			baseline = json.load(f)
+		with open(args.compare[1]) as f:
+			report = json.load(f)
+		regressions = compare(baseline, report, args.threshold)
+		for regression in regressions:
+			print(
+				f"{regression['config']} {regression['stage']}: {regression['before']:.2f}ms -> "
+				f"{regression['after']:.2f}ms (+{regression['change']:.0%})"
+			)
+		return 1 if regressions else 0
+
+	report = {
+		"environment": environment(),
+		"parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "threshold")},
+		"results": run(
+			parse_list(args.tasks, str),
+			parse_list(args.batch_sizes),
+			parse_list(args.image_sizes),
+			parse_list(args.concurrency),
+			args.requests,
+			args.timeout,
+			args.layers,
+			args.width,
+		),
+	}
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=2)
+	else:
+		print(json.dumps(report, indent=2))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
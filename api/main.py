@@ -1,14 +1,14 @@
 from fastapi import FastAPI, File, UploadFile, status, Form, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import APIKeyHeader
-from starlette.responses import StreamingResponse
-import rasterio as rio
+from starlette.responses import StreamingResponse, FileResponse, JSONResponse, Response
 import io
 import os
-from PIL import Image
-from skimage.transform import resize
-from typing import Dict, Optional
+import shutil
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager, contextmanager, ExitStack
 import asyncio
 from prometheus_fastapi_instrumentator import Instrumentator
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -17,9 +17,30 @@ from slowapi.errors import RateLimitExceeded
 import logging
 import traceback
 import json
+import hmac
 from api.src.eotdl_wrapper import ModelWrapper
 from api.src.batch import BatchProcessor
-from api.src.drift import DriftDetector
+from api.src.autotune import BatchTuner
+from api.src.batch_server import RemoteProcessor
+from api.src.buffers import BufferPool
+from api.src.drift import DriftDetector, subsample
+from api.src.registry import ModelRegistry, parse_model_list
+from api.src.executor import InferenceExecutor, QueueFullError
+from api.src.tiling import predict_tiled, check_tiling
+from api.src.variants import VariantNotFoundError
+from api.src.preprocessing import SIZE_MULTIPLE
+from api.src.decode import spool_upload, open_raster, open_tensor, is_tensor, encode_tensor, InputTooLargeError, NPY_MEDIA_TYPE
+from api.src.encode import cog_file, iter_file, remove_file, COG_MEDIA_TYPE
+from api.src.bulk import as_completed_bounded, discard_on_cancel, parse_locations, manifest_location, ndjson_line, tar_bytes, tar_file, tar_end
+from api.src.cache import ResultCache, cache_key
+from api.src.items import ItemsCache, etag_matches, read_items
+from api.src.metadata import get_metadata_cache
+from api.src.utils import retrieve_model_catalog
+from api.src.timing import Profiler, start_timings, current_timings, stage
+from api.src.jobs import create_job_queue, DONE
+from api.src.worker import run_worker
+from api.src.warmup import Warmup
+from api.src.deadlines import start_deadline, parse_deadline, current_deadline, check_deadline, cancel_on_disconnect, DeadlineExceededError, ClientDisconnectedError, InvalidDeadlineError, INTERACTIVE, BULK
 from api.src.metrics import model_counter, model_error_counter
 
 __version__ = "2025.02.26"
@@ -27,11 +48,123 @@ __version__ = "2025.02.26"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_PATH = os.getenv("EOTDL_DOWNLOAD_PATH", "/tmp")
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 1))
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", 1))
+BATCH_PAD = os.getenv("BATCH_PAD", None)  # pad inputs to a multiple of this size to batch nearby sizes together
+BATCH_BUFFERS = os.getenv("BATCH_BUFFERS", "true")  # reuse preallocated batch input/output buffers
+BATCH_SERVER = os.getenv("BATCH_SERVER", None)  # unix socket of a shared batching process (set by api.serve)
+BATCH_AUTOTUNE = os.getenv("BATCH_AUTOTUNE", "false")  # adapt batch size/timeout per model, up to BATCH_SIZE/BATCH_TIMEOUT
+BATCH_LATENCY_SLO = float(os.getenv("BATCH_LATENCY_SLO", 0.5))  # p95 of batching wait + inference targeted by the tuner
+DRIFT_DETECTION = os.getenv("DRIFT_DETECTION", "false")
+DRIFT_WINDOW = int(os.getenv("DRIFT_WINDOW", 50))  # samples per drift report
+DRIFT_REFERENCE_SAMPLES = int(os.getenv("DRIFT_REFERENCE_SAMPLES", 100))  # samples building the reference profile if the model has none
+DRIFT_PSI_THRESHOLD = float(os.getenv("DRIFT_PSI_THRESHOLD", 0.2))
+RATE_LIMIT = os.getenv("RATE_LIMIT", None) 
+MODEL_CACHE_SIZE = os.getenv("MODEL_CACHE_SIZE", None)  # max number of loaded models
+MODEL_CACHE_BYTES = os.getenv("MODEL_CACHE_BYTES", None)  # max size of loaded model files
+MODEL_RELOAD_INTERVAL = os.getenv("MODEL_RELOAD_INTERVAL", None)  # seconds between checks for new versions
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "")  # e.g. "EuroSAT-RGB-Q2,RoadSegmentationQ2:1"
+PRELOAD_ATTEMPTS = int(os.getenv("PRELOAD_ATTEMPTS", 5))  # loads of each preloaded model before giving up
+PRELOAD_BACKOFF = float(os.getenv("PRELOAD_BACKOFF", 2.0))  # seconds before the first retry, doubled each time
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")  # thread or process
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 1))  # concurrent inferences per model
+INFERENCE_QUEUE_SIZE = os.getenv("INFERENCE_QUEUE_SIZE", None)  # max requests in flight per model
+REQUEST_TIMEOUT = os.getenv("REQUEST_TIMEOUT", None)  # default deadline (seconds) of single image requests, X-Request-Timeout
+TILE_SIZE = os.getenv("TILE_SIZE", None)  # segment larger images with a sliding window of this size
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", 64))
+TILES_IN_FLIGHT = int(os.getenv("TILES_IN_FLIGHT", 2 * BATCH_SIZE))
+if TILE_SIZE:
+	check_tiling(int(TILE_SIZE), TILE_OVERLAP, SIZE_MULTIPLE)  # fail at startup, not on the first large scene
+MAX_INPUT_PIXELS = os.getenv("MAX_INPUT_PIXELS", None)  # reject larger inputs before decoding them
+COG_COMPRESSION = os.getenv("COG_COMPRESSION", "DEFLATE")  # DEFLATE, ZSTD, LZW...
+COG_QUANTIZATION = os.getenv("COG_QUANTIZATION", None)  # probability (uint8 0-255) or class (uint8 0/1)
+POSTPROCESSING = os.getenv("POSTPROCESSING", "true")  # post-process outputs as described in the model metadata
+TOP_K = int(os.getenv("TOP_K", 5))  # classes returned by classification models listing their classes
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", 2 * BATCH_SIZE))  # images of a bulk request in flight
+BULK_INPUT_ROOT = os.getenv("BULK_INPUT_ROOT", None)  # local directory bulk manifests can read from
+BULK_INPUT_URLS = parse_locations(os.getenv("BULK_INPUT_URLS", ""))  # e.g. "s3://bucket,https://host", urls manifests can read from
+PROFILING = os.getenv("PROFILING", "false")  # allow profiling requests (/admin/profile, X-Profile header)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", None)  # value of the X-Profile header profiling a request, ignored if unset
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))  # fraction of requests profiled when enabled
+RESULT_CACHE_BYTES = os.getenv("RESULT_CACHE_BYTES", None)  # cache results of repeated inputs, in memory up to this size
+RESULT_CACHE_DISK = os.getenv("RESULT_CACHE_DISK", "false")  # also keep cached results on disk
+RESULT_CACHE_DISK_BYTES = os.getenv("RESULT_CACHE_DISK_BYTES", None)
+METADATA_MAX_AGE = int(os.getenv("METADATA_MAX_AGE", 0))  # seconds clients may reuse model metadata before revalidating it
+JOBS_PATH = os.getenv("JOBS_PATH", DOWNLOAD_PATH + "/jobs")  # job inputs and results, shared with the workers
+JOBS_QUEUE_URL = os.getenv("JOBS_QUEUE_URL", None)  # e.g. redis://localhost:6379/0, sqlite under JOBS_PATH by default
+JOBS_TIMEOUT = float(os.getenv("JOBS_TIMEOUT", 3600))  # running jobs older than this are queued again
+JOBS_WORKER = os.getenv("JOBS_WORKER", "false")  # also process jobs in the API process (otherwise run python -m api.worker)
+JOBS_TTL = float(os.getenv("JOBS_TTL", 86400))  # seconds finished jobs (and their files) are kept
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", 2 * BATCH_SIZE))  # jobs in flight per worker
+
+batch_processors: Dict[tuple, BatchProcessor] = {}
+executors: Dict[tuple, InferenceExecutor] = {}
+drift_detector: Dict[tuple, DriftDetector] = {}
+
+def load_model(model, version):
+	return ModelWrapper(model, path=DOWNLOAD_PATH, version=version)
+
+model_items = ItemsCache()  # encoded STAC items served by GET /{model}
+
+def on_model_evicted(key):
+	detector = drift_detector.pop(key, None)
+	if detector is not None:
+		detector.close()
+	# processors and executors of every variant of the model
+	# new requests get new ones, those in flight keep theirs until they are done
+	for processor_key in [k for k in batch_processors if k[:2] == key]:
+		batch_processors.pop(processor_key, None)
+		executor = executors.pop(processor_key, None)
+		if executor is not None:
+			executor.close()
+
+registry = ModelRegistry(
+	loader=load_model,
+	max_models=int(MODEL_CACHE_SIZE) if MODEL_CACHE_SIZE else None,
+	max_bytes=int(MODEL_CACHE_BYTES) if MODEL_CACHE_BYTES else None,
+	reload_interval=float(MODEL_RELOAD_INTERVAL) if MODEL_RELOAD_INTERVAL else None,
+	on_evict=on_model_evicted,
+	load_sessions=BATCH_SERVER is None,
+)
+
+result_cache = ResultCache(
+	max_bytes=int(RESULT_CACHE_BYTES),
+	path=DOWNLOAD_PATH + "/results" if RESULT_CACHE_DISK == "true" else None,
+	max_disk_bytes=int(RESULT_CACHE_DISK_BYTES) if RESULT_CACHE_DISK_BYTES else None,
+) if RESULT_CACHE_BYTES else None
+
+profiler = Profiler(sample_rate=PROFILE_SAMPLE_RATE)
+
+job_queue = None
+
+def get_job_queue():
+	global job_queue
+	if job_queue is None:
+		job_queue = create_job_queue(JOBS_PATH, JOBS_QUEUE_URL, JOBS_TIMEOUT)
+	return job_queue
+
+warmup = Warmup(parse_model_list(PRELOAD_MODELS), attempts=PRELOAD_ATTEMPTS, backoff=PRELOAD_BACKOFF)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	# heavy imports and preloaded models are loaded in the background, so the server starts
+	# accepting connections right away (see /health/ready)
+	warming = asyncio.create_task(run_in_threadpool(warmup.run, lambda model, version: registry.preload([(model, version)])))
+	worker = None
+	if JOBS_WORKER == "true":
+		worker = asyncio.create_task(run_worker(get_job_queue(), process_job, JOBS_CONCURRENCY, ttl=JOBS_TTL))
+	yield
+	warming.cancel()
+	if worker is not None:
+		worker.cancel()
+
 limiter = Limiter(key_func=get_remote_address)
 app = FastAPI(
 	title="ml-inference",
 	version=__version__,
 	description="API to perform inference on models hosted on EOTDL.",
+	lifespan=lifespan,
 )
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
@@ -65,6 +198,11 @@ async def verify_api_key(api_key: Optional[str] = Depends(api_key_header)):
 			)
 	return api_key
 
+def profile_requested(request):
+	# a profiled request gets its own onnxruntime session, so only those knowing the token can ask for one
+	token = request.headers.get("X-Profile")
+	return PROFILE_TOKEN is not None and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
 @app.get("/")
 async def hello():
 	return {
@@ -73,14 +211,159 @@ async def hello():
 		"auth_required": API_KEY is not None
 	}
 
-DOWNLOAD_PATH = os.getenv("EOTDL_DOWNLOAD_PATH", "/tmp")
-BATCH_SIZE = int(os.getenv("BATCH_SIZE", 1))
-BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", 1))
-DRIFT_DETECTION = os.getenv("DRIFT_DETECTION", "false")
-RATE_LIMIT = os.getenv("RATE_LIMIT", None) 
+@app.get("/health/live")
+async def liveness():
+	# the process is up and serving requests, unless the preloaded models could not be loaded after
+	# all the retries (restarting it is then the only way to become ready)
+	if not warmup.alive:
+		return JSONResponse({"status": "failed"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+	return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness():
+	# ready to take traffic once the warmup (imports, preloaded models) is done
+	return JSONResponse(
+		warmup.status(),
+		status_code=status.HTTP_200_OK if warmup.ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+	)
+
+def get_processor(model, model_wrapper):
+	key = (model, model_wrapper.version, model_wrapper.variant)
+	# initialize executor and batch processor if not already initialized
+	if key not in batch_processors:
+		executors[key] = InferenceExecutor(
+			model,
+			kind=INFERENCE_EXECUTOR,
+			max_workers=INFERENCE_WORKERS,
+			max_queue=int(INFERENCE_QUEUE_SIZE) if INFERENCE_QUEUE_SIZE else None,
+		)
+		if BATCH_SERVER:
+			batch_processors[key] = RemoteProcessor(BATCH_SERVER, model, model_wrapper.version, executors[key], model_wrapper.variant)
+			return executors[key], batch_processors[key]
+		batch_processors[key] = BatchProcessor(
+			model=model_wrapper,
+			executor=executors[key],
+			batch_size=BATCH_SIZE,
+			timeout=BATCH_TIMEOUT,
+			pad_to=int(BATCH_PAD) if BATCH_PAD else None,
+			buffers=BufferPool(max_free=INFERENCE_WORKERS + 1) if BATCH_BUFFERS == "true" else None,
+			postprocess=postprocessing(model_wrapper),
+			tuner=BatchTuner(model, BATCH_LATENCY_SLO, BATCH_SIZE, BATCH_TIMEOUT) if BATCH_AUTOTUNE == "true" else None,
+		)
+	return executors[key], batch_processors[key]
 
-batch_processors: Dict[str, BatchProcessor] = {}
-drift_detector: Dict[str, DriftDetector] = {}
+def postprocessing(model_wrapper):
+	# post-processing compiled from the model's mlm:output, None to return the raw outputs
+	if POSTPROCESSING != "true" or not model_wrapper.postprocessing.enabled:
+		return None
+	return model_wrapper.postprocessing
+
+async def predict_source(model, model_wrapper, source):
+	# run the model on a decoded raster, returns the outputs and the size to restore them to
+	check_deadline()  # expired requests are not decoded nor inferred
+	executor, processor = get_processor(model, model_wrapper)
+	# the executor is only shut down (e.g. when the model is evicted) once it is not used anymore
+	with executor.use():
+		assert source.ndim == 3, "Image must have 3 dimensions (bands, height, width)"
+		tasks = model_wrapper.props["mlm:output"]["tasks"]
+		if TILE_SIZE and tasks == ["segmentation"] and max(source.shape[1:]) > int(TILE_SIZE):
+			# large scenes are read and segmented tile by tile at full resolution
+			await track_drift(model, model_wrapper, source)
+			async def preprocess_tile(tile):
+				with stage("preprocess"):
+					tile, _ = await executor.preprocess(model_wrapper, tile, source.band_names)
+				return tile
+			outputs = await predict_tiled(
+				source,
+				predict=lambda tile: predict_cached(model, model_wrapper, processor, tile, postprocess=False),
+				preprocess=preprocess_tile,
+				tile_size=int(TILE_SIZE),
+				overlap=TILE_OVERLAP,
+				max_in_flight=TILES_IN_FLIGHT,
+			)
+			# tiles are blended before being post-processed (e.g. to class maps)
+			postprocess = postprocessing(model_wrapper)
+			if postprocess is not None:
+				with stage("postprocess"):
+					outputs = (await run_in_threadpool(postprocess, outputs[None]))[0]
+			return outputs, outputs.shape[-2:]
+		# load image in memory as numpy array
+		with stage("decode"):
+			image = await run_in_threadpool(source.read)
+		await track_drift(model, model_wrapper, image)
+		# pre-process (as defined in the model metadata) and validate input (off the event loop)
+		with stage("preprocess"):
+			image, original_size = await executor.preprocess(model_wrapper, image, source.band_names)
+		# execute model
+		# outputs = model.predict(image)
+		outputs = await predict_cached(model, model_wrapper, processor, image)
+		return outputs, original_size
+
+async def track_drift(model, model_wrapper, sample):
+	# hands a subsampled view of the input to the drift detector, statistics are computed in the background
+	if DRIFT_DETECTION != 'true':
+		return
+	key = (model, model_wrapper.version)
+	if key not in drift_detector:
+		drift_detector[key] = DriftDetector(
+			model,
+			window_size=DRIFT_WINDOW,
+			reference_path=f"{model_wrapper.download_path}/drift.v{model_wrapper.version}.json",
+			reference_size=DRIFT_REFERENCE_SAMPLES,
+			psi_threshold=DRIFT_PSI_THRESHOLD,
+		)
+	detector = drift_detector[key]
+	with stage("drift"):
+		view = None
+		if hasattr(sample, "thumbnail"):
+			# decimated read of a whole (tiled) scene, done in the threadpool
+			view = await run_in_threadpool(subsample, sample, detector.sample_size)
+		detector.add_sample(sample, view)
+
+async def predict_cached(model, model_wrapper, processor, image, postprocess=True):
+	timings = current_timings.get()
+	if timings is not None and timings.profile:
+		# profiled requests run on their own (profiling) session, outside of the batches
+		with stage("inference"):
+			outputs, events = await processor.executor.run(model_wrapper.profile, image)
+		timings.onnxruntime.extend(events)
+		if postprocess and postprocessing(model_wrapper) is not None:
+			with stage("postprocess"):
+				outputs = model_wrapper.postprocessing(outputs)
+		return outputs[0]
+	# repeated inputs are served from the result cache (if enabled) without running the model
+	if result_cache is None:
+		return await process_in_batch(image, processor, postprocess)
+	key = await run_in_threadpool(cache_key, model, model_wrapper.version, image, postprocess, model_wrapper.variant)
+	return await result_cache.get_or_compute(key, lambda: process_in_batch(image, processor, postprocess), model)
+
+def segmentation_mask(model_wrapper, outputs, original_size):
+	# only returns first output as image, class maps (see postprocessing) are already 2D
+	if outputs.ndim == 3:  # get first band
+		outputs = outputs[0]
+	with stage("postprocess"):
+		outputs = model_wrapper.pipeline.restore_size(outputs, original_size)
+	if outputs.dtype.kind != "f":
+		return outputs  # class values, upsampled with nearest neighbours
+	return outputs.astype("float32", copy=False)
+
+def classification_result(model_wrapper, outputs):
+	# top classes (with their names) if the model metadata lists them, the scores otherwise
+	if postprocessing(model_wrapper) is None:
+		return outputs.tolist()
+	return model_wrapper.postprocessing.labels(outputs, TOP_K)
+
+def write_mask(mask, profile, activated=False):
+	# `activated`: the post-processing already turned the logits into probabilities
+	with stage("encode"):
+		return cog_file(
+			mask,
+			profile=profile,
+			directory=DOWNLOAD_PATH,
+			quantization=COG_QUANTIZATION,
+			compress=COG_COMPRESSION,
+			activated=activated,
+		)
 
 @app.post("/{model}")
 @limiter.limit(RATE_LIMIT)
@@ -89,91 +372,337 @@ async def inference(
 	model: str, 
 	image: UploadFile = File(...), 
 	version: int = Form(None),
+	variant: str = Form(None),  # original, int8-dynamic, int8-static or fp16 (default MODEL_VARIANT)
 	api_key: str = Depends(verify_api_key)
 ):
 	# Implementation
 	try:
 		model_counter.labels(model=model).inc()
-		# download model from ETODL
-		# download_path, stac_df = download_model(model, DOWNLOAD_PATH, version)
-		model_wrapper = ModelWrapper(model, path=DOWNLOAD_PATH, version=version)
-		# initialize batch processor if not already initialized
-		if model not in batch_processors:
-			batch_processors[model] = BatchProcessor(
-				model=model_wrapper,
-				batch_size=BATCH_SIZE,
-				timeout=BATCH_TIMEOUT,
-			)
-		# load image in memory as numpy array
-		with rio.open(io.BytesIO(image.file.read())) as src:
-			image = src.read()
-		if DRIFT_DETECTION == 'true':
-			if model not in drift_detector:
-				drift_detector[model] = DriftDetector(model)
-			drift_detector[model].add_sample(image)
-		assert image.ndim == 3, "Image must have 3 dimensions (bands, height, width)"
-		# pre-process and validate input
-		image = model_wrapper.process_inputs(image)
-		# normalization
-		image = (
-			image / 255.0
-		)  # this should be defined in the model metadata (this is only for RGB will not work with satellite images)
-		# TODO: resize if necessary
-		# execute model
-		# outputs = model.predict(image)
-		outputs = await process_in_batch(
-			image,
-			batch_processors[model]
-		)
-		# return outputs
+		profiled = PROFILING == "true" and profiler.should_profile(model, profile_requested(request))
+		timings = start_timings(model, profile=profiled)
+		request_deadline(request, REQUEST_TIMEOUT, INTERACTIVE)
+		# get model from the registry (downloaded from EOTDL on first use)
+		with stage("load"):
+			model_wrapper = await run_in_threadpool(registry.get, model, version)
+			model_wrapper = model_wrapper.with_variant(variant)
+		executor, _ = get_processor(model, model_wrapper)
+		max_pixels = int(MAX_INPUT_PIXELS) if MAX_INPUT_PIXELS else None
+		with executor.admit(), ExitStack() as stack:
+			if is_tensor(image.filename, image.content_type):
+				# raw .npy tensors are used as they are, without decoding
+				with stage("upload"):
+					source = await run_in_threadpool(stack.enter_context, open_tensor(image.file, max_pixels))
+			else:
+				with stage("upload"):
+					path = await run_in_threadpool(stack.enter_context, spool_upload(image.file, DOWNLOAD_PATH))
+				with stage("open"):
+					source = await run_in_threadpool(stack.enter_context, open_raster(path, max_pixels))
+			profile = source.profile  # georeferencing of the outputs
+			outputs, original_size = await cancel_on_disconnect(request, predict_source(model, model_wrapper, source))
+		# return outputs (as a .npy tensor if the client accepts it)
+		tensor = NPY_MEDIA_TYPE in request.headers.get("accept", "")
 		if model_wrapper.props["mlm:output"]["tasks"] == ["classification"]:
-			return outputs.tolist()
-		elif model_wrapper.props["mlm:output"]["tasks"] == ["segmentation"]:  # only returns first output as image
+			with stage("encode"):
+				if tensor:
+					return Response(encode_tensor(outputs), media_type=NPY_MEDIA_TYPE, headers=timing_headers(timings))
+				outputs = classification_result(model_wrapper, outputs)
+			return JSONResponse(outputs, headers=timing_headers(timings))
+		elif model_wrapper.props["mlm:output"]["tasks"] == ["segmentation"]:
 			# return mask
-			# image = sigmoid(outputs) > 0.5  # this should be defined in the model metadata
-			if outputs.ndim == 3:  # get first band
-				outputs = outputs[0]
-			outputs = resize(outputs, model_wrapper.original_size, preserve_range=True)
-			# outputs = outputs.astype(np.uint8)
-			img = Image.fromarray(outputs, mode="F")  # only returns binary mask
-			buf = io.BytesIO()
-			img.save(buf, "tiff")
-			buf.seek(0)
-			return StreamingResponse(buf, media_type="image/tiff") # TODO: should be COG
+			mask = segmentation_mask(model_wrapper, outputs, original_size)
+			if tensor:
+				with stage("encode"):
+					return Response(encode_tensor(mask), media_type=NPY_MEDIA_TYPE, headers=timing_headers(timings))
+			path = await run_in_threadpool(write_mask, mask, profile, postprocessing(model_wrapper) is not None)
+			# removed however the response ends, even if the client goes away before the body is sent
+			return ReleasingStreamingResponse(
+				iter_file(path, remove=False),
+				media_type=COG_MEDIA_TYPE,
+				release=lambda: remove_file(path),
+				headers=timing_headers(timings),
+			)
 		else:
 			raise Exception(
-				"Output task not supported", model.props["mlm:output"]["tasks"]
+				"Output task not supported", model_wrapper.props["mlm:output"]["tasks"]
 			)
+	except InvalidDeadlineError as e:
+		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+	except InputTooLargeError as e:
+		logger.error(f"Error in inference: {e}")
+		raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+	except VariantNotFoundError as e:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+	except QueueFullError as e:
+		logger.error(f"Error in inference: {e}")
+		raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+	except DeadlineExceededError as e:
+		logger.error(f"Error in inference: {e}")
+		raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+	except ClientDisconnectedError as e:
+		logger.info(f"Inference cancelled: {e}")
+		raise HTTPException(status_code=499, detail=str(e))  # nobody reads it, as nginx's "client closed request"
 	except Exception as e:
 		logger.error(f"Error in inference: {e}")
 		traceback.print_exc()
 		model_error_counter.labels(model=model, error_type="inference").inc()
 		raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
 
-async def process_in_batch(image, processor: BatchProcessor):
-	# Create an event to wait for the result
-	result_event = asyncio.Event()
-	result_container = {"result": None}
-	# Callback function to be called when batch processing is done
-	async def on_result(result):
-		result_container["result"] = result
-		result_event.set()
-	# Add to batch processor
-	await processor.add_item(image, on_result)
-	# Wait for result
-	await result_event.wait()
-	return result_container["result"]
+def request_deadline(request, timeout=None, priority=INTERACTIVE, cap=None):
+	# deadline (X-Request-Timeout, in seconds) and priority class (X-Request-Priority) of a request,
+	# raises InvalidDeadlineError for malformed headers
+	return parse_deadline(
+		request.headers.get("X-Request-Timeout", timeout), request.headers.get("X-Request-Priority", priority), cap
+	)
+
+def timing_headers(timings):
+	headers = {"Server-Timing": timings.server_timing()}
+	if timings.profile:
+		profiler.save(timings)
+		headers["X-Profile-Id"] = timings.id
+	return headers
+
+@contextmanager
+def open_item(item):
+	# bulk items are uploaded files or paths/urls listed in a manifest
+	max_pixels = int(MAX_INPUT_PIXELS) if MAX_INPUT_PIXELS else None
+	if isinstance(item, str):
+		with open_raster(manifest_location(item, BULK_INPUT_ROOT, BULK_INPUT_URLS), max_pixels) as source:
+			yield source
+	elif is_tensor(item.filename, item.content_type):
+		with open_tensor(item.file, max_pixels) as source:
+			yield source
+	else:
+		with spool_upload(item.file, DOWNLOAD_PATH) as path, open_raster(path, max_pixels) as source:
+			yield source
+
+@app.post("/{model}/batch")
+@limiter.limit(RATE_LIMIT)
+async def bulk_inference(
+	request: Request,
+	model: str,
+	images: List[UploadFile] = File(None),
+	manifest: str = Form(None),  # JSON list of local paths (under BULK_INPUT_ROOT) or object store urls
+	version: int = Form(None),
+	variant: str = Form(None),
+	api_key: str = Depends(verify_api_key)
+):
+	# many images in one request, results are streamed as soon as each one is ready:
+	# NDJSON for classification, a tar of COGs for segmentation
+	try:
+		model_counter.labels(model=model).inc()
+		# the deadline (if any) is the whole request's, its items are batched after interactive requests
+		deadline = request_deadline(request, None, BULK, cap=BULK)  # bulk requests can not jump the queue
+		items = list(images or []) + (json.loads(manifest) if manifest else [])
+		if not items:
+			raise Exception("No images or manifest provided")
+		model_wrapper = (await run_in_threadpool(registry.get, model, version)).with_variant(variant)
+		executor, _ = get_processor(model, model_wrapper)
+		tasks = model_wrapper.props["mlm:output"]["tasks"]
+		if tasks not in (["classification"], ["segmentation"]):
+			raise Exception("Output task not supported", tasks)
+		executor.acquire()  # released once the response has been sent (see ReleasingStreamingResponse)
+	except InvalidDeadlineError as e:
+		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+	except VariantNotFoundError as e:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+	except QueueFullError as e:
+		logger.error(f"Error in bulk inference: {e}")
+		raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+	except Exception as e:
+		logger.error(f"Error in bulk inference: {e}")
+		model_error_counter.labels(model=model, error_type="inference").inc()
+		raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+	def item_name(index, item):
+		name = item if isinstance(item, str) else item.filename
+		return f"{index}_{os.path.basename(name or 'image')}"
+
+	async def run(item):
+		start_timings(model)
+		current_deadline.set(deadline)
+		with ExitStack() as stack:
+			# uploads are spooled and rasters opened off the event loop
+			source = await run_in_threadpool(stack.enter_context, open_item(item))
+			profile = source.profile
+			outputs, original_size = await predict_source(model, model_wrapper, source)
+		if tasks == ["classification"]:
+			return classification_result(model_wrapper, outputs)
+		mask = segmentation_mask(model_wrapper, outputs, original_size)
+		# masks of items cancelled while being written (the client went away) are removed once written
+		return await discard_on_cancel(
+			run_in_threadpool(write_mask, mask, profile, postprocessing(model_wrapper) is not None), remove_file
+		)
+
+	async def stream():
+		discard = remove_file if tasks == ["segmentation"] else None  # masks that were not sent
+		async for index, item, result, error in as_completed_bounded(items, run, BULK_CONCURRENCY, discard):
+			name = item_name(index, item)
+			if error is not None:
+				logger.error(f"Error in bulk inference of {name}: {error}")
+				model_error_counter.labels(model=model, error_type="inference").inc()
+				record = {"index": index, "name": name, "error": str(error)}
+				yield ndjson_line(record) if tasks == ["classification"] else tar_bytes(name + ".error.json", ndjson_line(record))
+			elif tasks == ["classification"]:
+				yield ndjson_line({"index": index, "name": name, "outputs": result})
+			else:
+				for chunk in tar_file(os.path.splitext(name)[0] + ".tif", result):
+					yield chunk
+		if tasks == ["segmentation"]:
+			yield tar_end()
+
+	media_type = "application/x-ndjson" if tasks == ["classification"] else "application/x-tar"
+	return ReleasingStreamingResponse(stream(), media_type=media_type, release=executor.release)
+
+class ReleasingStreamingResponse(StreamingResponse):
+	# calls release() however the response ends (e.g. to free a slot of the inference queue or remove
+	# a temporary file), including when the client disconnects before the stream starts (the generator
+	# never runs then)
+	def __init__(self, content, media_type, release, headers=None):
+		super().__init__(content, media_type=media_type, headers=headers)
+		self.release = release
+
+	async def __call__(self, scope, receive, send):
+		try:
+			await super().__call__(scope, receive, send)
+		finally:
+			self.release()
+
+async def process_job(job):
+	# run a queued job, returns the path and media type of its result
+	model = job["model"]
+	model_counter.labels(model=model).inc()
+	start_timings(model)
+	start_deadline(priority=BULK)
+	model_wrapper = await run_in_threadpool(registry.get, model, job["version"])
+	tasks = model_wrapper.props["mlm:output"]["tasks"]
+	if tasks not in (["classification"], ["segmentation"]):
+		raise Exception("Output task not supported", tasks)
+	max_pixels = int(MAX_INPUT_PIXELS) if MAX_INPUT_PIXELS else None
+	with ExitStack() as stack:
+		source = await run_in_threadpool(stack.enter_context, open_raster(job["input_path"], max_pixels))
+		profile = source.profile
+		outputs, original_size = await predict_source(model, model_wrapper, source)
+	job_path = os.path.dirname(job["input_path"])
+	if tasks == ["classification"]:
+		path = job_path + "/result.json"
+		with open(path, "w") as f:
+			json.dump(classification_result(model_wrapper, outputs), f)
+		media_type = "application/json"
+	else:
+		mask = segmentation_mask(model_wrapper, outputs, original_size)
+		path = job_path + "/result.tif"
+		shutil.move(await run_in_threadpool(write_mask, mask, profile, postprocessing(model_wrapper) is not None), path)
+		media_type = COG_MEDIA_TYPE
+	os.remove(job["input_path"])
+	return path, media_type
+
+def job_status(job):
+	return {key: job[key] for key in ("id", "model", "version", "status", "error", "created_at", "updated_at")}
+
+@app.post("/{model}/jobs", status_code=status.HTTP_202_ACCEPTED)
+@limiter.limit(RATE_LIMIT)
+async def submit_job(
+	request: Request,
+	model: str,
+	image: UploadFile = File(...),
+	version: int = Form(None),
+	api_key: str = Depends(verify_api_key)
+):
+	# long running inferences (e.g. large scenes) are queued and processed by a worker,
+	# poll GET /jobs/{id} and download the result from GET /jobs/{id}/result
+	try:
+		queue = get_job_queue()
+		job = queue.new_job(model, version)
+		with open(job["input_path"], "wb") as f:
+			await run_in_threadpool(shutil.copyfileobj, image.file, f)
+		job = await run_in_threadpool(queue.submit, job)
+		return job_status(job)
+	except Exception as e:
+		logger.error(f"Error in submit_job: {e}")
+		raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@app.get("/jobs/{job_id}")
+async def retrieve_job(job_id: str, api_key: str = Depends(verify_api_key)):
+	job = await run_in_threadpool(get_job_queue().get, job_id)
+	if job is None:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+	return job_status(job)
+
+@app.get("/jobs/{job_id}/result")
+async def retrieve_job_result(job_id: str, api_key: str = Depends(verify_api_key)):
+	job = await run_in_threadpool(get_job_queue().get, job_id)
+	if job is None:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+	if job["status"] != DONE:
+		raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job['status']}")
+	if not os.path.exists(job["result_path"]):
+		# removed by the cleanup (JOBS_TTL) since the job was read
+		raise HTTPException(status_code=status.HTTP_410_GONE, detail="Job result expired")
+	return FileResponse(job["result_path"], media_type=job["media_type"])
+
+async def process_in_batch(image, processor: BatchProcessor, postprocess=True):
+	# wait for the batch containing the image to be processed
+	return await processor.submit(image, postprocess=postprocess)
+
+@app.post("/admin/profile/{model}")
+async def arm_profiler(model: str, count: int = 1, api_key: str = Depends(verify_api_key)):
+	# profile the next `count` requests of a model
+	if PROFILING != "true":
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profiling is disabled")
+	profiler.arm(model, count)
+	return {"model": model, "armed": profiler.armed[model]}
+
+@app.get("/admin/profiles")
+async def list_profiles(api_key: str = Depends(verify_api_key)):
+	return [{"id": profile["id"], "model": profile["model"]} for profile in profiler.profiles.values()]
+
+@app.get("/admin/profiles/{profile_id}")
+async def retrieve_profile(profile_id: str, api_key: str = Depends(verify_api_key)):
+	profile = profiler.get(profile_id)
+	if profile is None:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+	return profile
+
+def model_metadata(model, version):
+	# resolved from the metadata cache, not the registry: loading (or touching) a model only to
+	# describe it would evict (or keep) the models being served
+	metadata = get_metadata_cache(DOWNLOAD_PATH)
+	info = metadata.get(model)
+	versions = [v["version_id"] for v in info["versions"]]
+	if version is None:
+		version = max(versions)
+	elif version not in versions:
+		raise Exception(f"Version {version} not found")
+	path = metadata.catalog_path(model, version)
+
+	def items():
+		if os.path.exists(path):
+			return read_items(path)
+		# not downloaded yet, only its catalog is fetched (the model is downloaded when it is used)
+		gdf, error = retrieve_model_catalog(info["id"], version)
+		if error:
+			raise Exception(error)
+		buffer = io.BytesIO()
+		gdf.to_parquet(buffer)
+		buffer.seek(0)
+		return read_items(buffer)
+	return model_items.get(path, items)
 
 @app.get("/{model}")
 async def retrieve_model_metadata(
+	request: Request,
 	model: str, 
 	version: int = None,
 	api_key: str = Depends(verify_api_key)
 ):
+	# STAC items, encoded once per catalog, clients revalidate them with If-None-Match
 	try:
-		model = ModelWrapper(model, path=DOWNLOAD_PATH, version=version)
-		return model.items()
+		body, etag = await run_in_threadpool(model_metadata, model, version)
 	except Exception as e:
 		logger.error(f"Error in retrieve_model_metadata: {e}")
 		traceback.print_exc()
 		raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+	headers = {"ETag": etag, "Cache-Control": f"max-age={METADATA_MAX_AGE}, must-revalidate"}
+	if etag_matches(request.headers.get("if-none-match"), etag):
+		return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+	return Response(body, media_type="application/json", headers=headers)
@@ -0,0 +1,77 @@
+# Builds optimized variants of a model and compares them with the original one.
+#
+#   python -m api.optimize EuroSAT-RGB-Q2 --variants int8-dynamic,int8-static,fp16 --samples examples/samples
+#
+# The model is downloaded to EOTDL_DOWNLOAD_PATH (if needed) and its variants are written next to
+# it, where the API finds them (MODEL_VARIANT, or the variant form field of a request). The report
+# gives the latency of each variant on the sample images, and how far its outputs are from the
+# original model's (errors, and agreement of the predicted classes or mask pixels).
+import os
+import sys
+import json
+import argparse
+
+from api.src.eotdl_wrapper import ModelWrapper
+from api.src.variants import ORIGINAL, VARIANTS, build_variant, compare_variants, sample_paths, load_samples
+
+DOWNLOAD_PATH = os.getenv("EOTDL_DOWNLOAD_PATH", "/tmp")
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples", "samples")
+
+
+def optimize(model, version=None, variants=VARIANTS, samples=SAMPLES, runs=5, path=DOWNLOAD_PATH, max_pixels=None):
+	wrapper = ModelWrapper(model, version=version, path=path, verbose=False, variant=ORIGINAL)
+	inputs = load_samples(wrapper, sample_paths(samples), max_pixels)
+	if not inputs:
+		raise Exception(f"No usable samples for {model} in {samples}")
+	built = []
+	for variant in variants:
+		if variant == ORIGINAL:
+			continue
+		try:
+			build_variant(wrapper.model_path, variant, calibration=inputs)
+			built.append(variant)
+		except Exception as e:
+			print(f"Could not build the {variant} variant of {model}: {e}", file=sys.stderr)
+	return {
+		"model": model,
+		"version": wrapper.version,
+		"samples": len(inputs),
+		"runs": runs,
+		"variants": compare_variants(wrapper, built, inputs, runs),
+	}
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Build and compare quantized/FP16 variants of a model.")
+	parser.add_argument("model")
+	parser.add_argument("--version", type=int, default=None)
+	parser.add_argument("--variants", default=",".join(VARIANTS))
+	parser.add_argument("--samples", default=SAMPLES, help="directory of sample images (calibration and comparison)")
+	parser.add_argument("--runs", type=int, default=5, help="timed runs over the samples")
+	parser.add_argument("--max-pixels", type=int, default=4096 * 4096, help="skip larger samples")
+	parser.add_argument("--output", default=None, help="write the JSON report here (default stdout)")
+	args = parser.parse_args(argv)
+
+	report = optimize(
+		args.model,
+		args.version,
+		[variant for variant in args.variants.split(",") if variant],
+		args.samples,
+		args.runs,
+		max_pixels=args.max_pixels,
+	)
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=2)
+	else:
+		print(json.dumps(report, indent=2))
+	for variant, result in report["variants"].items():
+		summary = f"{variant}: {result['mean_ms']:.2f}ms"
+		if variant != ORIGINAL:
+			summary += f" ({result['speedup']:.2f}x), agreement {result['agreement']:.2%}, max error {result['max_abs_error']:.4f}"
+		print(summary, file=sys.stderr)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
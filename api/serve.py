@@ -0,0 +1,81 @@
+# Multi-worker server: several API worker processes sharing the models and their batches.
+#
+#   WORKERS=4 PRELOAD_MODELS=EuroSAT-RGB-Q2 SHARED_WEIGHTS=true python -m api.serve
+#
+# The parent process downloads the preloaded models once (and, with SHARED_WEIGHTS, moves their
+# weights to files onnxruntime memory-maps, so every process shares the same pages) before forking.
+# Inference runs in a single batching process listening on a unix socket (BATCH_SERVER): the API
+# workers decode and preprocess requests, and batches are filled with the requests of all of them.
+import os
+import asyncio
+import tempfile
+import multiprocessing
+
+from api.src.registry import parse_model_list
+
+DOWNLOAD_PATH = os.getenv("EOTDL_DOWNLOAD_PATH", "/tmp")
+WORKERS = int(os.getenv("WORKERS", os.cpu_count() or 1))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+BATCH_SERVER = os.getenv("BATCH_SERVER", f"{tempfile.gettempdir()}/ml-inference-{os.getpid()}.sock")
+SHARED_WEIGHTS = os.getenv("SHARED_WEIGHTS", "false")
+
+
+def prepare_models(models):
+	# download the models (and share their weights) before any worker needs them
+	from api.src.eotdl_wrapper import ModelWrapper
+	from api.src.session import share_weights
+
+	for model, version in models:
+		wrapper = ModelWrapper(model, path=DOWNLOAD_PATH, version=version)
+		if SHARED_WEIGHTS == "true":
+			share_weights(wrapper.model_path)
+
+
+def batch_server(path):
+	os.environ.pop("BATCH_SERVER", None)  # this process runs the models itself
+	from fastapi.concurrency import run_in_threadpool
+	from api import main
+	from api.src.batch_server import serve
+
+	async def get_processor(model, version, variant=None):
+		wrapper = await run_in_threadpool(main.registry.get, model, version)
+		return main.get_processor(model, wrapper.with_variant(variant))[1]
+
+	models = parse_model_list(main.PRELOAD_MODELS)
+	if models:
+		main.registry.preload(models)
+	asyncio.run(serve(path, get_processor))
+
+
+def wait_for(path, process, timeout=600):
+	for _ in range(int(timeout * 10)):
+		if os.path.exists(path):
+			return
+		if not process.is_alive():
+			raise RuntimeError("The batching process exited")
+		process.join(0.1)
+	raise RuntimeError(f"The batching process is not listening on {path}")
+
+
+def main():
+	import uvicorn
+
+	prepare_models(parse_model_list(os.getenv("PRELOAD_MODELS", "")))
+	if os.path.exists(BATCH_SERVER):
+		os.remove(BATCH_SERVER)
+	server = multiprocessing.get_context("spawn").Process(target=batch_server, args=(BATCH_SERVER,), name="batch-server")
+	server.start()
+	try:
+		wait_for(BATCH_SERVER, server)
+		os.environ["BATCH_SERVER"] = BATCH_SERVER  # inherited by the API workers
+		uvicorn.run("api.main:app", host=HOST, port=PORT, workers=WORKERS)
+	finally:
+		server.terminate()
+		server.join()
+		if os.path.exists(BATCH_SERVER):
+			os.remove(BATCH_SERVER)
+
+
+if __name__ == "__main__":
+	main()
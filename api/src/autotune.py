@@ -0,0 +1,117 @@
+import time
+import math
+from collections import deque
+import numpy as np
+
+from .metrics import model_batch_target_size, model_batch_target_timeout, model_arrival_rate, model_batch_latency_p95
+
+
+class BatchTuner:
+	# Chooses the batch size and flush deadline of a model's BatchProcessor from what it observes:
+	# the arrival rate of requests, the inference time of each batch size and the latency (batching
+	# wait + inference) of recent requests.
+	#
+	# The target is the smallest batch size that keeps up with the arrival rate while its fill time
+	# plus inference time stays under the p95 latency `slo`. When no batch size keeps up (overload),
+	# it is the one with the highest throughput whose inference fits in the SLO. The flush deadline
+	# leaves time for the inference within the SLO, and is halved while the observed p95 exceeds it.
+	def __init__(
+		self,
+		model,
+		slo: float,
+		max_batch_size: int,
+		max_timeout: float,
+		min_timeout: float = 0.001,
+		interval: float = 1.0,  # seconds between adjustments
+		horizon: float = 10.0,  # seconds of arrivals used for the rate
+		window: int = 512,  # recent request latencies used for the p95
+		headroom: float = 1.2,  # capacity kept above the arrival rate
+	):
+		self.model = model
+		self.slo = slo
+		self.max_batch_size = max_batch_size
+		self.max_timeout = max_timeout
+		self.min_timeout = min_timeout
+		self.interval = interval
+		self.horizon = horizon
+		self.headroom = headroom
+		self.arrivals = deque()
+		self.latencies = deque(maxlen=window)
+		self.costs = {}  # batch size -> moving average of its inference time
+		self.scale = 1.0  # flush deadline multiplier, lowered while the SLO is missed
+		self.batch_size = 1
+		self.timeout = min_timeout
+		self.updated_at = -math.inf  # first update as soon as a batch was measured
+
+	def record_arrival(self, now=None):
+		self.arrivals.append(time.monotonic() if now is None else now)
+
+	def record_batch(self, size, seconds, alpha=0.2):
+		previous = self.costs.get(size)
+		self.costs[size] = seconds if previous is None else previous + alpha * (seconds - previous)
+
+	def record_latency(self, seconds):
+		self.latencies.append(seconds)
+
+	def arrival_rate(self, now):
+		while self.arrivals and self.arrivals[0] < now - self.horizon:
+			self.arrivals.popleft()
+		if not self.arrivals:
+			return 0.0
+		return len(self.arrivals) / max(now - self.arrivals[0], self.interval)
+
+	def cost(self, size):
+		# inference time of a batch size, interpolated (least squares line) from the observed ones
+		if size in self.costs:
+			return self.costs[size]
+		sizes = np.array(list(self.costs), dtype=np.float64)
+		times = np.array(list(self.costs.values()))
+		if len(sizes) == 1:
+			# a single batch size observed: assume half of its time is a fixed cost, so larger
+			# batches get tried (and measured)
+			return times[0] * (0.5 + 0.5 * size / sizes[0])
+		slope, intercept = np.polyfit(sizes, times, 1)
+		slope = max(slope, 0.0)
+		return max(intercept, 0.0) + slope * size
+
+	def p95(self):
+		return float(np.percentile(self.latencies, 95)) if self.latencies else None
+
+	def update(self, now=None):
+		# returns True when the targets were recomputed (at most every `interval` seconds)
+		now = time.monotonic() if now is None else now
+		if now - self.updated_at < self.interval or not self.costs:
+			return False
+		self.updated_at = now
+		rate = self.arrival_rate(now)
+		p95 = self.p95()
+		best, best_capacity = None, 0.0
+		for size in range(1, self.max_batch_size + 1):
+			cost = self.cost(size)
+			fill = (size - 1) / rate if rate > 0 else (0.0 if size == 1 else math.inf)
+			if cost > self.slo or fill > self.max_timeout or fill + cost > self.slo:
+				continue
+			capacity = size / max(cost, 1e-9)
+			if capacity >= rate * self.headroom:
+				best = size  # the smallest batch keeping up, lowest latency
+				break
+			if capacity > best_capacity:
+				best, best_capacity = size, capacity
+		if best is None:  # overloaded, maximize throughput within the SLO
+			fitting = [size for size in range(1, self.max_batch_size + 1) if self.cost(size) <= self.slo] or [1]
+			best = max(fitting, key=lambda size: size / max(self.cost(size), 1e-9))
+		if p95 is not None and p95 > self.slo:
+			self.scale = max(self.scale / 2, 0.05)
+		else:
+			self.scale = min(self.scale * 1.25, 1.0)
+		fill = (best - 1) / rate if rate > 0 else 0.0
+		timeout = min(self.slo - self.cost(best), 2 * fill + self.min_timeout) * self.scale
+		self.batch_size = best
+		self.timeout = min(max(timeout, self.min_timeout), self.max_timeout)
+		self.latencies.clear()
+		model_batch_target_size.labels(model=self.model).set(self.batch_size)
+		model_batch_target_timeout.labels(model=self.model).set(self.timeout)
+		model_arrival_rate.labels(model=self.model).set(rate)
+		if p95 is not None:
+			model_batch_latency_p95.labels(model=self.model).set(p95)
+		return True
@@ -1,63 +1,320 @@
+import time
 import asyncio
+from collections import deque
 import numpy as np
 
-from .metrics import model_inference_duration, model_inference_batch_size, model_inference_timeout
+from .metrics import (
+	model_inference_duration,
+	model_inference_batch_size,
+	model_inference_timeout,
+	model_batch_queue_depth,
+	model_batch_fill_ratio,
+	model_batch_wait_time,
+	model_requests_dropped,
+)
+from .timing import current_timings
+from .deadlines import current_deadline, DeadlineExceededError
+
+
+class BatchRequest:
+	def __init__(self, data, deadline, future, postprocess=True):
+		self.data = data
+		self.postprocess = postprocess
+		self.shape = data.shape
+		self.deadline = deadline
+		self.future = future
+		self.enqueued_at = time.monotonic()
+		self.timings = current_timings.get()  # stages of the request that submitted it, if any
+		request_deadline = current_deadline.get()  # time limit and priority class of the request, if any
+		self.expires_at = None if request_deadline is None else request_deadline.expires_at
+		self.priority = 0 if request_deadline is None else request_deadline.rank
+
+	def expired(self, now):
+		return self.expires_at is not None and self.expires_at <= now
+
 
 class BatchProcessor:
+	# Groups requests by (dtype, shape) so only compatible inputs are batched together.
+	# With `pad_to`, spatial dims are padded up to a multiple of it so nearby sizes share a bucket.
+	# A bucket is flushed when it is full or when its oldest request reaches its latency budget.
+	# Requests with a deadline (see deadlines.py) are refused when the queue ahead of them cannot be
+	# processed in time, and dropped if they expire (or their client goes away) before being batched.
+	# Interactive requests are batched before bulk ones.
+	# `postprocess` (e.g. the model's Postprocessing) runs once on the outputs of the whole batch.
+	# With a `tuner` (BatchTuner), `batch_size` and `timeout` are upper bounds and the tuner picks the
+	# current targets from the observed arrival rate, batch inference times and request latencies.
 	def __init__(
 		self,
 		model,
+		executor = None,
 		batch_size: int = 16,
-		timeout: float = 0.2,  # 200ms
-		drift_detector = None
+		timeout: float = 0.2,  # default latency budget, 200ms
+		pad_to: int = None,
+		buffers = None,
+		drift_detector = None,
+		postprocess = None,
+		tuner = None,
 	):
 		self.model = model
+		self.executor = executor
+		self.max_batch_size = batch_size  # size of the batch buffers
 		self.batch_size = batch_size
 		self.timeout = timeout
-		self.processing = False
-		self.batches = []
-		self.batch_timer = None
+		self.tuner = tuner
+		if tuner is not None:
+			self.batch_size, self.timeout = tuner.batch_size, tuner.timeout
+		self.pad_to = pad_to
+		self.buffers = buffers  # optional BufferPool for batch inputs/outputs
+		self.postprocess = postprocess
+		self.inference_time = None  # moving average of the batch inference time
+		# batches wait in their buckets (where they can still be dropped or reordered) until the
+		# executor has a free inference slot
+		self.max_in_flight = None if executor is None else executor.max_workers
+		self.in_flight = 0
+		self.buckets = {}  # (dtype, shape) -> deque of BatchRequest
+		self.scheduler = None
+		self.wakeup = None
+		self.loop = None
+
+	async def submit(self, item, budget: float = None, postprocess: bool = True):
+		# item is a single sample with a leading batch dimension of 1, `postprocess=False` returns the
+		# raw model outputs (e.g. tiles blended before being post-processed)
+		if self.executor is not None:
+			with self.executor.use():  # its model may be evicted while the request waits
+				return await self._submit(item, budget, postprocess)
+		return await self._submit(item, budget, postprocess)
+
+	async def _submit(self, item, budget, postprocess):
+		self._ensure_scheduler()
+		future = self.loop.create_future()
+		now = time.monotonic()
+		request = BatchRequest(item, now + (self.timeout if budget is None else budget), future, postprocess)
+		if request.expires_at is not None:
+			self._admit(request, now)
+		if self.tuner is not None:
+			self.tuner.record_arrival()
+		self.buckets.setdefault(self.bucket_key(item), deque()).append(request)
+		self._report_depth()
+		self.wakeup.set()
+		try:
+			return await future
+		except asyncio.CancelledError:
+			self.wakeup.set()  # the client went away, free its slot in the bucket
+			raise
 
-		
 	async def add_item(self, item, callback):
-		# add item to batch
-		request_data = {
-			"data": item,
-			"callback": callback,
-		}
-		last_batch = self.batches[-1] if self.batches else None
-		if last_batch and len(last_batch) < self.batch_size:
-			last_batch.append(request_data)
-			# print(f"Added item to last batch. Current size: {len(last_batch)}/{self.batch_size}", flush=True)
-		else:
-			self.batches.append([request_data])
-			if self.batch_timer is None:
-				self.batch_timer = asyncio.create_task(self._timeout_handler())
-			# print(f"Started new batch. Current size: {len(self.batches)}/{self.batch_size}", flush=True)
-		# check if we need to process the batch
-		first_batch = self.batches[0]
-		if len(first_batch) == self.batch_size:
-			model_inference_batch_size.labels(model=self.model.model_name).set(self.batch_size)
-			if self.batch_timer:
-				self.batch_timer.cancel()
-				self.batch_timer = None
-			await self.process_batch()
-
-	async def _timeout_handler(self):
-		await asyncio.sleep(self.timeout)
-		if self.batches:  # Only process if there are batches waiting
-			# print(f"Timeout reached, processing incomplete batch of size {len(self.batches[0])}", flush=True)
-			model_inference_timeout.labels(model=self.model.model_name).inc()
-			await self.process_batch()
-		self.batch_timer = None
-		
-	async def process_batch(self):
-		current_batch = self.batches.pop(0)
-		# Prepare batch data
-		batch_data = np.concatenate([item["data"] for item in current_batch], axis=0)
-		with model_inference_duration.labels(model=self.model.model_name).time():
-			batch_results = self.model.predict(batch_data)
+		# callback based interface, kept for backwards compatibility
+		result = await self.submit(item)
+		await callback(result)
+
+	def bucket_key(self, item):
+		shape = item.shape[1:]
+		if self.pad_to and item.ndim >= 3:
+			shape = (*shape[:-2], *[self.pad_to * -(-dim // self.pad_to) for dim in shape[-2:]])
+		return (item.dtype.str, shape)
+
+	def queue_depth(self):
+		return sum(len(bucket) for bucket in self.buckets.values())
+
+	def estimate(self):
+		# expected time until the result of a new request: the full batches queued ahead of it, then its own
+		if self.inference_time is None:
+			return 0.0
+		ahead = self.queue_depth() // self.batch_size + (0 if self._has_slot() else 1)
+		return self.inference_time * (1 + ahead / (self.max_in_flight or 1))
+
+	def _admit(self, request, now):
+		# refuse requests that cannot finish before their deadline, flush the others in time for it
+		remaining, estimate = request.expires_at - now, self.estimate()
+		if remaining <= 0 or remaining < estimate:
+			reason = "expired" if remaining <= 0 else "shed"
+			model_requests_dropped.labels(model=self.model.model_name, reason=reason).inc()
+			raise DeadlineExceededError(
+				f"Request cannot complete within its deadline ({max(remaining, 0) * 1000:.0f}ms left, about {estimate * 1000:.0f}ms needed)"
+			)
+		request.deadline = min(request.deadline, request.expires_at - (self.inference_time or 0.0))
+
+	def _drop_abandoned(self, requests, now):
+		# requests whose client went away (cancelled future) or whose deadline passed are not inferred
+		for request in [request for request in requests if request.future.done() or request.expired(now)]:
+			requests.remove(request)
+			if request.future.done():
+				reason = "cancelled"
+			else:
+				reason = "expired"
+				request.future.set_exception(DeadlineExceededError("Request deadline exceeded while waiting for a batch"))
+			model_requests_dropped.labels(model=self.model.model_name, reason=reason).inc()
+
+	def _ensure_scheduler(self):
+		loop = asyncio.get_running_loop()
+		if self.scheduler is None or self.scheduler.done() or self.loop is not loop:
+			self.loop = loop
+			self.wakeup = asyncio.Event()
+			self.in_flight = 0  # batches of a previous event loop never complete
+			self.scheduler = loop.create_task(self._schedule())
+
+	async def _schedule(self):
+		while True:
+			now = time.monotonic()
+			if self.tuner is not None and self.tuner.update(now):
+				self.batch_size, self.timeout = self.tuner.batch_size, self.tuner.timeout
+			next_deadline = None
+			for key in list(self.buckets):
+				bucket = self.buckets[key]
+				self._drop_abandoned(bucket, now)
+				while len(bucket) >= self.batch_size and self._has_slot():
+					self._dispatch(key, bucket, timed_out=False)
+				if bucket and self._has_slot() and min(request.deadline for request in bucket) <= now:
+					self._dispatch(key, bucket, timed_out=True)
+				if not bucket:
+					del self.buckets[key]
+					continue
+				if self._has_slot():
+					deadline = min(request.deadline for request in bucket)
+				else:  # woken up when a batch completes, or to drop the next expiring request
+					deadline = min((request.expires_at for request in bucket if request.expires_at is not None), default=None)
+				if deadline is not None and (next_deadline is None or deadline < next_deadline):
+					next_deadline = deadline
+			self._report_depth()
+			self.wakeup.clear()
+			timeout = None if next_deadline is None else max(next_deadline - time.monotonic(), 0)
+			try:
+				await asyncio.wait_for(self.wakeup.wait(), timeout)
+			except asyncio.TimeoutError:
+				pass
+
+	def _dispatch(self, key, bucket, timed_out):
+		batch = self._take(bucket)
+		model_name = self.model.model_name
+		if timed_out:
+			model_inference_timeout.labels(model=model_name).inc()
+		model_inference_batch_size.labels(model=model_name).set(len(batch))
+		model_batch_fill_ratio.labels(model=model_name).observe(len(batch) / self.batch_size)
+		now = time.monotonic()
+		for request in batch:
+			model_batch_wait_time.labels(model=model_name).observe(now - request.enqueued_at)
+			if request.timings is not None:
+				request.timings.add("batch_wait", now - request.enqueued_at)
+		self.in_flight += 1
+		self.loop.create_task(self._run_batch(key, batch))
+
+	def _has_slot(self):
+		return self.max_in_flight is None or self.in_flight < self.max_in_flight
+
+	async def _run_batch(self, key, batch):
+		try:
+			await self.process_batch(key, batch)
+		finally:
+			self.in_flight -= 1
+			self.wakeup.set()
+
+	def _take(self, bucket):
+		# the most urgent requests first: interactive before bulk, then the earliest flush deadlines
+		size = min(self.batch_size, len(bucket))
+		if size < len(bucket) and any(request.priority != bucket[0].priority for request in bucket):
+			ordered = sorted(bucket, key=lambda request: (request.priority, request.deadline))
+			bucket.clear()
+			bucket.extend(ordered[size:])
+			return ordered[:size]
+		return [bucket.popleft() for _ in range(size)]
+
+	async def process_batch(self, key, batch):
+		batch = list(batch)
+		self._drop_abandoned(batch, time.monotonic())
+		if not batch:
+			return
+		buffers = []
+		try:
+			batch_data = self._stack(key, batch, buffers)
+			out = self._output_buffer(batch_data, buffers)
+			start = time.perf_counter()
+			batch_results = await self._predict(batch_data, out)
+			duration = time.perf_counter() - start
+			processed = None
+			if self.postprocess is not None and any(request.postprocess for request in batch):
+				processed = await self._postprocess(batch_results)
+				postprocess_duration = time.perf_counter() - start - duration
+		except Exception as e:
+			self._release(buffers)
+			if len(batch) == 1:
+				batch[0].future.set_exception(e)
+				return
+			# retry one by one so a bad request only fails its own future
+			for request in batch:
+				await self.process_batch(key, [request])
+			return
+		self.inference_time = duration if self.inference_time is None else 0.8 * self.inference_time + 0.2 * duration
+		if self.tuner is not None:
+			self.tuner.record_batch(len(batch), duration)
+			now = time.monotonic()
+			for request in batch:
+				self.tuner.record_latency(now - request.enqueued_at)
 		# Distribute results
-		for idx, item in enumerate(current_batch):
-			await item["callback"](batch_results[idx])
-		
\ No newline at end of file
+		for idx, request in enumerate(batch):
+			if not request.future.done():
+				postprocessed = processed is not None and request.postprocess
+				result = self._crop((processed if postprocessed else batch_results)[idx], request.shape, key[1])
+				if out is not None and not postprocessed:
+					result = result.copy()  # the output buffer is reused by the next batch
+				if request.timings is not None:
+					request.timings.add("inference", duration, start)
+					if postprocessed:
+						request.timings.add("postprocess", postprocess_duration, start + duration)
+				request.future.set_result(result)
+		self._release(buffers)
+
+	async def _predict(self, batch_data, out=None):
+		with model_inference_duration.labels(model=self.model.model_name).time():
+			if self.executor is not None:  # run inference off the event loop
+				return await self.executor.predict(self.model, batch_data, out)
+			return self.model.predict(*((batch_data,) if out is None else (batch_data, out)))
+
+	async def _postprocess(self, batch_results):
+		if self.executor is None:
+			return self.postprocess(batch_results)
+		# vectorized numpy, off the event loop without taking an inference slot
+		return await asyncio.get_running_loop().run_in_executor(None, self.postprocess, batch_results)
+
+	def _stack(self, key, batch, buffers):
+		dtype, shape = key
+		exact = all(request.shape[1:] == shape for request in batch)
+		if self.buffers is None:
+			if exact:
+				return np.concatenate([request.data for request in batch], axis=0)
+			batch_data = np.zeros((len(batch), *shape), dtype=np.dtype(dtype))
+		else:
+			# copy each request into its slot of a reusable batch buffer
+			buffer = self.buffers.acquire((self.max_batch_size, *shape), dtype)
+			buffers.append(buffer)
+			batch_data = buffer[:len(batch)]
+		for idx, request in enumerate(batch):
+			if request.shape[1:] == shape:
+				batch_data[idx] = request.data[0]
+			else:
+				h, w = request.shape[-2:]
+				batch_data[idx] = 0
+				batch_data[idx, ..., :h, :w] = request.data[0]
+		return batch_data
+
+	def _output_buffer(self, batch_data, buffers):
+		if self.buffers is None or self.executor is not None and self.executor.kind == "process":
+			return None
+		shape = self.model.output_shape(batch_data.shape)
+		if shape is None:  # not known in advance, let onnxruntime allocate it
+			return None
+		buffer = self.buffers.acquire((self.max_batch_size, *shape[1:]), self.model.output_dtype)
+		buffers.append(buffer)
+		return buffer[:batch_data.shape[0]]
+
+	def _release(self, buffers):
+		for buffer in buffers:
+			self.buffers.release(buffer)
+
+	def _crop(self, result, shape, padded_shape):
+		# remove the padding from spatial outputs (e.g. segmentation masks)
+		if shape[1:] != padded_shape and result.ndim >= 2 and result.shape[-2:] == padded_shape[-2:]:
+			return result[..., :shape[-2], :shape[-1]]
+		return result
+
+	def _report_depth(self):
+		model_batch_queue_depth.labels(model=self.model.model_name).set(self.queue_depth())
@@ -0,0 +1,104 @@
+import io
+import os
+import json
+import struct
+import asyncio
+import logging
+
+from .decode import read_npy, encode_tensor, InputTooLargeError
+from .timing import start_timings, current_timings
+from .deadlines import start_deadline, current_deadline, DeadlineExceededError, ClientDisconnectedError, INTERACTIVE
+from .executor import QueueFullError
+from .variants import VariantNotFoundError
+
+logger = logging.getLogger(__name__)
+
+# errors raised again with their type by the API workers, so they get the same status codes as in a
+# single process (e.g. 503 when the queue is full), other errors are plain exceptions
+REMOTE_ERRORS = {
+	error.__name__: error for error in (DeadlineExceededError, ClientDisconnectedError, QueueFullError, InputTooLargeError, VariantNotFoundError)
+}
+
+# messages are a JSON header followed by an optional .npy payload
+PREFIX = struct.Struct("!II")  # header size, payload size
+
+
+async def read_message(reader):
+	header_size, payload_size = PREFIX.unpack(await reader.readexactly(PREFIX.size))
+	header = json.loads(await reader.readexactly(header_size))
+	payload = await reader.readexactly(payload_size)
+	return header, payload
+
+
+def write_message(writer, header, payload=b""):
+	header = json.dumps(header).encode()
+	writer.write(PREFIX.pack(len(header), len(payload)) + header)
+	writer.write(payload)
+
+
+async def serve(path, get_processor):
+	# Shared batching process: the API workers send their preprocessed inputs to this unix socket,
+	# so requests from all the workers are packed into the same batches (one request per connection).
+	# get_processor(model, version, variant) is a coroutine function returning the model's BatchProcessor.
+	async def handle(reader, writer):
+		try:
+			header, payload = await read_message(reader)
+			timings = start_timings(header["model"])
+			start_deadline(header.get("deadline"), header.get("priority", INTERACTIVE))
+			try:
+				processor = await get_processor(header["model"], header["version"], header.get("variant"))
+				submit = asyncio.ensure_future(
+					processor.submit(read_npy(io.BytesIO(payload)), header.get("budget"), header.get("postprocess", True))
+				)
+				# the worker closes the connection when its client disconnects, drop the request then
+				closed = asyncio.ensure_future(reader.read(1))
+				await asyncio.wait({submit, closed}, return_when=asyncio.FIRST_COMPLETED)
+				closed.cancel()
+				if not submit.done():
+					submit.cancel()
+					return
+				write_message(writer, {"stages": timings.totals()}, encode_tensor(submit.result()))
+			except Exception as e:
+				logger.error(f"Error in batch server: {e}")
+				write_message(writer, {"error": str(e), "type": type(e).__name__})
+			await writer.drain()
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass  # the worker went away
+		finally:
+			writer.close()
+
+	if os.path.exists(path):
+		os.remove(path)
+	server = await asyncio.start_unix_server(handle, path)
+	async with server:
+		await server.serve_forever()
+
+
+class RemoteProcessor:
+	# BatchProcessor interface for the API workers, batches run in the shared batching process
+	def __init__(self, path, model, version, executor=None, variant=None):
+		self.path = path
+		self.model = model
+		self.version = version
+		self.executor = executor
+		self.variant = variant
+
+	async def submit(self, item, budget: float = None, postprocess: bool = True):
+		reader, writer = await asyncio.open_unix_connection(self.path)
+		try:
+			header = {"model": self.model, "version": self.version, "variant": self.variant, "budget": budget, "postprocess": postprocess}
+			deadline = current_deadline.get()
+			if deadline is not None:
+				header.update({"deadline": deadline.remaining(), "priority": deadline.priority})
+			write_message(writer, header, encode_tensor(item))
+			await writer.drain()
+			header, payload = await read_message(reader)
+		finally:
+			writer.close()
+		if "error" in header:
+			raise REMOTE_ERRORS.get(header.get("type"), Exception)(header["error"])
+		timings = current_timings.get()
+		if timings is not None:  # batch_wait and inference, measured by the batching process
+			for stage, seconds in header["stages"].items():
+				timings.add(stage, seconds)
+		return read_npy(io.BytesIO(payload))
@@ -0,0 +1,23 @@
+from collections import defaultdict
+import numpy as np
+
+
+class BufferPool:
+	# Reusable arrays keyed by (shape, dtype), so batches do not allocate new inputs/outputs every time.
+	def __init__(self, max_free: int = 2):
+		self.max_free = max_free  # free buffers kept per key, roughly the number of concurrent batches
+		self.free = defaultdict(list)
+
+	def acquire(self, shape, dtype):
+		key = (tuple(shape), np.dtype(dtype).str)
+		if self.free[key]:
+			return self.free[key].pop()
+		return np.empty(shape, dtype=dtype)
+
+	def release(self, buffer):
+		key = (buffer.shape, buffer.dtype.str)
+		if len(self.free[key]) < self.max_free:
+			self.free[key].append(buffer)
+
+	def nbytes(self):
+		return sum(buffer.nbytes for buffers in self.free.values() for buffer in buffers)
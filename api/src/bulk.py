@@ -0,0 +1,123 @@
+import os
+import json
+import asyncio
+import tarfile
+from urllib.parse import urlsplit
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def discard_result(task, discard):
+	# calls discard(result) for a task that completed successfully, e.g. to remove its output file
+	if not task.cancelled() and task.exception() is None:
+		discard(task.result())
+
+
+async def discard_on_cancel(awaitable, discard):
+	# awaits `awaitable` (e.g. a file written in a thread, which can not be interrupted). If the caller
+	# is cancelled first, the result is passed to discard(result) once it is ready.
+	task = asyncio.ensure_future(awaitable)
+	try:
+		return await asyncio.shield(task)
+	except asyncio.CancelledError:
+		task.add_done_callback(lambda task: discard_result(task, discard))
+		raise
+
+
+async def as_completed_bounded(items, run, concurrency=4, discard=None):
+	# run(item) for each (index, item) with at most `concurrency` in flight, yielding results as they
+	# complete so memory stays bounded whatever the number of items. If the consumer stops early, the
+	# results it did not get are passed to discard(result) (e.g. to remove their files).
+	pending, done = set(), []
+	items = iter(enumerate(items))
+
+	async def run_item(index, item):
+		try:
+			return index, item, await run(item), None
+		except Exception as e:
+			return index, item, None, e
+
+	try:
+		for index, item in items:
+			pending.add(asyncio.ensure_future(run_item(index, item)))
+			if len(pending) >= concurrency:
+				finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+				done = list(finished)
+				while done:
+					yield done.pop().result()
+		while pending:
+			finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+			done = list(finished)
+			while done:
+				yield done.pop().result()
+	finally:
+		# the client went away, stop the remaining work
+		for task in pending:
+			task.cancel()
+		if discard is not None:
+			for task in done:
+				_, _, result, error = task.result()
+				if error is None:
+					discard(result)
+
+
+def ndjson_line(record):
+	return (json.dumps(record) + "\n").encode()
+
+
+def parse_locations(value):
+	# "s3://bucket,https://data.example.com" -> {("s3", "bucket"), ("https", "data.example.com")}
+	locations = set()
+	for entry in (value or "").split(","):
+		entry = entry.strip()
+		if entry:
+			url = urlsplit(entry)
+			locations.add((url.scheme.lower(), url.netloc.lower()))
+	return locations
+
+
+def manifest_location(item, root=None, allowed=()):
+	# path or url a manifest item may be read from: local paths under `root`, or urls on one of the
+	# `allowed` (scheme, host) locations. GDAL virtual paths (/vsi...) and file:// urls are rejected,
+	# they can reach any local file or host.
+	if item.startswith("/vsi") or "://" in item:
+		url = urlsplit(item)
+		if item.startswith("/vsi") or url.scheme.lower() == "file" or (url.scheme.lower(), url.netloc.lower()) not in allowed:
+			raise Exception(f"Location not allowed: {item}")
+		return item
+	root = os.path.realpath(root) if root else None
+	path = os.path.realpath(os.path.join(root or "", item))
+	if root is None or not path.startswith(root + os.sep):
+		raise Exception(f"Local path not allowed: {item}")
+	return path
+
+
+def tar_header(name, size):
+	info = tarfile.TarInfo(name)
+	info.size = size
+	return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def tar_padding(size):
+	return b"\0" * (-size % BLOCK_SIZE)
+
+
+def tar_bytes(name, data):
+	return tar_header(name, len(data)) + data + tar_padding(len(data))
+
+
+def tar_file(name, path, chunk_size=1024 * 1024):
+	# stream a file on disk as a tar member and remove it once sent
+	size = os.path.getsize(path)
+	try:
+		yield tar_header(name, size)
+		with open(path, "rb") as f:
+			while chunk := f.read(chunk_size):
+				yield chunk
+		yield tar_padding(size)
+	finally:
+		os.remove(path)
+
+
+def tar_end():
+	return b"\0" * (2 * BLOCK_SIZE)
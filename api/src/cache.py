@@ -0,0 +1,142 @@
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from .metrics import result_cache_hits, result_cache_misses, result_cache_evictions
+from .deadlines import DeadlineExceededError, ClientDisconnectedError
+from .executor import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# errors of the request running the inference rather than of the inference itself, requests
+# waiting for the same result run it themselves instead
+REQUEST_ERRORS = (DeadlineExceededError, ClientDisconnectedError, QueueFullError)
+
+
+def cache_key(model, version, x, postprocess=True, variant="original"):
+	# hash of the model and its (preprocessed) input, so identical inputs share results
+	h = hashlib.sha256(f"{model}:{version}:{variant}:{postprocess}:{x.dtype.str}:{x.shape}".encode())
+	h.update(np.ascontiguousarray(x).data)
+	return h.hexdigest()
+
+
+class ResultCache:
+	# Model outputs keyed by `cache_key`. The most recently used ones are kept in memory up to
+	# `max_bytes`; with `path`, they are also written to disk (up to `max_disk_bytes`) so they survive
+	# evictions and restarts. Concurrent requests for the same key wait for a single inference.
+	def __init__(self, max_bytes: int, path: str = None, max_disk_bytes: int = None):
+		self.max_bytes = max_bytes
+		self.path = path
+		self.max_disk_bytes = max_disk_bytes
+		self.entries = OrderedDict()  # key -> array, LRU order
+		self.nbytes = 0
+		self.pending = {}  # key -> future of the inference in flight
+		self.disk = OrderedDict()  # key -> file size, LRU order
+		self.disk_nbytes = 0
+		self.disk_lock = threading.Lock()
+		if path is not None:
+			os.makedirs(path, exist_ok=True)
+			self._scan()
+
+	async def get_or_compute(self, key, compute, model):
+		# compute() is a coroutine function returning the result for `key`
+		result = self.entries.get(key)
+		if result is not None:
+			self.entries.move_to_end(key)
+			result_cache_hits.labels(model=model, tier="memory").inc()
+			return result
+		if key in self.pending:
+			pending = self.pending[key]
+			try:
+				result = await asyncio.shield(pending)
+				result_cache_hits.labels(model=model, tier="coalesced").inc()
+				return result
+			except asyncio.CancelledError:
+				if not pending.cancelled():
+					raise
+				# the request running the inference went away (or failed on its own), run it ourselves
+				return await self.get_or_compute(key, compute, model)
+		future = asyncio.get_running_loop().create_future()
+		self.pending[key] = future
+		try:
+			result = await run_in_threadpool(self._read, key) if self.path is not None else None
+			if result is not None:
+				result_cache_hits.labels(model=model, tier="disk").inc()
+			else:
+				result_cache_misses.labels(model=model).inc()
+				result = await compute()
+				if self.path is not None:
+					await run_in_threadpool(self._write, key, result)
+			result = self._put(key, result)
+			future.set_result(result)
+			return result
+		except (asyncio.CancelledError, *REQUEST_ERRORS):
+			future.cancel()
+			raise
+		except Exception as e:
+			future.set_exception(e)
+			future.exception()  # retrieved, do not warn if nobody else was waiting
+			raise
+		finally:
+			del self.pending[key]
+
+	def _put(self, key, result):
+		result = np.array(result)  # own copy, read only since it is shared between requests
+		result.setflags(write=False)
+		if result.nbytes > self.max_bytes:
+			return result
+		self.entries[key] = result
+		self.nbytes += result.nbytes
+		while self.nbytes > self.max_bytes:
+			_, evicted = self.entries.popitem(last=False)
+			self.nbytes -= evicted.nbytes
+			result_cache_evictions.labels(tier="memory").inc()
+		return result
+
+	def _file(self, key):
+		return f"{self.path}/{key}.npy"
+
+	def _scan(self):
+		files = [entry for entry in os.scandir(self.path) if entry.name.endswith(".npy")]
+		for entry in sorted(files, key=lambda entry: entry.stat().st_atime):
+			self.disk[entry.name[:-4]] = entry.stat().st_size
+			self.disk_nbytes += entry.stat().st_size
+
+	def _read(self, key):
+		with self.disk_lock:
+			if key not in self.disk:
+				return None
+			self.disk.move_to_end(key)
+		try:
+			return np.load(self._file(key))
+		except (OSError, ValueError) as e:
+			logger.warning(f"Could not read cached result {key}: {e}")
+			return None
+
+	def _write(self, key, result):
+		# write to a temporary file first so readers never see partial results
+		fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.path)
+		with os.fdopen(fd, "wb") as f:
+			np.save(f, result)
+		size = os.path.getsize(tmp)
+		if self.max_disk_bytes is not None and size > self.max_disk_bytes:
+			os.remove(tmp)
+			return
+		os.replace(tmp, self._file(key))
+		with self.disk_lock:
+			self.disk_nbytes += size - self.disk.pop(key, 0)
+			self.disk[key] = size
+			while self.max_disk_bytes is not None and self.disk_nbytes > self.max_disk_bytes:
+				evicted, evicted_size = self.disk.popitem(last=False)
+				self.disk_nbytes -= evicted_size
+				result_cache_evictions.labels(tier="disk").inc()
+				try:
+					os.remove(self._file(evicted))
+				except FileNotFoundError:
+					pass
@@ -0,0 +1,96 @@
+import math
+import time
+import asyncio
+import contextvars
+
+current_deadline = contextvars.ContextVar("deadline", default=None)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = {INTERACTIVE: 0, BULK: 1}  # lower is batched first
+
+
+class DeadlineExceededError(Exception):
+	pass
+
+
+class ClientDisconnectedError(Exception):
+	pass
+
+
+class InvalidDeadlineError(ValueError):
+	pass
+
+
+class Deadline:
+	# Time limit and priority class of a request (or bulk item / job). Requests that expire while
+	# queued are dropped before being batched, and those that cannot finish in time are refused.
+	def __init__(self, timeout: float = None, priority: str = INTERACTIVE):
+		if priority not in PRIORITIES:
+			raise ValueError(f"Priority not supported: {priority}, use one of {', '.join(PRIORITIES)}")
+		self.expires_at = None if timeout is None else time.monotonic() + timeout  # time.monotonic()
+		self.priority = priority
+
+	@property
+	def rank(self):
+		return PRIORITIES[self.priority]
+
+	def remaining(self, now=None):
+		if self.expires_at is None:
+			return None
+		return self.expires_at - (time.monotonic() if now is None else now)
+
+	def expired(self, now=None):
+		return self.expires_at is not None and self.remaining(now) <= 0
+
+	def check(self):
+		if self.expired():
+			raise DeadlineExceededError("Request deadline exceeded")
+
+
+def start_deadline(timeout=None, priority=INTERACTIVE):
+	# deadline of the current request (or bulk item / job), picked up by the BatchProcessor
+	deadline = Deadline(timeout, priority)
+	current_deadline.set(deadline)
+	return deadline
+
+
+def parse_deadline(timeout=None, priority=INTERACTIVE, cap=None):
+	# deadline from client supplied values (e.g. request headers), started for the current request.
+	# `cap` is the highest priority class allowed, higher ones are lowered to it
+	if timeout is not None and timeout != "":
+		try:
+			timeout = float(timeout)
+		except ValueError:
+			raise InvalidDeadlineError(f"Invalid request timeout: {timeout}")
+		if not (math.isfinite(timeout) and timeout > 0):
+			raise InvalidDeadlineError(f"Request timeout must be a positive number of seconds, got {timeout}")
+	else:
+		timeout = None
+	if priority not in PRIORITIES:
+		raise InvalidDeadlineError(f"Priority not supported: {priority}, use one of {', '.join(PRIORITIES)}")
+	if cap is not None and PRIORITIES[priority] < PRIORITIES[cap]:
+		priority = cap
+	return start_deadline(timeout, priority)
+
+
+def check_deadline():
+	deadline = current_deadline.get()
+	if deadline is not None:
+		deadline.check()
+
+
+async def cancel_on_disconnect(request, coroutine, interval: float = 0.1):
+	# awaits the coroutine, cancelling it (and so removing its inputs from the batching queue) if the
+	# client of `request` disconnects first
+	task = asyncio.ensure_future(coroutine)
+	try:
+		while True:
+			done, _ = await asyncio.wait({task}, timeout=interval)
+			if done:
+				return task.result()
+			if await request.is_disconnected():
+				raise ClientDisconnectedError("Client disconnected")
+	finally:
+		if not task.done():
+			task.cancel()
@@ -0,0 +1,146 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+
+NPY_MEDIA_TYPE = "application/x-npy"
+
+
+class InputTooLargeError(Exception):
+	pass
+
+
+def check_size(height, width, max_pixels=None):
+	# reject oversized inputs before decoding them
+	if max_pixels is not None and height * width > max_pixels:
+		raise InputTooLargeError(
+			f"Input of {height}x{width} pixels exceeds the maximum of {max_pixels} pixels"
+		)
+
+
+@contextmanager
+def spool_upload(file, directory=None):
+	# yields a path to the uploaded file without reading it into memory
+	rolled = getattr(file, "_rolled", False)
+	if rolled and os.path.exists(f"/dev/fd/{file.fileno()}"):
+		# the upload was already spooled to an (anonymous) temporary file on disk
+		file.flush()
+		yield f"/dev/fd/{file.fileno()}"
+		return
+	file.seek(0)
+	with tempfile.NamedTemporaryFile(dir=directory) as tmp:
+		shutil.copyfileobj(file, tmp, length=1024 * 1024)
+		tmp.flush()
+		yield tmp.name
+
+
+class RasterSource:
+	# Lazy (bands, height, width) view of a raster, slicing it reads only the requested window.
+	# Reads run in threads (off the event loop) and are serialized, rasterio datasets are not
+	# thread-safe.
+	def __init__(self, src):
+		self.src = src
+		self.lock = threading.Lock()
+		self.shape = (src.count, src.height, src.width)
+		self.ndim = 3
+		self.dtype = src.dtypes[0]
+		self.profile = src.profile
+		self.band_names = src.descriptions
+
+	def read(self):
+		with self.lock:
+			return self.src.read()
+
+	def thumbnail(self, max_size):
+		# decimated read (from the overviews, if any) no larger than max_size, e.g. for statistics
+		step = max(1, -(-max(self.shape[1:]) // max_size))
+		with self.lock:
+			return self.src.read(out_shape=(self.shape[0], max(1, self.shape[1] // step), max(1, self.shape[2] // step)))
+
+	def __getitem__(self, index):
+		bands, rows, cols = index
+		assert bands == slice(None), "Only spatial windows are supported"
+		row_start, row_stop, _ = rows.indices(self.shape[1])
+		col_start, col_stop, _ = cols.indices(self.shape[2])
+		from rasterio.windows import Window
+		window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+		with self.lock:
+			return self.src.read(window=window)
+
+
+@contextmanager
+def open_raster(path, max_pixels=None):
+	import rasterio as rio  # imported on first use (or by the warmup), not at startup
+	with rio.open(path) as src:
+		check_size(src.height, src.width, max_pixels)
+		yield RasterSource(src)
+
+
+def is_tensor(filename=None, content_type=None):
+	return content_type == NPY_MEDIA_TYPE or (filename or "").endswith(".npy")
+
+
+class ArraySource:
+	# (bands, height, width) array with the interface of RasterSource, for raw tensor inputs
+	def __init__(self, array):
+		self.array = array
+		self.shape = array.shape
+		self.ndim = array.ndim
+		self.dtype = array.dtype
+		self.profile = None  # not georeferenced
+		self.band_names = (None,) * array.shape[0]
+
+	def read(self):
+		return self.array
+
+	def __getitem__(self, index):
+		return self.array[index]
+
+
+def read_npy(file, check_shape=None):
+	# .npy data as an array wrapping the bytes read from `file`, without extra copies.
+	# `check_shape(shape)` can validate (and reshape) it before the data is read.
+	file.seek(0)
+	version = np.lib.format.read_magic(file)
+	if version == (1, 0):
+		shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+	elif version == (2, 0):
+		shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+	else:
+		raise ValueError(f"npy format version not supported: {version}")
+	if dtype.hasobject:
+		raise ValueError("npy arrays of objects are not supported")
+	if check_shape is not None:
+		shape = check_shape(shape)
+	count = int(np.prod(shape))
+	array = np.frombuffer(file.read(count * dtype.itemsize), dtype=dtype, count=count)
+	return array.reshape(shape, order="F" if fortran_order else "C")
+
+
+def read_tensor(file, max_pixels=None):
+	# .npy upload as a (bands, height, width) image, its size is checked before the data is read
+	def check_shape(shape):
+		if len(shape) == 2:
+			shape = (1, *shape)
+		if len(shape) != 3:
+			raise ValueError(f"Tensor must have 3 dimensions (bands, height, width), found {len(shape)}")
+		check_size(*shape[1:], max_pixels)
+		return shape
+	return read_npy(file, check_shape)
+
+
+@contextmanager
+def open_tensor(file, max_pixels=None):
+	yield ArraySource(read_tensor(file, max_pixels))
+
+
+def encode_tensor(array):
+	# .npy bytes of an array
+	array = np.ascontiguousarray(array)
+	header = io.BytesIO()
+	np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(array))
+	return header.getvalue() + array.tobytes()
@@ -1,6 +1,13 @@
+import os
+import json
+import queue
+import logging
+import threading
 import numpy as np
 import prometheus_client
 
+logger = logging.getLogger(__name__)
+
 # we assume all samples will be tif images with 3 dimensions (bands, height, width)
 
 dimension_gauges = {
@@ -21,55 +28,271 @@ dimension_gauges = {
 	)
 }
 
+band_gauges = {
+	'psi': prometheus_client.Gauge(
+		'input_band_psi',
+		'Population stability index of the pixel values of a band against the reference profile',
+		labelnames=["model", "band"]
+	),
+	'ks': prometheus_client.Gauge(
+		'input_band_ks',
+		'Kolmogorov-Smirnov statistic of the pixel values of a band against the reference profile',
+		labelnames=["model", "band"]
+	),
+	'mean': prometheus_client.Gauge(
+		'input_band_mean',
+		'Mean pixel value of a band',
+		labelnames=["model", "band"]
+	),
+	'std': prometheus_client.Gauge(
+		'input_band_std',
+		'Standard deviation of the pixel values of a band',
+		labelnames=["model", "band"]
+	),
+}
+
+drift_samples_dropped = prometheus_client.Counter(
+	'input_drift_samples_dropped_total',
+	'Number of samples skipped by the drift detector because it was busy',
+	labelnames=["model"]
+)
+
+
+def subsample(sample, max_size=64):
+	# small (bands, h, w) view of an image: decimated read of a raster source, strided view of an array
+	height, width = sample.shape[1:]
+	if hasattr(sample, "thumbnail"):
+		return sample.thumbnail(max_size)
+	step = max(1, -(-max(height, width) // max_size))
+	return np.array(sample[:, ::step, ::step])  # own copy, the input may be reused
+
+
+class BandStats:
+	# Per band running moments and fixed-bin histograms, O(bands * bins) memory whatever the samples.
+	def __init__(self, bands, edges):
+		self.edges = np.asarray(edges, dtype=np.float64)
+		self.bins = len(self.edges) - 1
+		self.count = np.zeros(bands)
+		self.mean = np.zeros(bands)
+		self.m2 = np.zeros(bands)
+		self.histograms = np.zeros((bands, self.bins))
+
+	@property
+	def bands(self):
+		return len(self.count)
+
+	def update(self, x):
+		# x is (bands, ...) pixel values, non-finite values are ignored
+		x = x.reshape(self.bands, -1).astype(np.float64, copy=False)
+		valid = np.isfinite(x)
+		n = valid.sum(axis=1)
+		if not n.any():
+			return
+		values = np.where(valid, x, 0)
+		mean = values.sum(axis=1) / np.maximum(n, 1)
+		m2 = (np.where(valid, x - mean[:, None], 0) ** 2).sum(axis=1)
+		# merge with the running moments (Chan et al.)
+		total = self.count + n
+		delta = mean - self.mean
+		with np.errstate(invalid="ignore", divide="ignore"):
+			self.mean = np.where(total > 0, self.mean + delta * n / np.maximum(total, 1), 0)
+			self.m2 = self.m2 + m2 + delta ** 2 * self.count * n / np.maximum(total, 1)
+		self.count = total
+		# values outside of the edges are counted in the first/last bins
+		index = np.clip(np.searchsorted(self.edges, values, side="right") - 1, 0, self.bins - 1)
+		index += np.arange(self.bands)[:, None] * self.bins
+		self.histograms += np.bincount(
+			index.ravel(), weights=valid.ravel(), minlength=self.bands * self.bins
+		).reshape(self.bands, self.bins)
+
+	@property
+	def std(self):
+		return np.sqrt(self.m2 / np.maximum(self.count, 1))
+
+	def to_dict(self):
+		return {
+			"edges": self.edges.tolist(),
+			"count": self.count.tolist(),
+			"mean": self.mean.tolist(),
+			"std": self.std.tolist(),
+			"histograms": self.histograms.tolist(),
+		}
+
+	@classmethod
+	def from_dict(cls, data):
+		histograms = np.asarray(data["histograms"], dtype=np.float64)
+		stats = cls(len(histograms), data["edges"])
+		stats.histograms = histograms
+		stats.count = np.asarray(data["count"], dtype=np.float64)
+		stats.mean = np.asarray(data["mean"], dtype=np.float64)
+		stats.m2 = np.asarray(data["std"], dtype=np.float64) ** 2 * stats.count
+		return stats
+
+
+def default_edges(sample, bins=64):
+	# fixed bins covering the range of the data type, or of the first sample for floats
+	dtype = np.dtype(sample.dtype)
+	if np.issubdtype(dtype, np.integer):
+		info = np.iinfo(dtype)
+		low, high = info.min, info.max + 1
+		if dtype.itemsize > 1:
+			bins = 256
+	else:
+		finite = sample[np.isfinite(sample)]
+		low, high = (float(finite.min()), float(finite.max())) if finite.size else (0.0, 1.0)
+		margin = (high - low) * 0.1 or 1.0
+		low, high = low - margin, high + margin
+	return np.linspace(low, high, bins + 1)
+
+
+def psi(reference, current, eps=1e-4):
+	# population stability index between two sets of histograms (one row per band)
+	p = reference / np.maximum(reference.sum(axis=1, keepdims=True), 1) + eps
+	q = current / np.maximum(current.sum(axis=1, keepdims=True), 1) + eps
+	return ((q - p) * np.log(q / p)).sum(axis=1)
+
+
+def ks(reference, current):
+	# Kolmogorov-Smirnov statistic computed on the binned distributions
+	p = np.cumsum(reference, axis=1) / np.maximum(reference.sum(axis=1, keepdims=True), 1)
+	q = np.cumsum(current, axis=1) / np.maximum(current.sum(axis=1, keepdims=True), 1)
+	return np.abs(p - q).max(axis=1)
+
+
 class DriftDetector:
-	def __init__(self, model, window_size=10):
+	# Compares the pixel distribution of recent inputs with a reference profile, band by band.
+	# Requests only hand over a small subsampled view of their input; statistics are updated in a
+	# background thread (samples are dropped when it falls behind). The reference profile is read
+	# from `reference_path` (next to the model catalog), or built from the first
+	# `reference_size` samples and saved there.
+	def __init__(
+		self,
+		model,
+		window_size=50,
+		reference_path=None,
+		reference_size=100,
+		sample_size=64,
+		psi_threshold=0.2,
+		queue_size=8,
+	):
 		self.model = model
 		self.window_size = window_size
-		self.current_window = []
+		self.reference_path = reference_path
+		self.reference_size = reference_size
+		self.sample_size = sample_size
+		self.psi_threshold = psi_threshold
+		self.reference = None
+		self.window = None  # BandStats of the current window
+		self.samples = 0
+		self.dimensions = np.zeros(3)
 		self.drift_metrics = {}
 		self.dimension_thresholds = {
 			'bands': 100,
 			'height': 10000,  # Adjust these thresholds based on your needs
 			'width': 10000
 		}
+		if reference_path is not None and os.path.exists(reference_path):
+			with open(reference_path) as f:
+				self.reference = BandStats.from_dict(json.load(f))
+		self.queue = queue.Queue(maxsize=queue_size)
+		self.thread = threading.Thread(target=self._run, name=f"drift-{model}", daemon=True)
+		self.thread.start()
 
-	def add_sample(self, sample):
-		self.current_window.append(sample)
-		if len(self.current_window) > self.window_size:
-			self.compute_drift()	
+	def add_sample(self, sample, view=None):
+		# called on the request path, `sample` is a (bands, height, width) array or raster source.
+		# `view` is its subsampled view if it was already read (e.g. off the event loop)
+		if view is None:
+			view = subsample(sample, self.sample_size)
+		try:
+			self.queue.put_nowait((sample.shape, view))
+		except queue.Full:
+			drift_samples_dropped.labels(model=self.model).inc()
+
+	def flush(self):
+		# wait for the queued samples to be processed
+		self.queue.join()
+
+	def close(self):
+		self.queue.put(None)
+
+	def _run(self):
+		while True:
+			item = self.queue.get()
+			try:
+				if item is None:
+					return
+				self.update(*item)
+			except Exception as e:
+				logger.error(f"Error in drift detection for {self.model}: {e}")
+			finally:
+				self.queue.task_done()
+
+	def update(self, shape, view):
+		self.dimensions += shape
+		self.samples += 1
+		if self.reference is None:
+			# first samples build the reference profile
+			if self.window is None:
+				self.window = BandStats(view.shape[0], default_edges(view))
+			if view.shape[0] == self.window.bands:
+				self.window.update(view)
+			if self.samples >= self.reference_size:
+				self.reference, self.window = self.window, None
+				self.save_reference()
+				self.reset()
+			return
+		if self.window is None:
+			self.window = BandStats(self.reference.bands, self.reference.edges)
+		if view.shape[0] == self.window.bands:  # inputs with other bands only count in the dimensions
+			self.window.update(view)
+		if self.samples >= self.window_size:
+			self.compute_drift()
 			self.report_drift()
 			self.alerts()
-			self.current_window = []
-					 
+			self.reset()
+
+	def reset(self):
+		self.window = None
+		self.samples = 0
+		self.dimensions = np.zeros(3)
+
+	def save_reference(self):
+		if self.reference_path is None:
+			return
+		tmp = self.reference_path + ".part"
+		with open(tmp, "w") as f:
+			json.dump(self.reference.to_dict(), f)
+		os.replace(tmp, self.reference_path)
+
 	def compute_drift(self):
-		# Initialize lists for each dimension
-		dimensions = {
-			'bands': [],
-			'height': [],
-			'width': []
-		}
-		
-		# Collect dimensions from all samples in the window
-		for sample in self.current_window:
-			shape = np.array(sample).shape
-			dimensions['bands'].append(shape[0])    # First dimension for bands
-			dimensions['height'].append(shape[1])   # Second dimension for height
-			dimensions['width'].append(shape[2])    # Third dimension for width
-		
-		# Store computed means in drift metrics
+		# mean input dimensions of the window
 		self.drift_metrics = {
-			dim_name: np.mean(sizes) 
-			for dim_name, sizes in dimensions.items()
+			dim_name: mean_size
+			for dim_name, mean_size in zip(['bands', 'height', 'width'], self.dimensions / self.samples)
 		}
+		if self.window is not None and self.window.count.any():
+			self.drift_metrics.update({
+				'psi': psi(self.reference.histograms, self.window.histograms),
+				'ks': ks(self.reference.histograms, self.window.histograms),
+				'mean': self.window.mean,
+				'std': self.window.std,
+			})
 
 	def report_drift(self):
-		# Report dimension metrics to Prometheus
-		for dim_name, mean_size in self.drift_metrics.items():
-			dimension_gauges[dim_name].labels(model=self.model).set(mean_size)
+		# Report dimension and band metrics to Prometheus
+		for dim_name, gauge in dimension_gauges.items():
+			gauge.labels(model=self.model).set(self.drift_metrics[dim_name])
+		for metric, gauge in band_gauges.items():
+			for band, value in enumerate(self.drift_metrics.get(metric, [])):
+				gauge.labels(model=self.model, band=str(band)).set(value)
 
 	def alerts(self):
-		for dim_name, mean_size in self.drift_metrics.items():
-			threshold = self.dimension_thresholds[dim_name]
+		for dim_name, threshold in self.dimension_thresholds.items():
+			mean_size = self.drift_metrics[dim_name]
 			if mean_size > threshold:
 				print(f"⚠️ WARNING: {dim_name} mean size ({mean_size:.1f}) "
 					  f"exceeds threshold of {threshold} ❗")
+		for band, value in enumerate(self.drift_metrics.get('psi', [])):
+			if value > self.psi_threshold:
+				print(f"⚠️ WARNING: band {band} of {self.model} drifted (PSI {value:.3f}) "
+					  f"exceeds threshold of {self.psi_threshold} ❗")
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import numpy as np
+
+from .utils import sigmoid
+
+COG_MEDIA_TYPE = "image/tiff; application=geotiff; profile=cloud-optimized"
+
+
+def quantize(outputs, mode=None, activated=False):
+	# float logits (or probabilities, if `activated` by the post-processing) -> uint8 probabilities
+	# (0-255) or binary classes (0/1)
+	if mode is None or outputs.dtype.kind in "iu":  # already class values
+		return outputs
+	probabilities = outputs if activated else sigmoid(outputs)
+	if mode == "probability":
+		return np.round(probabilities * 255).astype(np.uint8)
+	if mode == "class":
+		return (probabilities > 0.5).astype(np.uint8)
+	raise ValueError(f"Quantization mode not supported: {mode}")
+
+
+def write_cog(outputs, path, profile=None, compress="DEFLATE", blocksize=512):
+	# write a (height, width) or (bands, height, width) array as a tiled COG with internal overviews,
+	# keeping the georeferencing of the input (if any)
+	if outputs.ndim == 2:
+		outputs = outputs[None]
+	count, height, width = outputs.shape
+	georef = {}
+	if profile is not None and profile.get("crs") is not None:
+		georef = {"crs": profile["crs"], "transform": profile["transform"]}
+	import rasterio as rio
+	integer = np.issubdtype(outputs.dtype, np.integer)
+	with rio.open(
+		path,
+		"w",
+		driver="COG",
+		width=width,
+		height=height,
+		count=count,
+		dtype=outputs.dtype,
+		compress=compress,
+		predictor=2 if integer else 3,
+		blocksize=blocksize,
+		overview_resampling="nearest" if integer else "average",
+		**georef,
+	) as dst:
+		dst.write(outputs)
+	return path
+
+
+def remove_file(path):
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
+
+
+def iter_file(path, chunk_size=1024 * 1024, remove=True):
+	# stream a file in chunks, removing it once it has been sent
+	try:
+		with open(path, "rb") as f:
+			while chunk := f.read(chunk_size):
+				yield chunk
+	finally:
+		if remove:
+			os.remove(path)
+
+
+def cog_file(outputs, profile=None, directory=None, quantization=None, compress="DEFLATE", activated=False):
+	# write the outputs to a temporary COG and return its path
+	outputs = quantize(outputs, quantization, activated)
+	fd, path = tempfile.mkstemp(suffix=".tif", dir=directory)
+	os.close(fd)
+	try:
+		write_cog(outputs, path, profile=profile, compress=compress)
+	except Exception:
+		os.remove(path)
+		raise
+	return path
+
+
+def encode_cog(outputs, profile=None, directory=None, quantization=None, compress="DEFLATE", activated=False):
+	return iter_file(cog_file(outputs, profile, directory, quantization, compress, activated))
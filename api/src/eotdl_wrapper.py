@@ -5,26 +5,46 @@
 # https://github.com/earthpulse/eotdl/blob/main/eotdl/eotdl/wrappers/models.py
 
 import os 
+import json
+import shutil
+import tempfile
 from pathlib import Path
 from tqdm import tqdm
 import numpy as np
-import onnxruntime as ort
-from skimage.transform import resize
-import geopandas as gpd
-import pyarrow.parquet as pq
-import stac_geoparquet
 
-from .utils import retrieve_model, retrieve_model_catalog, download_file_url
+from .utils import retrieve_model_catalog, download_files
+from .metadata import get_metadata_cache
+from .preprocessing import Pipeline
+from .postprocessing import Postprocessing
+from .session import create_session, session_config
+from .variants import ORIGINAL, MODEL_VARIANTS_BUILD, VariantNotFoundError, VARIANT_CALIBRATION, variant_path, build_variant, sample_paths, load_samples
+
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 4))
+
+ONNX_DTYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+    "tensor(uint8)": np.uint8,
+}
 
 class ModelWrapper:
-    def __init__(self, model_name, version=None, path=None, force=False, assets=True, verbose=True):
+    def __init__(self, model_name, version=None, path=None, force=False, assets=True, verbose=True, variant=None):
         self.model_name = model_name
         self.version = version
+        # served variant of the model (see variants.py), the deployment's default when None
+        self.variant = variant or session_config(model_name).get("variant") or ORIGINAL
         self.path = path
         self.force = force
         self.assets = assets
         self.verbose = verbose
         self.ready = False
+        self.session = None
+        self.output_shapes = {}
+        self.default_variant = self.variant
+        self.variants = {self.variant: self}
         self.setup()
 
     def setup(self):
@@ -37,29 +57,130 @@ class ModelWrapper:
         assert gdf["mlm:framework"].iloc[0] == "ONNX", "Only ONNX models are supported, found " + gdf["mlm:framework"].iloc[0]
         self.model_path = download_path + '/' + gdf["mlm:name"].iloc[0]
         self.props = gdf.iloc[0]
+        self.pipeline = Pipeline(self.props["mlm:input"])
+        self.postprocessing = Postprocessing(self.props["mlm:output"])
         self.ready = True
 
-    def predict(self, x):
+    def load(self):
+        # create the onnx session once and reuse it across requests
         if not self.ready:
             self.setup()
-        ort_session = self.get_onnx_session(self.model_path)
+        if self.session is None:
+            self.session = self.get_onnx_session(self.variant_model_path())
+        return self.session
+
+    def preload(self):
+        # load before serving, building the missing default variant if MODEL_VARIANTS_BUILD is set
+        if MODEL_VARIANTS_BUILD == "true" and not os.path.exists(self.session_path):
+            calibration = load_samples(self, sample_paths(VARIANT_CALIBRATION)) if VARIANT_CALIBRATION else None
+            build_variant(self.model_path, self.variant, calibration)
+        return self.load()
+
+    def unload(self):
+        for wrapper in self.variants.values():
+            wrapper.session = None
+
+    def __getstate__(self):
+        # onnx sessions can not be pickled, process pool workers create their own
+        state = self.__dict__.copy()
+        state["session"] = None
+        state["variants"] = {}
+        return state
+
+    def with_variant(self, variant=None):
+        # the same model served from another variant, with its own session (metadata is shared).
+        # Only variants already built are served, requests can not make the API build one
+        variant = variant or self.default_variant
+        if variant not in self.variants:
+            try:
+                path = variant_path(self.model_path, variant)
+            except ValueError as e:
+                raise VariantNotFoundError(str(e))
+            if not os.path.exists(path):
+                raise VariantNotFoundError(f"Variant {variant} of {self.model_name} not found, build it with `python -m api.optimize`")
+            wrapper = object.__new__(ModelWrapper)  # not copy.copy, __getstate__ drops the variants
+            wrapper.__dict__.update(self.__dict__)
+            wrapper.variant, wrapper.session, wrapper.output_shapes = variant, None, {}
+            self.variants[variant] = wrapper
+        return self.variants[variant]
+
+    @property
+    def session_path(self):
+        return variant_path(self.model_path, self.variant)
+
+    def variant_model_path(self):
+        # model file served by this wrapper (variants are built by preload or `python -m api.optimize`)
+        path = self.session_path
+        if not os.path.exists(path):
+            raise VariantNotFoundError(f"Variant {self.variant} of {self.model_name} not found, build it with `python -m api.optimize`")
+        return path
+
+    @property
+    def size(self):
+        return sum(
+            os.path.getsize(wrapper.session_path)
+            for wrapper in self.variants.values()
+            if os.path.exists(wrapper.session_path)
+        )
+
+    def predict(self, x, out=None):
+        ort_session = self.load()
         # preprocess input
         # x = self.process_inputs(x)
         # execute model
-        print("executing model with input shape", x.shape)
-        input_name = ort_session.get_inputs()[0].name
-        ort_inputs = {input_name: x}
-        ort_outs = ort_session.run(None, ort_inputs)
+        if self.verbose:
+            print("executing model with input shape", x.shape)
+        # bind inputs (and the first output if a buffer is given) to avoid copies
+        binding = ort_session.io_binding()
+        binding.bind_cpu_input(ort_session.get_inputs()[0].name, np.ascontiguousarray(x))
         output_nodes = ort_session.get_outputs()
         output_names = [node.name for node in output_nodes]
+        for i, name in enumerate(output_names):
+            if i == 0 and out is not None:
+                binding.bind_output(name, "cpu", element_type=out.dtype, shape=out.shape, buffer_ptr=out.ctypes.data)
+            else:
+                binding.bind_output(name, "cpu")
+        ort_session.run_with_iobinding(binding)
+        ort_outs = [
+            out if i == 0 and out is not None else value.numpy()
+            for i, value in enumerate(binding.get_outputs())
+        ]
+        if len(self.output_shapes) > 64:
+            self.output_shapes.clear()
+        self.output_shapes[x.shape[1:]] = ort_outs[0].shape[1:]
         # format and return outputs
         return self.return_outputs(ort_outs, output_names)
 
+    def profile(self, x):
+        # run the model on a new session with onnxruntime profiling enabled (slow, only for
+        # requests being profiled), returns the outputs and the profiling events
+        directory = tempfile.mkdtemp()
+        try:
+            session = self.get_onnx_session(self.variant_model_path(), profile_prefix=directory + "/profile")
+            output_names = [node.name for node in session.get_outputs()]
+            ort_outs = session.run(output_names, {session.get_inputs()[0].name: np.ascontiguousarray(x)})
+            with open(session.end_profiling()) as f:
+                events = json.load(f)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return self.return_outputs(ort_outs, output_names), events
+
+    def output_shape(self, input_shape):
+        # shape of the first output for a given input shape, learned from previous runs
+        shape = self.output_shapes.get(tuple(input_shape[1:]))
+        return None if shape is None else (input_shape[0], *shape)
+
+    @property
+    def output_dtype(self):
+        return ONNX_DTYPES[self.load().get_outputs()[0].type]
+
     def download(self, user=None):
-        # download the model
-        model, error = retrieve_model(self.model_name)
-        if error:
-            raise Exception(error)
+        download_base_path = os.getenv(
+            "EOTDL_DOWNLOAD_PATH", str(Path.home()) + "/.cache/eotdl/models"
+        )
+        base_path = download_base_path if self.path is None else self.path
+        # resolve versions from the local metadata cache (refreshed from EOTDL in the background)
+        model = get_metadata_cache(base_path).get(self.model_name)
         if self.version is None:
             self.version = sorted(model["versions"], key=lambda v: v["version_id"])[-1][
                 "version_id"
@@ -68,17 +189,12 @@ class ModelWrapper:
             assert self.version in [
                 v["version_id"] for v in model["versions"]
             ], f"Version {self.version} not found"
-        download_base_path = os.getenv(
-            "EOTDL_DOWNLOAD_PATH", str(Path.home()) + "/.cache/eotdl/models"
-        )
-        if self.path is None:
-            download_path = download_base_path + "/" + self.model_name
-        else:
-            download_path = self.path + "/" + self.model_name
+        download_path = base_path + "/" + self.model_name
         # check if model already exists
         os.makedirs(download_path, exist_ok=True)
         catalog_path = download_path + f"/catalog.v{self.version}.parquet"
         if os.path.exists(catalog_path) and not self.force:
+            import geopandas as gpd  # heavy imports are deferred to the first model load
             gdf = gpd.read_parquet(catalog_path)
             return download_path, gdf
         if self.verbose:
@@ -86,53 +202,32 @@ class ModelWrapper:
         gdf, error = retrieve_model_catalog(model["id"], self.version)
         if error:
             raise Exception(error)
-        gdf.to_parquet(download_path + f"/catalog.v{self.version}.parquet")
         # download assets
         if self.assets:
             if self.verbose:
                 print("Downloading assets...")
-            for _, row in tqdm(gdf.iterrows(), total=len(gdf)):
-                for k, v in row["assets"].items():
-                    href = v["href"]
-                    download_file_url(href, download_path)
+            assets = [
+                (v["href"], v.get("file:checksum", v.get("checksum")))  # STAC file extension
+                for _, row in gdf.iterrows()
+                for v in row["assets"].values()
+            ]
+            download_files(assets, download_path, max_workers=DOWNLOAD_WORKERS, verbose=self.verbose)
         else:
             print("To download assets, set assets=True.")
+        # the catalog is written last, so its presence means the model is complete
+        gdf.to_parquet(catalog_path + ".part")
+        os.replace(catalog_path + ".part", catalog_path)
         if self.verbose:
             print("Done")
         return download_path, gdf
 
-    def process_inputs(self, x):
-        # pre-process and validate input
-        input = self.props["mlm:input"]
-        # input data type
-        dtype = input["input"]["data_type"]
-        x = x.astype(dtype)
-        # input shape
-        input_shape = input["input"]["shape"]
-        ndims = len(input_shape)
-        if ndims != x.ndim:
-            if ndims == 4:
-                x = np.expand_dims(x, axis=0).astype(np.float32)
-            else:
-                raise Exception("Input shape not valid", input_shape, x.ndim)
-        for i, dim in enumerate(input_shape):
-            if dim != -1:
-                assert dim == x.shape[i], f"Input dimension not valid: The model expects {input_shape} but input has {x.shape} (-1 means any dimension)."
-        # TODO: should apply normalization if defined in metadata
-
-        # check height and width are divisible by 32
-        original_size = x.shape[2:]
-        if original_size[0] % 32 != 0 or original_size[1] % 32 != 0:
-            # resize to nearest multiple of 32
-            new_size = (
-                32 * (original_size[0] // 32),
-                32 * (original_size[1] // 32),
-            )
-            x = resize(x, (1, 3, *new_size), preserve_range=True)
-            print(f"Resized image from {original_size} to {new_size}")
-        self.original_size = original_size
-
-        return x
+    def process_inputs(self, x, band_names=None):
+        # pre-process and validate input, returns it with the size to restore the outputs to
+        x, original_size = self.pipeline(x, band_names)
+        self.pipeline.validate(x)
+        if x.shape[2:] != original_size and self.verbose:
+            print(f"Resized image from {original_size} to {x.shape[2:]}")
+        return x, original_size
     
     def return_outputs(self, ort_outputs, output_names):
         if self.props["mlm:output"]["tasks"] == ["classification"]:
@@ -146,15 +241,18 @@ class ModelWrapper:
         else:
             raise Exception("Output task not supported:", self.props["mlm:output"]["tasks"])
 
-    def get_onnx_session(self, model):        
-        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    def get_onnx_session(self, model, profile_prefix=None):
+        # providers, threads and graph optimizations are configured per model (see session.py)
         try:
-            session = ort.InferenceSession(model, providers=providers)
+            session = create_session(model, self.model_name, profile_prefix)
         except Exception as e:
             raise RuntimeError(f"Error loading ONNX model: {str(e)}")
         return session
     
     def items(self):
+        import pyarrow.parquet as pq
+        import stac_geoparquet
+
         table = pq.read_table(self.gdf_path)
         items = []
         for item in tqdm(stac_geoparquet.arrow.stac_table_to_items(table), total=len(table)):
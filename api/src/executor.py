@@ -0,0 +1,135 @@
+import os
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+
+from .metrics import model_inference_queue_size, model_inference_rejected
+from .session import thread_budget
+
+
+class QueueFullError(Exception):
+	pass
+
+
+# models loaded inside process pool workers, (model_name, version, variant) -> wrapper
+_process_models = {}
+
+
+def _predict(model, x):
+	# runs in a process pool worker, keeps one warm session per model and worker
+	key = (model.model_name, model.version, getattr(model, "variant", None))
+	if key not in _process_models:
+		_process_models[key] = model
+	return _process_models[key].predict(x)
+
+
+def _init_worker(threads):
+	# process pool workers each get their share of the threads, instead of the whole cpu quota
+	os.environ["ONNX_THREAD_BUDGET"] = str(threads)
+
+
+def preprocess(pipeline, x, band_names=None):
+	# returns the input ready for the model and the size to restore its outputs to, nothing is kept
+	# on the (shared) model between requests
+	x, original_size = pipeline(x, band_names)
+	pipeline.validate(x)
+	return x, original_size
+
+
+class InferenceExecutor:
+	def __init__(
+		self,
+		model_name: str,
+		kind: str = "thread",
+		max_workers: int = 1,
+		max_queue: int = None,
+	):
+		# onnxruntime releases the GIL, so threads are enough to overlap inference with the event loop.
+		# Processes also parallelize the (GIL bound) preprocessing, at the cost of pickling inputs.
+		self.model_name = model_name
+		self.kind = kind
+		self.max_workers = max_workers
+		self.max_queue = max_queue
+		if kind == "thread":
+			self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"inference-{model_name}")
+		elif kind == "process":
+			self.executor = ProcessPoolExecutor(
+				max_workers=max_workers,
+				mp_context=multiprocessing.get_context("spawn"),
+				initializer=_init_worker,
+				initargs=(max(1, thread_budget() // max_workers),),
+			)
+		else:
+			raise ValueError(f"Executor kind not supported: {kind}")
+		self.semaphore = None
+		self.loop = None
+		self.in_flight = 0
+		self.users = 0  # requests using the executor, see use() and close()
+		self.closing = False
+		self.lock = threading.Lock()  # close() may be called from other threads (e.g. model reloads)
+
+	def acquire(self):
+		# bounded queue of requests in flight for this model, reject early when saturated
+		if self.max_queue is not None and self.in_flight >= self.max_queue:
+			model_inference_rejected.labels(model=self.model_name).inc()
+			raise QueueFullError(f"Inference queue for model {self.model_name} is full")
+		self.in_flight += 1
+		model_inference_queue_size.labels(model=self.model_name).set(self.in_flight)
+
+	def release(self):
+		self.in_flight -= 1
+		model_inference_queue_size.labels(model=self.model_name).set(self.in_flight)
+
+	@contextmanager
+	def admit(self):
+		self.acquire()
+		try:
+			yield
+		finally:
+			self.release()
+
+	@contextmanager
+	def use(self):
+		with self.lock:
+			self.users += 1
+		try:
+			yield
+		finally:
+			with self.lock:
+				self.users -= 1
+				done = self.closing and self.users == 0
+			if done:
+				self.shutdown()
+
+	def close(self):
+		# shut down once the requests using the executor are done, e.g. when its model is evicted
+		with self.lock:
+			self.closing = True
+			done = self.users == 0
+		if done:
+			self.shutdown()
+
+	async def run(self, fn, *args):
+		loop = asyncio.get_running_loop()
+		if self.loop is not loop:  # asyncio primitives are bound to the loop they are used in
+			self.loop = loop
+			self.semaphore = asyncio.Semaphore(self.max_workers)
+		async with self.semaphore:
+			return await loop.run_in_executor(self.executor, fn, *args)
+
+	async def predict(self, model, x, out=None):
+		if self.kind == "process":  # buffers can not be shared with the workers
+			return await self.run(_predict, model, x)
+		return await self.run(model.predict, *((x,) if out is None else (x, out)))
+
+	async def preprocess(self, model, x, band_names=None):
+		# preprocessing does not count against the inference concurrency limit. Process workers only
+		# get the (small) pipeline, not the whole model
+		loop = asyncio.get_running_loop()
+		executor = self.executor if self.kind == "process" else None
+		return await loop.run_in_executor(executor, preprocess, model.pipeline, x, band_names)
+
+	def shutdown(self):
+		self.executor.shutdown(wait=False)
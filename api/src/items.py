@@ -0,0 +1,63 @@
+import os
+import json
+import hashlib
+import threading
+
+from fastapi.encoders import jsonable_encoder
+
+
+def catalog_stamp(path):
+	# changes when the catalog file is rewritten (e.g. the model is downloaded again)
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return stat.st_mtime_ns, stat.st_size
+
+
+def encode_json(content):
+	# same encoding as FastAPI's JSONResponse
+	return json.dumps(
+		jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+	).encode("utf-8")
+
+
+def read_items(catalog):
+	# STAC items of a model catalog, a (stac-)geoparquet file path or file object
+	import pyarrow.parquet as pq  # imported on first use (or by the warmup), not at startup
+	import stac_geoparquet
+	return list(stac_geoparquet.arrow.stac_table_to_items(pq.read_table(catalog)))
+
+
+def etag_matches(if_none_match, etag):
+	# If-None-Match is "*" or a list of (possibly weak) entity tags
+	if not if_none_match:
+		return False
+	tags = [tag.strip() for tag in if_none_match.split(",")]
+	return any(tag == "*" or tag.removeprefix("W/") == etag for tag in tags)
+
+
+class ItemsCache:
+	# STAC items of each catalog file, converted once and kept as encoded JSON with an ETag, so
+	# metadata requests only stat the catalog. An entry is rebuilt when the catalog file changes
+	# (or appears, e.g. once the model is downloaded).
+	def __init__(self):
+		self.entries = {}  # catalog path -> (catalog stamp, body, etag)
+		self.lock = threading.Lock()
+
+	def get(self, path, items):
+		# returns (body, etag), blocking on a miss, where `items()` returns the items to encode
+		stamp = catalog_stamp(path)
+		with self.lock:
+			entry = self.entries.get(path)
+		if entry is not None and entry[0] == stamp:
+			return entry[1], entry[2]
+		body = encode_json(items())
+		etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+		with self.lock:
+			self.entries[path] = (stamp, body, etag)
+		return body, etag
+
+	def invalidate(self, path):
+		with self.lock:
+			self.entries.pop(path, None)
@@ -0,0 +1,250 @@
+import os
+import json
+import shutil
+import time
+import uuid
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueue(ABC):
+	# Jobs are dicts with: id, model, version, status, input_path, result_path, media_type, error,
+	# created_at, updated_at. Inputs and results are files under `path`, which must be shared
+	# between the API and the workers.
+	def __init__(self, path, timeout=3600):
+		self.path = path
+		self.timeout = timeout  # running jobs older than this are considered lost and queued again
+		os.makedirs(path, exist_ok=True)
+
+	def job_path(self, job_id):
+		return f"{self.path}/{job_id}"
+
+	def new_job(self, model, version):
+		job_id = uuid.uuid4().hex
+		os.makedirs(self.job_path(job_id), exist_ok=True)
+		now = time.time()
+		return {
+			"id": job_id,
+			"model": model,
+			"version": version,
+			"status": QUEUED,
+			"input_path": self.job_path(job_id) + "/input",
+			"result_path": None,
+			"media_type": None,
+			"error": None,
+			"created_at": now,
+			"updated_at": now,
+		}
+
+	@abstractmethod
+	def submit(self, job):
+		...
+
+	@abstractmethod
+	def get(self, job_id):
+		...
+
+	@abstractmethod
+	def claim(self, limit=1):
+		# mark up to `limit` queued jobs as running and return them
+		...
+
+	@abstractmethod
+	def update(self, job_id, **fields):
+		# returns the updated job, None if it does not exist (e.g. removed by cleanup)
+		...
+
+	@abstractmethod
+	def heartbeat(self, job_id):
+		# keeps a running job from being considered lost while its worker is alive
+		...
+
+	@abstractmethod
+	def finished_before(self, timestamp):
+		# ids of the jobs done or failed before `timestamp`
+		...
+
+	@abstractmethod
+	def delete(self, job_id):
+		...
+
+	def cleanup(self, ttl):
+		# removes the jobs (and their inputs and results) finished more than `ttl` seconds ago
+		job_ids = self.finished_before(time.time() - ttl)
+		for job_id in job_ids:
+			shutil.rmtree(self.job_path(job_id), ignore_errors=True)
+			self.delete(job_id)
+		return len(job_ids)
+
+	def complete(self, job_id, result_path, media_type):
+		self.update(job_id, status=DONE, result_path=result_path, media_type=media_type)
+
+	def fail(self, job_id, error):
+		self.update(job_id, status=FAILED, error=error)
+
+
+class SQLiteJobQueue(JobQueue):
+	FIELDS = ["id", "model", "version", "status", "input_path", "result_path", "media_type", "error", "created_at", "updated_at"]
+
+	def __init__(self, path, timeout=3600):
+		super().__init__(path, timeout)
+		self.db_path = path + "/jobs.db"
+		with self.connect() as db:
+			db.execute(
+				"CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, model TEXT, version INTEGER, status TEXT, "
+				"input_path TEXT, result_path TEXT, media_type TEXT, error TEXT, created_at REAL, updated_at REAL)"
+			)
+			db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+	@contextmanager
+	def connect(self):
+		# one connection per call, so the queue can be used from any thread or process
+		db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+		db.row_factory = sqlite3.Row
+		try:
+			yield db
+		finally:
+			db.close()
+
+	def submit(self, job):
+		with self.connect() as db:
+			db.execute(
+				f"INSERT INTO jobs ({', '.join(self.FIELDS)}) VALUES ({', '.join('?' * len(self.FIELDS))})",
+				[job[field] for field in self.FIELDS],
+			)
+		return job
+
+	def get(self, job_id):
+		with self.connect() as db:
+			row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+		return dict(row) if row else None
+
+	def claim(self, limit=1):
+		now = time.time()
+		with self.connect() as db:
+			db.execute("BEGIN IMMEDIATE")  # lock the database so jobs are claimed by a single worker
+			try:
+				db.execute(
+					"UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+					(QUEUED, now, RUNNING, now - self.timeout),
+				)
+				rows = db.execute(
+					"SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT ?", (QUEUED, limit)
+				).fetchall()
+				db.executemany(
+					"UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+					[(RUNNING, now, row["id"]) for row in rows],
+				)
+				db.execute("COMMIT")
+			except Exception:
+				db.execute("ROLLBACK")
+				raise
+		return [{**dict(row), "status": RUNNING, "updated_at": now} for row in rows]
+
+	def update(self, job_id, **fields):
+		fields["updated_at"] = time.time()
+		with self.connect() as db:
+			db.execute(
+				f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?",
+				[*fields.values(), job_id],
+			)
+		return self.get(job_id)
+
+	def heartbeat(self, job_id):
+		with self.connect() as db:
+			db.execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING))
+
+	def finished_before(self, timestamp):
+		with self.connect() as db:
+			rows = db.execute(
+				"SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, timestamp)
+			).fetchall()
+		return [row["id"] for row in rows]
+
+	def delete(self, job_id):
+		with self.connect() as db:
+			db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+class RedisJobQueue(JobQueue):
+	# requeues the jobs of dead workers, then moves up to ARGV[2] queued jobs to the running set,
+	# atomically so a job is claimed by a single worker and never lost in between
+	CLAIM = """
+	for _, job_id in ipairs(redis.call("ZRANGEBYSCORE", KEYS[2], 0, ARGV[1] - ARGV[3])) do
+		redis.call("ZREM", KEYS[2], job_id)
+		redis.call("RPUSH", KEYS[1], job_id)
+	end
+	local claimed = {}
+	for _ = 1, tonumber(ARGV[2]) do
+		local job_id = redis.call("LPOP", KEYS[1])
+		if not job_id then
+			break
+		end
+		redis.call("ZADD", KEYS[2], ARGV[1], job_id)
+		table.insert(claimed, job_id)
+	end
+	return claimed
+	"""
+
+	def __init__(self, path, url, timeout=3600):
+		import redis  # optional dependency
+
+		super().__init__(path, timeout)
+		self.redis = redis.Redis.from_url(url, decode_responses=True)
+		self.claim_script = self.redis.register_script(self.CLAIM)
+
+	def submit(self, job):
+		pipe = self.redis.pipeline()
+		pipe.set(f"job:{job['id']}", json.dumps(job))
+		pipe.rpush("jobs:queued", job["id"])
+		pipe.execute()
+		return job
+
+	def get(self, job_id):
+		job = self.redis.get(f"job:{job_id}")
+		return json.loads(job) if job else None
+
+	def claim(self, limit=1):
+		job_ids = self.claim_script(keys=["jobs:queued", "jobs:running"], args=[time.time(), limit, self.timeout])
+		jobs = []
+		for job_id in job_ids:
+			job = self.update(job_id, status=RUNNING)
+			if job is None:
+				self.redis.zrem("jobs:running", job_id)
+			else:
+				jobs.append(job)
+		return jobs
+
+	def update(self, job_id, **fields):
+		job = self.get(job_id)
+		if job is None:
+			return None
+		job.update(fields, updated_at=time.time())
+		pipe = self.redis.pipeline()
+		pipe.set(f"job:{job_id}", json.dumps(job))
+		if job["status"] in (DONE, FAILED):
+			pipe.zrem("jobs:running", job_id)
+			pipe.zadd("jobs:finished", {job_id: job["updated_at"]})
+		pipe.execute()
+		return job
+
+	def heartbeat(self, job_id):
+		self.redis.zadd("jobs:running", {job_id: time.time()}, xx=True)
+
+	def finished_before(self, timestamp):
+		return self.redis.zrangebyscore("jobs:finished", 0, timestamp)
+
+	def delete(self, job_id):
+		pipe = self.redis.pipeline()
+		pipe.delete(f"job:{job_id}")
+		pipe.zrem("jobs:finished", job_id)
+		pipe.execute()
+
+
+def create_job_queue(path, url=None, timeout=3600):
+	if url and url.startswith("redis"):
+		return RedisJobQueue(path, url, timeout)
+	return SQLiteJobQueue(path, timeout)
@@ -0,0 +1,117 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+from .utils import retrieve_model
+
+logger = logging.getLogger(__name__)
+
+METADATA_TTL = float(os.getenv("METADATA_TTL", 300))  # seconds before model metadata is refreshed
+EOTDL_OFFLINE = os.getenv("EOTDL_OFFLINE", "false") == "true"  # never call the EOTDL API
+
+
+class MetadataCache:
+    # On-disk index of model name -> id -> versions -> catalog paths, so the request path does not
+    # depend on the EOTDL API. Stale entries are served while they are refreshed in the background.
+    def __init__(self, path, ttl=METADATA_TTL, offline=EOTDL_OFFLINE, fetch=retrieve_model):
+        self.path = path
+        self.index_path = path + "/models.json"
+        self.ttl = ttl
+        self.offline = offline
+        self.fetch = fetch
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.index = self._read_index()
+
+    def get(self, name):
+        entry = self.index.get(name)
+        if self.offline:
+            return self._from_disk(name)
+        if entry is None:
+            return self._refresh(name)
+        if time.time() - entry["fetched_at"] > self.ttl:
+            with self.lock:
+                if name not in self.refreshing:
+                    self.refreshing.add(name)
+                    threading.Thread(target=self._background_refresh, args=(name,), daemon=True).start()
+        return entry["model"]
+
+    def catalog_path(self, name, version):
+        return f"{self.path}/{name}/catalog.v{version}.parquet"
+
+    def _refresh(self, name):
+        try:
+            model, error = self.fetch(name)
+        except Exception as e:  # e.g. connection errors
+            model, error = None, str(e)
+        if error:
+            # fall back to the models already downloaded
+            if self._local_versions(name):
+                logger.warning(f"Error retrieving model {name}, using local metadata: {error}")
+                return self._from_disk(name)
+            raise Exception(error)
+        with self.lock:
+            self.index[name] = {
+                "model": model,
+                "fetched_at": time.time(),
+                "catalogs": {
+                    str(v["version_id"]): self.catalog_path(name, v["version_id"]) for v in model["versions"]
+                },
+            }
+            self._write_index()
+        return model
+
+    def _background_refresh(self, name):
+        try:
+            self._refresh(name)
+        except Exception as e:
+            logger.error(f"Error refreshing metadata of model {name}: {e}")
+        finally:
+            with self.lock:
+                self.refreshing.discard(name)
+
+    def _local_versions(self, name):
+        model_path = f"{self.path}/{name}"
+        if not os.path.isdir(model_path):
+            return []
+        return sorted(
+            int(match.group(1))
+            for match in map(re.compile(r"catalog\.v(\d+)\.parquet$").match, os.listdir(model_path))
+            if match
+        )
+
+    def _from_disk(self, name):
+        entry = self.index.get(name)
+        versions = self._local_versions(name)
+        if not versions:
+            raise Exception(f"Model {name} is not available offline")
+        model = dict(entry["model"]) if entry else {"name": name, "id": None}
+        # only versions that are fully downloaded can be served
+        model["versions"] = [{"version_id": version} for version in versions]
+        return model
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.index_path + ".part", "w") as f:
+            json.dump(self.index, f)
+        os.replace(self.index_path + ".part", self.index_path)
+
+
+metadata_caches = {}
+
+
+def get_metadata_cache(path):
+    # one cache per download path
+    if path not in metadata_caches:
+        metadata_caches[path] = MetadataCache(path)
+    return metadata_caches[path]
@@ -29,3 +29,89 @@ model_inference_timeout = prometheus_client.Counter(
     "Number of inference requests that timed out",
     labelnames=["model"]
 )
+
+model_inference_queue_size = prometheus_client.Gauge(
+    "model_inference_queue_size",
+    "Number of inference requests in flight",
+    labelnames=["model"]
+)
+
+model_inference_rejected = prometheus_client.Counter(
+    "model_inference_rejected_total",
+    "Number of inference requests rejected because the queue was full",
+    labelnames=["model"]
+)
+
+model_batch_queue_depth = prometheus_client.Gauge(
+    "model_batch_queue_depth",
+    "Number of requests waiting to be batched",
+    labelnames=["model"]
+)
+
+model_batch_fill_ratio = prometheus_client.Histogram(
+    "model_batch_fill_ratio",
+    "Ratio between the number of images in a batch and the batch size",
+    labelnames=["model"],
+    buckets=[0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+)
+
+model_batch_wait_time = prometheus_client.Histogram(
+    "model_batch_wait_time_seconds",
+    "Time requests wait in the queue before their batch is dispatched",
+    labelnames=["model"]
+)
+
+result_cache_hits = prometheus_client.Counter(
+    "result_cache_hits_total",
+    "Number of inference results served from the cache",
+    labelnames=["model", "tier"]
+)
+
+result_cache_misses = prometheus_client.Counter(
+    "result_cache_misses_total",
+    "Number of inference results not found in the cache",
+    labelnames=["model"]
+)
+
+result_cache_evictions = prometheus_client.Counter(
+    "result_cache_evictions_total",
+    "Number of inference results evicted from the cache",
+    labelnames=["tier"]
+)
+
+model_stage_duration = prometheus_client.Histogram(
+    "model_stage_duration_seconds",
+    "Time spent in each stage of a request (decode, preprocess, batch_wait, inference, postprocess, encode...)",
+    labelnames=["model", "stage"],
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+)
+
+model_batch_target_size = prometheus_client.Gauge(
+    "model_batch_target_size",
+    "Batch size chosen by the batch auto-tuner",
+    labelnames=["model"]
+)
+
+model_batch_target_timeout = prometheus_client.Gauge(
+    "model_batch_target_timeout_seconds",
+    "Batch flush deadline chosen by the batch auto-tuner",
+    labelnames=["model"]
+)
+
+model_arrival_rate = prometheus_client.Gauge(
+    "model_arrival_rate",
+    "Requests per second submitted to the batching queue, as seen by the batch auto-tuner",
+    labelnames=["model"]
+)
+
+model_batch_latency_p95 = prometheus_client.Gauge(
+    "model_batch_latency_p95_seconds",
+    "95th percentile of the batching wait plus inference time of recent requests",
+    labelnames=["model"]
+)
+
+model_requests_dropped = prometheus_client.Counter(
+    "model_requests_dropped_total",
+    "Requests dropped from the batching queue, labeled by reason: expired, shed (could not meet their deadline) or cancelled (client disconnected)",
+    labelnames=["model", "reason"]
+)
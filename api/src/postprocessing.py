@@ -0,0 +1,92 @@
+import numpy as np
+
+ACTIVATIONS = ("softmax", "sigmoid")
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        return [value]
+    return list(value)
+
+
+def softmax(x, axis=1):
+    x = x - x.max(axis=axis, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=axis, keepdims=True)
+    return x
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+class Postprocessing:
+    """
+    Output post-processing compiled once per model from its `mlm:output` metadata.
+
+    Outputs are (batch, channels, ...) arrays, processed for the whole batch at once. With
+    `classification:classes`, classification scores go through a softmax (sigmoid for a single
+    output) and are labelled with the top classes, and segmentation logits become uint8 class maps
+    (argmax over channels, or a 0.5 threshold for a single channel). A `post_processing_function`
+    naming `softmax` or `sigmoid` selects the activation. Without either, outputs are left as they are.
+    """
+
+    def __init__(self, output):
+        if isinstance(output, (list, tuple, np.ndarray)):
+            output = output[0]  # only the first output is returned
+        self.tasks = list(output.get("tasks", []))
+        self.classes = [dict(c) for c in _as_list(output.get("classification:classes"))]
+        function = output.get("post_processing_function") or {}
+        expression = str(function.get("expression", "") if isinstance(function, dict) else function).lower()
+        self.activation = next((name for name in ACTIVATIONS if name in expression), None)
+        if self.activation is None and self.classes:
+            self.activation = "auto"  # softmax, or sigmoid for a single channel
+        self.decide = "segmentation" in self.tasks and bool(self.classes)
+        values = [int(c.get("value", i)) for i, c in enumerate(self.classes)]
+        self.values = np.asarray(values or [0], dtype=np.uint8 if max(values or [0]) < 256 else np.uint16)
+        self.names = [str(c.get("name", c.get("value", i))) for i, c in enumerate(self.classes)]
+
+    @property
+    def enabled(self):
+        return self.activation is not None or self.decide
+
+    def __call__(self, outputs):
+        if self.decide:
+            return self.class_map(outputs)
+        return self.activate(outputs)
+
+    def activate(self, outputs):
+        channels = outputs.shape[1] if outputs.ndim > 1 else 1
+        activation = self.activation
+        if activation == "auto":
+            activation = "softmax" if channels > 1 else "sigmoid"
+        if activation == "softmax":
+            return softmax(outputs.astype(np.float32))  # new array, `outputs` may be a reused buffer
+        if activation == "sigmoid":
+            return sigmoid(outputs.astype(np.float32, copy=False))
+        return outputs
+
+    def class_map(self, outputs):
+        # (batch, channels, h, w) logits -> (batch, h, w) class values. Activations are monotonic,
+        # so they are skipped: argmax of the logits, or logits > 0 for sigmoid(x) > 0.5
+        if outputs.ndim == 4 and outputs.shape[1] > 1:
+            index = outputs.argmax(axis=1)
+        else:
+            index = (outputs.reshape(outputs.shape[0], *outputs.shape[-2:]) > 0).astype(np.intp)
+            if len(self.values) == 1:  # a single class: the pixels above the threshold
+                return (index * self.values[0]).astype(self.values.dtype)
+        if index.max(initial=0) >= len(self.values):
+            return index.astype(self.values.dtype)  # more channels than classes, keep the indexes
+        return self.values[index]
+
+    def labels(self, scores, k=5):
+        # top `k` classes of the (classes,) scores of one input
+        if not self.classes or scores.ndim != 1 or len(scores) != len(self.classes):
+            return scores.tolist()
+        top = np.argsort(scores)[::-1][:k]
+        return [
+            {"class": self.names[i], "value": int(self.values[i]), "score": float(scores[i])}
+            for i in top
+        ]
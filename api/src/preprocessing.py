@@ -0,0 +1,153 @@
+import numpy as np
+
+# spatial dimensions of the inputs are adjusted to a multiple of it (the stride of most models)
+SIZE_MULTIPLE = 32
+
+# skimage interpolation orders for the MLM resize types
+INTERPOLATION_ORDERS = {
+    "interpolation-nearest": 0,
+    "interpolation-linear": 1,
+    "interpolation-cubic": 3,
+}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        return [value]
+    return list(value)
+
+
+def _band_name(band):
+    return band["name"] if isinstance(band, dict) else str(band)
+
+
+def nearest(x, size):
+    # nearest neighbour resize of the last two dims by indexing, keeps the dtype (e.g. class maps)
+    height, width = size
+    rows = np.arange(height) * x.shape[-2] // height
+    cols = np.arange(width) * x.shape[-1] // width
+    return x[..., rows[:, None], cols]
+
+
+class Pipeline:
+    """
+    Preprocessing compiled once per model from its `mlm:input` metadata.
+
+    Inputs are (bands, height, width) images or (batch, bands, height, width) batches. Bands are
+    selected and cast to float32 in a single copy, scaling is applied in place on that buffer, and
+    spatial dimensions are adjusted to a multiple of `size_multiple` with the `resize_type` method.
+    """
+
+    def __init__(self, input, size_multiple=SIZE_MULTIPLE):
+        if isinstance(input, (list, tuple, np.ndarray)):
+            input = input[0]  # only single input models are supported
+        self.dtype = np.dtype(input["input"]["data_type"])
+        self.shape = list(input["input"]["shape"])
+        self.bands = [_band_name(band) for band in _as_list(input.get("bands"))]
+        self.channels = self.shape[1] if len(self.shape) == 4 and self.shape[1] != -1 else len(self.bands) or None
+        self.resize_type = input.get("resize_type") or "interpolation-linear"
+        self.size_multiple = size_multiple
+        self.steps = self._compile_scaling(input)
+
+    def _compile_scaling(self, input):
+        # each step is (operation, per band values broadcastable to (bands, 1, 1))
+        def values(scalings, key, default=None):
+            values = [default if s.get(key) is None else s[key] for s in scalings]
+            return np.array(values, dtype=np.float32).reshape(-1, 1, 1)
+
+        scalings = [dict(s) for s in _as_list(input.get("value_scaling"))]
+        if not scalings and input.get("norm_type"):  # MLM < 1.3
+            scalings = [{"type": input["norm_type"], **dict(s)} for s in _as_list(input.get("statistics"))]
+        if not scalings:
+            # inputs are assumed to be 8 bit images when the metadata does not define a scaling
+            return [("scale", np.float32(1 / 255))]
+        steps = []
+        for kind in dict.fromkeys(s["type"] for s in scalings):
+            group = [s for s in scalings if s["type"] == kind]
+            if len(group) != 1 and len(group) != len(scalings):
+                raise Exception("Value scaling must be defined for one or all bands", kind)
+            if kind == "min-max":
+                minimum, maximum = values(group, "minimum"), values(group, "maximum")
+                steps += [("offset", minimum), ("scale", 1 / (maximum - minimum))]
+            elif kind == "z-score":
+                steps += [("offset", values(group, "mean")), ("scale", 1 / values(group, "stddev"))]
+            elif kind in ("clip", "clip-min", "clip-max"):
+                steps.append(("clip", (values(group, "minimum", -np.inf), values(group, "maximum", np.inf))))
+            elif kind == "offset":
+                steps.append(("offset", values(group, "value")))
+            elif kind == "scale":
+                steps.append(("scale", 1 / values(group, "value")))
+            else:
+                raise Exception("Value scaling not supported", kind)
+        return steps
+
+    def band_indexes(self, count, band_names=None):
+        if self.channels is None or count == self.channels:
+            return list(range(count))
+        if band_names and self.bands and all(band in band_names for band in self.bands):
+            return [list(band_names).index(band) for band in self.bands]
+        if count > self.channels:
+            return list(range(self.channels))  # e.g. drop the alpha band of RGBA images
+        raise Exception(f"The model expects {self.channels} bands but input has {count}")
+
+    def __call__(self, x, band_names=None):
+        if x.ndim == 3:
+            x = x[None]
+        # band selection + cast, the only full copy of the input
+        indexes = self.band_indexes(x.shape[1], band_names)
+        out = np.empty((x.shape[0], len(indexes), *x.shape[2:]), dtype=np.float32)
+        for i, band in enumerate(indexes):
+            np.copyto(out[:, i], x[:, band], casting="unsafe")
+        original_size = out.shape[2:]
+        out = self.resize(out)
+        for operation, value in self.steps:
+            if operation == "offset":
+                np.subtract(out, value, out=out)
+            elif operation == "scale":
+                np.multiply(out, value, out=out)
+            elif operation == "clip":
+                np.clip(out, *value, out=out)
+        if out.dtype != self.dtype:
+            out = out.astype(self.dtype)
+        return out, original_size
+
+    def validate(self, x):
+        # pre-processed input against the model's input shape
+        if len(self.shape) != x.ndim:
+            raise Exception("Input shape not valid", self.shape, x.ndim)
+        for i, dim in enumerate(self.shape):
+            if dim != -1:
+                assert dim == x.shape[i], f"Input dimension not valid: The model expects {self.shape} but input has {x.shape} (-1 means any dimension)."
+
+    def restore_size(self, outputs, original_size):
+        # bring spatial outputs (e.g. segmentation masks) back to the size of the input
+        height, width = original_size
+        if outputs.shape[-2:] == (height, width):
+            return outputs
+        if self.resize_type == "pad":
+            return outputs[..., :height, :width]
+        if self.resize_type == "crop":
+            pad = [(0, 0)] * (outputs.ndim - 2) + [(0, height - outputs.shape[-2]), (0, width - outputs.shape[-1])]
+            return np.pad(outputs, pad, mode="edge")
+        order = INTERPOLATION_ORDERS.get(self.resize_type, 1)
+        if order == 0 or not np.issubdtype(outputs.dtype, np.floating):
+            return nearest(outputs, original_size)  # class values can not be interpolated
+        from skimage.transform import resize
+        return resize(outputs, (*outputs.shape[:-2], height, width), order=order, preserve_range=True)
+
+    def resize(self, x):
+        height, width = x.shape[2:]
+        m = self.size_multiple
+        if not m or (height % m == 0 and width % m == 0):
+            return x
+        if self.resize_type == "crop":
+            return x[..., : m * (height // m), : m * (width // m)]  # view, no copy
+        if self.resize_type == "pad":
+            return np.pad(x, ((0, 0), (0, 0), (0, -height % m), (0, -width % m)))
+        # resize to nearest multiple of m
+        new_size = (m * max(height // m, 1), m * max(width // m, 1))
+        order = INTERPOLATION_ORDERS.get(self.resize_type, 1)
+        from skimage.transform import resize  # slow to import, only needed for interpolated resizes
+        return resize(x, (*x.shape[:2], *new_size), order=order, preserve_range=True).astype(np.float32, copy=False)
@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def parse_model_list(value):
+	# "EuroSAT-RGB-Q2,RoadSegmentationQ2:2" -> [("EuroSAT-RGB-Q2", None), ("RoadSegmentationQ2", 2)]
+	models = []
+	for entry in (value or "").split(","):
+		entry = entry.strip()
+		if not entry:
+			continue
+		name, _, version = entry.partition(":")
+		models.append((name, int(version) if version else None))
+	return models
+
+
+class ModelRegistry:
+	def __init__(
+		self,
+		loader,
+		max_models: int = None,
+		max_bytes: int = None,
+		reload_interval: float = None,
+		on_evict = None,
+		load_sessions: bool = True,
+	):
+		# loader(model, version) -> ModelWrapper, must resolve `version` when None
+		self.loader = loader
+		self.max_models = max_models
+		self.max_bytes = max_bytes
+		self.reload_interval = reload_interval
+		self.on_evict = on_evict
+		self.load_sessions = load_sessions  # False when inference runs in another process
+		self.entries = OrderedDict()  # (model, version) -> wrapper, LRU order
+		self.latest = {}  # model -> (version, resolved_at)
+		self.lock = threading.RLock()
+		self.key_locks = {}
+		self.refreshing = set()
+
+	def get(self, model, version=None):
+		if version is None:
+			version = self._latest_version(model)
+		if version is not None:
+			wrapper = self._lookup((model, version))
+			if wrapper is not None:
+				return wrapper
+		with self._key_lock((model, version)):
+			# another request may have loaded it while we waited
+			if version is not None:
+				wrapper = self._lookup((model, version))
+				if wrapper is not None:
+					return wrapper
+			return self._load(model, version)
+
+	def preload(self, models):
+		for model, version in models:
+			logger.info(f"Preloading model {model} (version {version or 'latest'})")
+			wrapper = self.get(model, version)
+			if self.load_sessions:
+				wrapper.preload()
+
+	def evict(self, model, version=None):
+		with self.lock:
+			keys = [k for k in self.entries if k[0] == model and (version is None or k[1] == version)]
+			for key in keys:
+				self._remove(key)
+
+	def size(self):
+		with self.lock:
+			return sum(wrapper.size for wrapper in self.entries.values())
+
+	def _lookup(self, key):
+		with self.lock:
+			wrapper = self.entries.get(key)
+			if wrapper is not None:
+				self.entries.move_to_end(key)
+			return wrapper
+
+	def _key_lock(self, key):
+		with self.lock:
+			return self.key_locks.setdefault(key, threading.Lock())
+
+	def _latest_version(self, model):
+		with self.lock:
+			if model not in self.latest:
+				return None
+			version, resolved_at = self.latest[model]
+			stale = self.reload_interval is not None and time.monotonic() - resolved_at > self.reload_interval
+			if stale and model not in self.refreshing:
+				# serve the current version while a new one is resolved in the background
+				self.refreshing.add(model)
+				threading.Thread(target=self._refresh, args=(model,), daemon=True).start()
+			return version
+
+	def _refresh(self, model):
+		try:
+			wrapper = self._load(model, None)
+			if self.load_sessions:
+				wrapper.preload()
+		except Exception as e:
+			logger.error(f"Error reloading model {model}: {e}")
+		finally:
+			with self.lock:
+				self.refreshing.discard(model)
+
+	def _load(self, model, version):
+		wrapper = self.loader(model, version)
+		key = (model, wrapper.version)
+		with self.lock:
+			if version is None:
+				previous = self.latest.get(model)
+				self.latest[model] = (wrapper.version, time.monotonic())
+				if previous is not None and previous[0] != wrapper.version:
+					logger.info(f"New version of model {model} found: {previous[0]} -> {wrapper.version}")
+					if (model, previous[0]) in self.entries:
+						self._remove((model, previous[0]))
+			if key in self.entries:
+				# already loaded under its resolved version, keep the warm one
+				self.entries.move_to_end(key)
+				return self.entries[key]
+			self.entries[key] = wrapper
+			self._enforce_limits()
+		return wrapper
+
+	def _enforce_limits(self):
+		while len(self.entries) > 1:
+			too_many = self.max_models is not None and len(self.entries) > self.max_models
+			too_big = self.max_bytes is not None and self.size() > self.max_bytes
+			if not (too_many or too_big):
+				break
+			self._remove(next(iter(self.entries)))
+
+	def _remove(self, key):
+		wrapper = self.entries.pop(key)
+		self.key_locks.pop(key, None)
+		logger.info(f"Evicting model {key[0]} version {key[1]}")
+		wrapper.unload()
+		if self.on_evict is not None:
+			self.on_evict(key)
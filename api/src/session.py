@@ -0,0 +1,209 @@
+# onnxruntime session configuration, per model
+#
+# Defaults come from env variables and can be overridden per model in a JSON file (ONNX_SESSION_CONFIG):
+#
+#   {"RoadSegmentationQ2": {"providers": ["OpenVINOExecutionProvider", "CPUExecutionProvider"], "intra_op_threads": 4}}
+
+import os
+import json
+import math
+import mmap
+import hashlib
+import logging
+import platform
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONNX_SESSION_CONFIG = os.getenv("ONNX_SESSION_CONFIG", None)  # JSON file with settings keyed by model name
+
+# onnxruntime is imported by the functions using it, so importing the API does not load it
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+def cpu_quota(cgroup_path="/sys/fs/cgroup"):
+    # number of cpus the container can use, from the cgroup quota (v2 or v1) or the cpu affinity
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open(cgroup_path + "/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        try:
+            with open(cgroup_path + "/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open(cgroup_path + "/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+    if quota in ("max", "-1"):
+        return cpus
+    return max(1, min(cpus, math.ceil(int(quota) / int(period))))
+
+
+def thread_budget():
+    # threads the sessions of this process may use together: the cpu quota, or the share of it given to
+    # a process pool worker (ONNX_THREAD_BUDGET, see executor.py)
+    budget = os.getenv("ONNX_THREAD_BUDGET", None)
+    return int(budget) if budget else cpu_quota()
+
+
+def session_slots():
+    # sessions that can be loaded (and run) at the same time, each one gets its share of the budget
+    slots = os.getenv("ONNX_SESSIONS", None) or os.getenv("MODEL_CACHE_SIZE", None)
+    return max(1, int(slots)) if slots else 1
+
+
+def default_config():
+    providers = os.getenv("ONNX_PROVIDERS", "CUDAExecutionProvider,CPUExecutionProvider")
+    intra_op_threads = os.getenv("ONNX_INTRA_OP_THREADS", None)
+    shared_weights = os.getenv("SHARED_WEIGHTS", "false") == "true"
+    return {
+        "providers": [provider.strip() for provider in providers.split(",") if provider.strip()],
+        # onnxruntime uses all the host cores by default (per session), which oversubscribes containers
+        "intra_op_threads": int(intra_op_threads) if intra_op_threads else max(1, thread_budget() // session_slots()),
+        "inter_op_threads": int(os.getenv("ONNX_INTER_OP_THREADS", 1)),
+        # layout optimizations (extended and above) rewrite the weights into private copies
+        "graph_optimization_level": os.getenv("ONNX_GRAPH_OPTIMIZATION_LEVEL", "basic" if shared_weights else "all"),
+        "enable_mem_arena": os.getenv("ONNX_ENABLE_MEM_ARENA", "true") == "true",
+        "allow_spinning": os.getenv("ONNX_ALLOW_SPINNING", "true") == "true",
+        "optimized_model_cache": os.getenv("ONNX_OPTIMIZED_MODEL_CACHE", "true") == "true",
+        "shared_weights": shared_weights,
+        "variant": os.getenv("MODEL_VARIANT", "original"),  # original, int8-dynamic, int8-static or fp16
+    }
+
+
+def session_config(model_name, config_path=ONNX_SESSION_CONFIG):
+    config = default_config()
+    if config_path:
+        with open(config_path) as f:
+            overrides = json.load(f)
+        config.update(overrides.get("default", {}))
+        config.update(overrides.get(model_name, {}))
+    return config
+
+
+def session_providers(providers):
+    # providers are names or [name, options] pairs, the ones not available in this build are skipped
+    import onnxruntime as ort
+
+    available = ort.get_available_providers()
+    selected = []
+    for provider in providers:
+        name = provider if isinstance(provider, str) else provider[0]
+        if name in available:
+            selected.append(provider if isinstance(provider, str) else tuple(provider))
+    return selected or ["CPUExecutionProvider"]
+
+
+def session_options(config):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = config["intra_op_threads"]
+    options.inter_op_num_threads = config["inter_op_threads"]
+    options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[config["graph_optimization_level"]])
+    options.enable_cpu_mem_arena = config["enable_mem_arena"]
+    if not config["allow_spinning"]:  # idle threads stop busy waiting, better when several models share the cpus
+        options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        options.add_session_config_entry("session.inter_op.allow_spinning", "0")
+    return options
+
+
+def cpu_flags():
+    try:
+        with open("/proc/cpuinfo") as f:
+            return next((line for line in f if line.startswith("flags")), "")
+    except OSError:
+        return platform.processor()
+
+
+def optimized_model_path(model_path, providers, level):
+    # optimized graphs may contain provider and cpu specific nodes, so they are cached per
+    # providers/level/onnxruntime version/cpu
+    import onnxruntime as ort
+
+    providers = [p if isinstance(p, str) else p[0] for p in providers]
+    key = json.dumps([providers, level, ort.__version__, platform.machine(), cpu_flags()])
+    return f"{model_path}.{hashlib.sha256(key.encode()).hexdigest()[:12]}.optimized.onnx"
+
+
+def share_weights(model_path, size_threshold=1024):
+    # Moves the weights of a model to an external data file, aligned so onnxruntime memory-maps
+    # them instead of copying them: every process using the model then shares the same pages.
+    # Returns the path of the model referencing them (created once, next to the model).
+    shared_path = model_path + ".shared.onnx"
+    if os.path.exists(shared_path):
+        return shared_path
+    import onnx  # only needed to convert the model
+    from onnx import numpy_helper, TensorProto
+
+    model = onnx.load(model_path)
+    weights_name = os.path.basename(model_path) + ".weights"
+    weights_path = f"{os.path.dirname(model_path)}/{weights_name}"
+    part = f".{os.getpid()}.part"
+    offset = 0
+    with open(weights_path + part, "wb") as f:
+        for tensor in model.graph.initializer:
+            if tensor.data_location == TensorProto.EXTERNAL:
+                raise ValueError(f"Model {model_path} already uses external data")
+            if tensor.data_type == TensorProto.STRING:
+                continue
+            array = numpy_helper.to_array(tensor)
+            if array.nbytes < size_threshold:
+                continue
+            padding = -offset % mmap.ALLOCATIONGRANULARITY
+            f.write(b"\0" * padding)
+            offset += padding
+            f.write(np.ascontiguousarray(array).tobytes())
+            for field in ("raw_data", "float_data", "int32_data", "int64_data", "double_data", "uint64_data"):
+                tensor.ClearField(field)
+            tensor.data_location = TensorProto.EXTERNAL
+            for key, value in (("location", weights_name), ("offset", offset), ("length", array.nbytes)):
+                entry = tensor.external_data.add()
+                entry.key, entry.value = key, str(value)
+            offset += array.nbytes
+    os.replace(weights_path + part, weights_path)
+    onnx.save(model, shared_path + part)
+    os.replace(shared_path + part, shared_path)  # written last, its presence means the conversion is complete
+    return shared_path
+
+
+def create_session(model_path, model_name, profile_prefix=None):
+    import onnxruntime as ort
+
+    config = session_config(model_name)
+    providers = session_providers(config["providers"])
+    options = session_options(config)
+    level = config["graph_optimization_level"]
+    if config["shared_weights"]:
+        # optimized graphs would embed a (private) copy of the weights, so they are not cached
+        model_path = share_weights(model_path)
+        config["optimized_model_cache"] = False
+    if profile_prefix is not None:
+        # separate session recording onnxruntime's profiling, see ModelWrapper.profile
+        options.enable_profiling = True
+        options.profile_file_prefix = profile_prefix
+        return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    if not config["optimized_model_cache"] or level == "disable":
+        return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    optimized_path = optimized_model_path(model_path, providers, level)
+    if os.path.exists(optimized_path):
+        # already optimized, skip graph optimizations on cold starts
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return ort.InferenceSession(optimized_path, sess_options=options, providers=providers)
+        except Exception as e:
+            logger.warning(f"Could not load optimized model {optimized_path}, optimizing again: {e}")
+            options = session_options(config)
+    options.optimized_model_filepath = optimized_path + f".{os.getpid()}.part"
+    session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    try:
+        os.replace(options.optimized_model_filepath, optimized_path)
+    except OSError as e:
+        logger.warning(f"Could not save optimized model {optimized_path}: {e}")
+    return session
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Polygon
+
+BANDS = ["red", "green", "blue"]
+
+
+def build_model(task="segmentation", bands=3, layers=0, width=16, classes=10, seed=0):
+	# tiny ONNX model taking (batch, bands, height, width) float32 inputs. Without layers it
+	# returns the mean over bands (segmentation) or over pixels (classification, one output per
+	# band); with layers it runs a small convolutional network, closer to real workloads
+	import onnx  # only needed to build models, not to serve them
+	from onnx import helper, numpy_helper, TensorProto
+
+	rng = np.random.default_rng(seed)
+	nodes, initializers = [], []
+
+	def weight(name, *shape):
+		initializers.append(numpy_helper.from_array((rng.standard_normal(shape) * 0.1).astype(np.float32), name))
+		return name
+
+	x, channels = "x", bands
+	for i in range(layers):
+		nodes.append(helper.make_node(
+			"Conv", [x, weight(f"w{i}", width, channels, 3, 3), weight(f"b{i}", width)], [f"conv{i}"], pads=[1, 1, 1, 1]
+		))
+		nodes.append(helper.make_node("Relu", [f"conv{i}"], [f"relu{i}"]))
+		x, channels = f"relu{i}", width
+	if task == "segmentation":
+		if layers:
+			nodes.append(helper.make_node("Conv", [x, weight("head", 1, channels, 1, 1)], ["y"]))
+		else:
+			nodes.append(helper.make_node("ReduceMean", [x], ["y"], axes=[1], keepdims=1))
+		output_shape = ["batch", 1, "height", "width"]
+	elif task == "classification":
+		if layers:
+			nodes.append(helper.make_node("GlobalAveragePool", [x], ["pool"]))
+			nodes.append(helper.make_node("Flatten", ["pool"], ["features"]))
+			nodes.append(helper.make_node("Gemm", ["features", weight("head", classes, channels), weight("bias", classes)], ["y"], transB=1))
+			output_shape = ["batch", classes]
+		else:
+			nodes.append(helper.make_node("ReduceMean", [x], ["y"], axes=[2, 3], keepdims=0))
+			output_shape = ["batch", bands]
+	else:
+		raise ValueError(f"Task not supported: {task}")
+	graph = helper.make_graph(
+		nodes,
+		task,
+		[helper.make_tensor_value_info("x", TensorProto.FLOAT, ["batch", bands, "height", "width"])],
+		[helper.make_tensor_value_info("y", TensorProto.FLOAT, output_shape)],
+		initializer=initializers,
+	)
+	# ir_version 8 loads in every supported onnxruntime release
+	return helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8)
+
+
+def make_model(path, name, task="segmentation", version=1, bands=BANDS, class_names=None, **kwargs):
+	# write a model and its MLM catalog under `path`, laid out as ModelWrapper downloads them,
+	# so it can be served without EOTDL (see `make_index`). `class_names` are listed in mlm:output
+	# (one per output of classification models, background and foreground for segmentation)
+	import onnx
+
+	model_path = f"{path}/{name}"
+	os.makedirs(model_path, exist_ok=True)
+	onnx.save(build_model(task, bands=len(bands), **kwargs), f"{model_path}/model.onnx")
+	output = {"tasks": [task]}
+	if class_names:
+		output["classification:classes"] = [{"value": i, "name": name} for i, name in enumerate(class_names)]
+	gdf = gpd.GeoDataFrame({
+		"mlm:name": ["model.onnx"],
+		"mlm:framework": ["ONNX"],
+		"mlm:input": [{"bands": list(bands), "input": {"data_type": "float32", "shape": [-1, len(bands), -1, -1]}}],
+		"mlm:output": [output],
+		"geometry": [Polygon()],
+	})
+	gdf.to_parquet(f"{model_path}/catalog.v{version}.parquet")
+	return model_path
+
+
+def make_index(path, models, versions=(1,)):
+	# metadata cache index (models.json) listing the models, fresh for a long time so EOTDL is never asked
+	index = {
+		name: {
+			"model": {"id": name, "versions": [{"version_id": version} for version in versions]},
+			"fetched_at": time.time() + 1e9,
+		}
+		for name in models
+	}
+	with open(f"{path}/models.json", "w") as f:
+		json.dump(index, f)
@@ -0,0 +1,82 @@
+import asyncio
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+
+def tile_offsets(size, tile_size, overlap):
+	# start offsets along one axis, the last tile is aligned with the border
+	if size <= tile_size:
+		return [0]
+	stride = tile_size - overlap
+	offsets = list(range(0, size - tile_size, stride))
+	offsets.append(size - tile_size)
+	return offsets
+
+
+def check_tiling(tile_size, overlap, multiple):
+	# tiles that are not a multiple of the model's stride are resized by the preprocessing, and their
+	# outputs no longer line up with the mosaic
+	if tile_size % multiple or overlap % multiple:
+		raise ValueError(f"Tile size ({tile_size}) and overlap ({overlap}) must be multiples of {multiple}")
+	if not 0 <= overlap < tile_size:
+		raise ValueError("Tile overlap must be smaller than the tile size")
+
+
+def tile_windows(height, width, tile_size, overlap=0):
+	return [
+		(row, col)
+		for row in tile_offsets(height, tile_size, overlap)
+		for col in tile_offsets(width, tile_size, overlap)
+	]
+
+
+def blend_weights(tile_size, overlap):
+	# linear ramp over the overlap so neighbouring tiles fade into each other (never 0)
+	ramp = np.ones(tile_size, dtype=np.float32)
+	if overlap > 0:
+		edge = np.arange(1, overlap + 1, dtype=np.float32) / (overlap + 1)
+		ramp[:overlap] = edge
+		ramp[-overlap:] = np.minimum(ramp[-overlap:], edge[::-1])
+	return np.outer(ramp, ramp)
+
+
+def read_tile(image, row, col, tile_size):
+	# image is (bands, height, width), border tiles are zero padded to the tile size
+	tile = image[:, row:row + tile_size, col:col + tile_size]
+	h, w = tile.shape[1:]
+	if h < tile_size or w < tile_size:
+		tile = np.pad(tile, ((0, 0), (0, tile_size - h), (0, tile_size - w)))
+	return tile
+
+
+async def predict_tiled(image, predict, preprocess, tile_size=512, overlap=64, max_in_flight=16):
+	"""
+	Run a segmentation model over a large (bands, height, width) image with a sliding window.
+
+	Tiles are preprocessed (`preprocess` is a coroutine function) and sent to `predict` (e.g. a
+	BatchProcessor) concurrently, so tiles of the same scene fill up batches. Results are blended into
+	a preallocated output as they arrive, so only `max_in_flight` tiles are kept in memory at once
+	(besides the input and output arrays).
+	"""
+	assert 0 <= overlap < tile_size, "Tile overlap must be smaller than the tile size"
+	_, height, width = image.shape
+	weights = blend_weights(tile_size, overlap)
+	output, weight_sum = None, np.zeros((height, width), dtype=np.float32)
+	semaphore = asyncio.Semaphore(max_in_flight)
+
+	async def run_tile(row, col):
+		nonlocal output
+		async with semaphore:
+			# windowed reads of raster sources are blocking, done in a thread
+			tile = await preprocess(await run_in_threadpool(read_tile, image, row, col, tile_size))
+			result = await predict(tile)
+			result = result.reshape(-1, *result.shape[-2:])  # (channels, tile_size, tile_size)
+			if output is None:
+				output = np.zeros((result.shape[0], height, width), dtype=np.float32)
+			h, w = min(tile_size, height - row), min(tile_size, width - col)
+			output[:, row:row + h, col:col + w] += result[:, :h, :w] * weights[:h, :w]
+			weight_sum[row:row + h, col:col + w] += weights[:h, :w]
+
+	await asyncio.gather(*[run_tile(row, col) for row, col in tile_windows(height, width, tile_size, overlap)])
+	output /= weight_sum
+	return output
@@ -0,0 +1,103 @@
+import time
+import uuid
+import random
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from .metrics import model_stage_duration
+
+current_timings = contextvars.ContextVar("timings", default=None)
+
+
+class Timings:
+	# Stages of a request (decode, preprocess, batch_wait, inference...), exported as per model/stage
+	# histograms and as a Server-Timing header. With `profile`, the spans (and onnxruntime's own
+	# profiling) are kept for GET /admin/profiles/{id}.
+	def __init__(self, model, profile=False):
+		self.model = model
+		self.profile = profile
+		self.id = uuid.uuid4().hex
+		self.start = time.perf_counter()
+		self.spans = []  # (stage, start offset, seconds)
+		self.onnxruntime = []  # onnxruntime profiling events
+
+	def add(self, stage, seconds, start=None):
+		model_stage_duration.labels(model=self.model, stage=stage).observe(seconds)
+		start = time.perf_counter() - seconds if start is None else start
+		self.spans.append((stage, start - self.start, seconds))
+
+	@contextmanager
+	def stage(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add(name, time.perf_counter() - start, start)
+
+	def totals(self):
+		# seconds per stage, summed over repeated stages (e.g. the tiles of a large scene)
+		totals = OrderedDict()
+		for stage, _, seconds in self.spans:
+			totals[stage] = totals.get(stage, 0) + seconds
+		return totals
+
+	def server_timing(self):
+		totals = self.totals()
+		totals["total"] = time.perf_counter() - self.start
+		return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items())
+
+	def report(self):
+		return {
+			"id": self.id,
+			"model": self.model,
+			"stages": [
+				{"stage": stage, "start_ms": start * 1000, "duration_ms": seconds * 1000}
+				for stage, start, seconds in self.spans
+			],
+			"onnxruntime": self.onnxruntime,
+		}
+
+
+def start_timings(model, profile=False):
+	# timings of the current request (or bulk item / job), picked up by `stage` and the BatchProcessor
+	timings = Timings(model, profile)
+	current_timings.set(timings)
+	return timings
+
+
+@contextmanager
+def stage(name):
+	timings = current_timings.get()
+	if timings is None:
+		yield
+		return
+	with timings.stage(name):
+		yield
+
+
+class Profiler:
+	# Decides which requests are profiled (armed from the admin endpoint, or sampled) and keeps the
+	# most recent profiles.
+	def __init__(self, sample_rate: float = 0, max_profiles: int = 32):
+		self.sample_rate = sample_rate
+		self.max_profiles = max_profiles
+		self.armed = {}  # model -> number of upcoming requests to profile
+		self.profiles = OrderedDict()  # id -> report
+
+	def arm(self, model, count=1):
+		self.armed[model] = self.armed.get(model, 0) + count
+
+	def should_profile(self, model, requested=False):
+		if self.armed.get(model):
+			self.armed[model] -= 1
+			return True
+		return requested or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+	def save(self, timings):
+		self.profiles[timings.id] = timings.report()
+		while len(self.profiles) > self.max_profiles:
+			self.profiles.popitem(last=False)
+
+	def get(self, profile_id):
+		return self.profiles.get(profile_id)
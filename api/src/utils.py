@@ -1,11 +1,17 @@
 import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
-import geopandas as gpd
+from tqdm import tqdm
 import numpy as np
 import io
 
-EOTDL_API_URL = "https://api.eotdl.com/"
+EOTDL_API_URL = os.getenv("EOTDL_API_URL", "https://api.eotdl.com/")
 EOTDL_API_KEY = os.getenv("EOTDL_API_KEY")
+# (connect, read) timeouts in seconds, stalled connections fail (and downloads are retried) instead of hanging
+EOTDL_TIMEOUT = (float(os.getenv("EOTDL_CONNECT_TIMEOUT", 10)), float(os.getenv("EOTDL_READ_TIMEOUT", 60)))
+
+session = requests.Session()  # reuse connections across requests
 
 
 def format_response(response):
@@ -15,20 +21,22 @@ def format_response(response):
 
 
 def retrieve_model(name):
-    response = requests.get(EOTDL_API_URL + "models?name=" + name)
+    response = session.get(EOTDL_API_URL + "models?name=" + name, timeout=EOTDL_TIMEOUT)
     return format_response(response)
 
 
 def retrieve_model_catalog(model_id, version):
+    import geopandas as gpd  # slow to import, only needed when downloading models
+
     url = f"{EOTDL_API_URL}models/{model_id}/stage/catalog.v{version}.parquet"
     headers = {"X-API-Key": EOTDL_API_KEY}
-    response = requests.get(url, headers=headers)
+    response = session.get(url, headers=headers, timeout=EOTDL_TIMEOUT)
     data, error = format_response(response)
     if error:
         return None, error
     presigned_url = data["presigned_url"]
     # get parquet file from presigned url and load as geopandas dataframe
-    response = requests.get(presigned_url)
+    response = session.get(presigned_url, timeout=EOTDL_TIMEOUT)
     if response.status_code != 200:
         return None, f"Failed to download parquet file: {response.status_code}"
     # Load parquet from memory buffer
@@ -37,22 +45,108 @@ def retrieve_model_catalog(model_id, version):
     return gdf, None
 
 
-def download_file_url(url, path):
+def download_file_url(url, path, checksum=None, chunk_size=1024 * 1024, retries=3):
     file_name = url.split("/stage/")[-1] 
     file_path = f"{path}/{file_name}"
-    for i in range(1, len(file_path.split("/")) - 1):
-        os.makedirs("/".join(file_path.split("/")[: i + 1]), exist_ok=True)
-    headers = {"X-API-Key": EOTDL_API_KEY}
-    response = requests.get(url, headers=headers)
-    data, error = format_response(response)
-    if error:
-        return None, error
-    presigned_url = data["presigned_url"]
-    response = requests.get(presigned_url)
-    response.raise_for_status()  # This will raise an HTTPError for 4XX and 5XX status codes
-    with open(file_path, 'wb') as f:
-        f.write(response.content)
-    return file_path
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if os.path.exists(file_path) and (checksum is None or verify_checksum(file_path, checksum)):
+        return file_path
+    # download to a temporary file and move it once complete, partial downloads are resumed
+    part_path = file_path + ".part"
+    for attempt in range(retries):
+        try:
+            response = session.get(url, headers={"X-API-Key": EOTDL_API_KEY}, timeout=EOTDL_TIMEOUT)
+            data, error = format_response(response)
+            if error:
+                raise Exception(error)
+            presigned_url = data["presigned_url"]
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            with session.get(presigned_url, headers=headers, stream=True, timeout=EOTDL_TIMEOUT) as response:
+                if response.status_code == 416:  # already complete
+                    pass
+                else:
+                    response.raise_for_status()  # This will raise an HTTPError for 4XX and 5XX status codes
+                    mode = "ab" if response.status_code == 206 else "wb"
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+            if checksum is not None and not verify_checksum(part_path, checksum):
+                os.remove(part_path)
+                raise Exception(f"Checksum mismatch for {file_name}")
+            os.replace(part_path, file_path)
+            return file_path
+        except Exception:
+            if attempt == retries - 1:
+                raise
+
+
+def download_files(assets, path, max_workers=4, verbose=True):
+    # download (url, checksum) pairs concurrently
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(download_file_url, url, path, checksum) for url, checksum in assets]
+        for future in tqdm(as_completed(futures), total=len(futures), disable=not verbose):
+            future.result()
+    return [future.result() for future in futures]
+
+
+HASHES = {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}
+# multihash codes (https://github.com/multiformats/multicodec), blake2b/blake2s are handled apart
+MULTIHASHES = {
+    0x11: "sha1",
+    0x12: "sha256",
+    0x13: "sha512",
+    0x14: "sha3_512",
+    0x15: "sha3_384",
+    0x16: "sha3_256",
+    0x17: "sha3_224",
+    0x20: "sha384",
+    0xD5: "md5",
+}
+BLAKE2B, BLAKE2S = 0xB200, 0xB240  # + digest size in bytes (1 to 64 and 1 to 32)
+
+
+def read_varint(data):
+    # unsigned varint (LEB128) as used by multiformats, returns the value and the remaining bytes
+    value = 0
+    for i, byte in enumerate(data[:9]):
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value, data[i + 1 :]
+    raise ValueError("Invalid varint")
+
+
+def parse_multihash(checksum):
+    # <varint hash code><varint digest length><digest>, returns a new hash object and the hex digest
+    try:
+        code, data = read_varint(bytes.fromhex(checksum))
+        length, digest = read_varint(data)
+    except ValueError:
+        raise ValueError(f"Checksum format not supported: {checksum}")
+    if code in MULTIHASHES:
+        h = hashlib.new(MULTIHASHES[code])
+    elif BLAKE2B < code <= BLAKE2B + 64:
+        h = hashlib.blake2b(digest_size=code - BLAKE2B)
+    elif BLAKE2S < code <= BLAKE2S + 32:
+        h = hashlib.blake2s(digest_size=code - BLAKE2S)
+    else:
+        raise ValueError(f"Multihash code not supported: {code:#x}")
+    if length != len(digest) or length != h.digest_size:
+        raise ValueError(f"Invalid multihash digest length: {checksum}")
+    return h, digest.hex()
+
+
+def verify_checksum(file_path, checksum):
+    # checksums can be plain hex digests or multihashes (STAC file:checksum)
+    checksum = checksum.lower()
+    if len(checksum) in HASHES:
+        h, digest = hashlib.new(HASHES[len(checksum)]), checksum
+    else:
+        h, digest = parse_multihash(checksum)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest() == digest
 
 
 def sigmoid(x):
@@ -0,0 +1,144 @@
+# Optimized variants of a model (INT8 quantized, FP16), cached next to the model
+#
+# Variants are built with onnxruntime's quantization tools, by `python -m api.optimize` or when a
+# model is preloaded (MODEL_VARIANTS_BUILD=true), and served instead of the original model per
+# deployment (MODEL_VARIANT, or "variant" in ONNX_SESSION_CONFIG) or per request (variant form field).
+# Requests never build variants, those not built yet are not found.
+
+import os
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ORIGINAL = "original"
+VARIANTS = ("int8-dynamic", "int8-static", "fp16")
+MODEL_VARIANTS_BUILD = os.getenv("MODEL_VARIANTS_BUILD", "false")  # build the missing default variant when preloading
+VARIANT_CALIBRATION = os.getenv("VARIANT_CALIBRATION", None)  # directory of sample images for int8-static
+
+
+class VariantNotFoundError(Exception):
+    pass
+
+
+def variant_path(model_path, variant):
+    if variant == ORIGINAL:
+        return model_path
+    if variant not in VARIANTS:
+        raise ValueError(f"Model variant not supported: {variant}, use one of {', '.join((ORIGINAL, *VARIANTS))}")
+    return f"{model_path}.{variant}.onnx"
+
+
+class CalibrationReader:
+    # feeds preprocessed sample inputs to the static quantization calibration
+    def __init__(self, input_name, inputs):
+        self.input_name = input_name
+        self.inputs = iter(inputs)
+
+    def get_next(self):
+        x = next(self.inputs, None)
+        return None if x is None else {self.input_name: x}
+
+    def rewind(self):
+        pass
+
+
+def build_variant(model_path, variant, calibration=None):
+    # writes the variant of the model (if missing) and returns its path. `calibration` is a list of
+    # preprocessed inputs, required by int8-static
+    path = variant_path(model_path, variant)
+    if os.path.exists(path):
+        return path
+    import onnx  # only needed to build variants
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, QuantFormat
+
+    part = f"{path}.{os.getpid()}.part"
+    start = time.perf_counter()
+    try:
+        if variant == "int8-dynamic":
+            quantize_dynamic(model_path, part, weight_type=QuantType.QInt8)
+        elif variant == "int8-static":
+            if not calibration:
+                raise ValueError("Static quantization needs calibration inputs (see VARIANT_CALIBRATION)")
+            input_name = onnx.load(model_path, load_external_data=False).graph.input[0].name
+            quantize_static(model_path, part, CalibrationReader(input_name, calibration), quant_format=QuantFormat.QDQ)
+        elif variant == "fp16":
+            from onnxruntime.transformers.float16 import convert_float_to_float16
+            # inputs and outputs stay float32, so preprocessing and post-processing are unchanged
+            onnx.save(convert_float_to_float16(onnx.load(model_path), keep_io_types=True), part)
+        os.replace(part, path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+    logger.info(f"Built {variant} variant of {model_path} in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+def sample_paths(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".jp2", ".npy")
+    )
+
+
+def load_samples(model, paths, max_pixels=None):
+    # preprocessed (1, bands, height, width) inputs of the model for sample images
+    from .decode import open_raster, read_tensor
+
+    inputs = []
+    for path in paths:
+        try:
+            if path.endswith(".npy"):
+                with open(path, "rb") as f:
+                    image, band_names = read_tensor(f, max_pixels), None
+            else:
+                with open_raster(path, max_pixels) as source:
+                    image, band_names = source.read(), source.band_names
+            inputs.append(model.process_inputs(image, band_names)[0])
+        except Exception as e:
+            logger.warning(f"Skipping sample {path}: {e}")
+    return inputs
+
+
+def agreement(reference, outputs):
+    # share of the predictions (classes, or mask pixels above 0) that match the original model
+    if reference.ndim >= 2 and reference.shape[1] > 1:
+        return float((reference.argmax(axis=1) == outputs.argmax(axis=1)).mean())
+    return float(((reference > 0) == (outputs > 0)).mean())
+
+
+def compare_variants(model, variants, inputs, runs=5):
+    # accuracy (against the original model) and latency of each variant on the same inputs
+    results = {}
+    references = None
+    for variant in (ORIGINAL, *[v for v in variants if v != ORIGINAL]):
+        wrapper = model.with_variant(variant)
+        wrapper.load()
+        outputs = [wrapper.predict(x) for x in inputs]  # also warms up the session
+        timings = []
+        for _ in range(runs):
+            for x in inputs:
+                start = time.perf_counter()
+                wrapper.predict(x)
+                timings.append(time.perf_counter() - start)
+        timings = np.asarray(timings) * 1000
+        result = {
+            "path": wrapper.session_path,
+            "size_bytes": os.path.getsize(wrapper.session_path),
+            "mean_ms": float(timings.mean()),
+            "p50_ms": float(np.percentile(timings, 50)),
+            "p90_ms": float(np.percentile(timings, 90)),
+        }
+        if references is None:
+            references = outputs
+        else:
+            errors = [np.abs(o.astype(np.float32) - r.astype(np.float32)) for o, r in zip(outputs, references)]
+            result.update({
+                "max_abs_error": float(max(e.max() for e in errors)),
+                "mean_abs_error": float(np.mean([e.mean() for e in errors])),
+                "agreement": float(np.mean([agreement(r, o) for o, r in zip(outputs, references)])),
+                "speedup": results[ORIGINAL]["mean_ms"] / result["mean_ms"],
+            })
+        results[variant] = result
+    return results
@@ -0,0 +1,81 @@
+import time
+import logging
+import importlib
+
+logger = logging.getLogger(__name__)
+
+# imported in the background once the server is up, instead of delaying the first response
+HEAVY_MODULES = ["onnxruntime", "rasterio", "rasterio.windows", "skimage.transform", "geopandas", "pyarrow.parquet"]
+
+
+class Warmup:
+	# Startup work done after the socket is bound (heavy imports, then the preloaded models), so the
+	# process answers liveness probes right away and reports readiness once it is done. Models that
+	# fail to load (e.g. EOTDL unavailable) are retried with exponential backoff, and once `attempts`
+	# are exhausted the process reports itself as not alive, so it gets restarted.
+	def __init__(self, models, modules=HEAVY_MODULES, attempts=5, backoff=2.0, max_backoff=60.0):
+		self.models = models  # [(model, version)], see parse_model_list
+		self.modules = modules
+		self.attempts = attempts
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.started_at = time.time()
+		self.done = False
+		self.failed = False
+		self.imports = "pending"
+		self.model_status = {self.name(model, version): "pending" for model, version in models}
+
+	@staticmethod
+	def name(model, version):
+		return model if version is None else f"{model}:{version}"
+
+	@property
+	def ready(self):
+		return self.done and all(status == "loaded" for status in self.model_status.values())
+
+	@property
+	def alive(self):
+		return not self.failed
+
+	def run(self, load):
+		# blocking, run it in a thread. `load(model, version)` loads a model (e.g. registry.preload)
+		try:
+			start = time.perf_counter()
+			self.imports = "loading"
+			for module in self.modules:
+				try:
+					importlib.import_module(module)
+				except ImportError as e:  # optional module, loaded (and reported) when it is needed
+					logger.warning(f"Could not import {module}: {e}")
+			self.imports = "loaded"
+			logger.info(f"Imported modules in {time.perf_counter() - start:.2f}s")
+			pending = list(self.models)
+			for attempt in range(1, self.attempts + 1):
+				failed = []
+				for model, version in pending:
+					name = self.name(model, version)
+					self.model_status[name] = "loading"
+					try:
+						load(model, version)
+						self.model_status[name] = "loaded"
+					except Exception as e:
+						logger.error(f"Error preloading model {name} (attempt {attempt} of {self.attempts}): {e}")
+						self.model_status[name] = f"error: {e}"
+						failed.append((model, version))
+				pending = failed
+				if not pending:
+					break
+				if attempt < self.attempts:
+					time.sleep(min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
+			self.failed = bool(pending)
+		finally:
+			self.done = True
+
+	def status(self):
+		return {
+			"ready": self.ready,
+			"alive": self.alive,
+			"uptime": time.time() - self.started_at,
+			"imports": self.imports,
+			"models": self.model_status,
+		}
@@ -0,0 +1,58 @@
+import time
+import asyncio
+import logging
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker(queue, process, concurrency=4, poll_interval=1.0, ttl=None, cleanup_interval=60.0):
+	# Claims jobs from the queue and runs `process(job)` with up to `concurrency` jobs in flight.
+	# Jobs of the same model run concurrently, so they are packed into the same batches.
+	# With `ttl`, jobs finished more than `ttl` seconds ago are removed every `cleanup_interval`.
+	running = set()
+	cleaned_at = 0.0
+	try:
+		while True:
+			if ttl is not None and time.monotonic() - cleaned_at > cleanup_interval:
+				cleaned_at = time.monotonic()
+				try:
+					removed = await run_in_threadpool(queue.cleanup, ttl)
+					if removed:
+						logger.info(f"Removed {removed} finished jobs")
+				except Exception as e:
+					logger.error(f"Error cleaning up jobs: {e}")
+			free = concurrency - len(running)
+			jobs = await run_in_threadpool(queue.claim, free) if free > 0 else []
+			for job in jobs:
+				running.add(asyncio.ensure_future(run_job(queue, process, job)))
+			if running and (not jobs or len(running) >= concurrency):
+				_, running = await asyncio.wait(running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+			elif not jobs:
+				await asyncio.sleep(poll_interval)
+	finally:
+		# unfinished jobs are queued again once JOBS_TIMEOUT expires
+		for task in running:
+			task.cancel()
+
+
+async def run_job(queue, process, job):
+	heartbeat = asyncio.ensure_future(keep_alive(queue, job["id"]))
+	try:
+		result_path, media_type = await process(job)
+		await run_in_threadpool(queue.complete, job["id"], result_path, media_type)
+	except Exception as e:
+		logger.error(f"Error in job {job['id']}: {e}")
+		await run_in_threadpool(queue.fail, job["id"], str(e))
+	finally:
+		heartbeat.cancel()
+
+
+async def keep_alive(queue, job_id):
+	# jobs running longer than the queue timeout are not queued again while this worker is alive
+	while True:
+		await asyncio.sleep(queue.timeout / 3)
+		try:
+			await run_in_threadpool(queue.heartbeat, job_id)
+		except Exception as e:
+			logger.error(f"Error in heartbeat of job {job_id}: {e}")
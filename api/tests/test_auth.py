@@ -86,10 +86,8 @@ def test_model_endpoint_with_auth_invalid_key(client_with_api_key):
 
 def test_model_endpoint_with_auth_valid_key(client_with_api_key):
     """Test model endpoint when API key is required and valid key is provided"""
-    # Mock the ModelWrapper to avoid actual model loading
-    with patch("api.main.ModelWrapper") as mock_model:
-        mock_instance = mock_model.return_value
-        mock_instance.gdf.to_json.return_value = '{"test": "data"}'
+    # Mock the model metadata to avoid retrieving it from EOTDL
+    with patch("api.main.model_metadata", return_value=(b'{"test": "data"}', '"etag"')):
         response = client_with_api_key.get("/test_model", headers={"X-API-Key": "test_key"})
         assert response.status_code == 200
 
@@ -0,0 +1,65 @@
+import asyncio
+import numpy as np
+
+from api.src.autotune import BatchTuner
+from api.src.batch import BatchProcessor
+
+
+def arrivals(tuner, rate, seconds=2.0):
+	for i in range(int(rate * seconds)):
+		tuner.record_arrival(now=i / rate)
+	return seconds
+
+
+def test_low_arrival_rate_keeps_batches_small():
+	tuner = BatchTuner("fake", slo=0.5, max_batch_size=16, max_timeout=1.0)
+	now = arrivals(tuner, rate=1)
+	tuner.record_batch(1, 0.01)
+	assert tuner.update(now)
+	assert tuner.batch_size == 1
+
+
+def test_high_arrival_rate_grows_batches_within_slo():
+	tuner = BatchTuner("fake", slo=0.5, max_batch_size=16, max_timeout=1.0)
+	now = arrivals(tuner, rate=400)
+	tuner.record_batch(1, 0.01)
+	tuner.record_batch(16, 0.025)
+	assert tuner.update(now)
+	assert 1 < tuner.batch_size < 16
+	assert tuner.batch_size / tuner.cost(tuner.batch_size) >= 400
+	assert tuner.timeout + tuner.cost(tuner.batch_size) <= 0.5
+
+
+def test_timeout_shrinks_while_slo_is_missed():
+	tuners = []
+	for latency in (0.05, 0.3):
+		tuner = BatchTuner("fake", slo=0.1, max_batch_size=16, max_timeout=1.0)
+		now = arrivals(tuner, rate=400)
+		tuner.record_batch(1, 0.01)
+		tuner.record_batch(16, 0.025)
+		for _ in range(20):
+			tuner.record_latency(latency)
+		assert tuner.update(now)
+		assert not tuner.update(now + 0.5)  # at most once per interval
+		tuners.append(tuner)
+	met, missed = tuners
+	assert missed.batch_size == met.batch_size
+	assert missed.timeout < met.timeout
+
+
+def test_processor_follows_tuner():
+	class Model:
+		model_name = "fake"
+
+		def predict(self, x):
+			return x * 2
+
+	tuner = BatchTuner("fake", slo=0.5, max_batch_size=8, max_timeout=0.05, interval=0)
+	processor = BatchProcessor(Model(), batch_size=8, timeout=0.05, tuner=tuner)
+	assert processor.batch_size == 1
+	async def run():
+		return await asyncio.gather(*[processor.submit(np.ones((1, 3, 4, 4), np.float32)) for _ in range(8)])
+	results = asyncio.run(run())
+	assert all((result == 2).all() for result in results)
+	assert tuner.costs and len(tuner.arrivals) == 8
+	assert (processor.batch_size, processor.timeout) == (tuner.batch_size, tuner.timeout)
@@ -0,0 +1,98 @@
+import asyncio
+import numpy as np
+import pytest
+
+from api.src.batch import BatchProcessor
+
+
+class FakeModel:
+	model_name = "fake"
+	version = 1
+
+	def __init__(self):
+		self.batches = []
+
+	def predict(self, x):
+		self.batches.append(x.shape)
+		if np.isnan(x).any():
+			raise ValueError("nan in batch")
+		return x * 2
+
+
+def image(h, w, value=1.0):
+	return np.full((1, 3, h, w), value, dtype=np.float32)
+
+
+def test_full_batch_is_dispatched():
+	model = FakeModel()
+	processor = BatchProcessor(model, batch_size=2, timeout=10)
+	async def run():
+		return await asyncio.gather(processor.submit(image(4, 4, 1)), processor.submit(image(4, 4, 2)))
+	a, b = asyncio.run(run())
+	assert model.batches == [(2, 3, 4, 4)]
+	assert (a == 2).all() and (b == 4).all()
+
+
+def test_different_shapes_are_not_mixed():
+	model = FakeModel()
+	processor = BatchProcessor(model, batch_size=2, timeout=0.01)
+	async def run():
+		return await asyncio.gather(processor.submit(image(4, 4)), processor.submit(image(8, 8)))
+	a, b = asyncio.run(run())
+	assert sorted(model.batches) == [(1, 3, 4, 4), (1, 3, 8, 8)]
+	assert a.shape == (3, 4, 4) and b.shape == (3, 8, 8)
+
+
+def test_padding_buckets_nearby_sizes():
+	model = FakeModel()
+	processor = BatchProcessor(model, batch_size=2, timeout=10, pad_to=8)
+	async def run():
+		return await asyncio.gather(processor.submit(image(5, 6)), processor.submit(image(8, 7)))
+	a, b = asyncio.run(run())
+	assert model.batches == [(2, 3, 8, 8)]
+	assert a.shape == (3, 5, 6) and b.shape == (3, 8, 7)
+
+
+def test_deadline_of_oldest_request():
+	model = FakeModel()
+	processor = BatchProcessor(model, batch_size=8, timeout=10)
+	async def run():
+		return await asyncio.wait_for(
+			asyncio.gather(processor.submit(image(4, 4), budget=0.01), processor.submit(image(4, 4))),
+			timeout=1,
+		)
+	asyncio.run(run())
+	assert model.batches == [(2, 3, 4, 4)]
+
+
+def test_error_only_fails_its_request():
+	model = FakeModel()
+	processor = BatchProcessor(model, batch_size=2, timeout=10)
+	async def run():
+		return await asyncio.gather(
+			processor.submit(image(4, 4, 1)),
+			processor.submit(image(4, 4, np.nan)),
+			return_exceptions=True,
+		)
+	ok, error = asyncio.run(run())
+	assert (ok == 2).all()
+	assert isinstance(error, ValueError)
+
+
+def test_postprocess_runs_once_per_batch():
+	model = FakeModel()
+	calls = []
+	def postprocess(outputs):
+		calls.append(outputs.shape)
+		return (outputs[:, 0] > 3).astype(np.uint8)
+	processor = BatchProcessor(model, batch_size=3, timeout=10, pad_to=8, postprocess=postprocess)
+	async def run():
+		return await asyncio.gather(
+			processor.submit(image(5, 6, 1)),
+			processor.submit(image(8, 8, 2)),
+			processor.submit(image(8, 8, 2), postprocess=False),
+		)
+	a, b, raw = asyncio.run(run())
+	assert calls == [(3, 3, 8, 8)]
+	assert a.shape == (5, 6) and a.dtype == np.uint8 and (a == 0).all() and (b == 1).all()
+	assert raw.shape == (3, 8, 8) and (raw == 4).all()
@@ -0,0 +1,83 @@
+import asyncio
+import numpy as np
+import pytest
+
+from api.src.batch import BatchProcessor
+from api.src.batch_server import serve, RemoteProcessor
+from api.src.timing import start_timings
+from api.src.executor import QueueFullError
+
+
+class FakeModel:
+	model_name = "fake"
+	version = 1
+
+	def __init__(self):
+		self.batches = []
+
+	def predict(self, x):
+		self.batches.append(x.shape)
+		if np.isnan(x).any():
+			raise ValueError("nan in batch")
+		return x * 2
+
+
+def test_remote_requests_share_batches(tmp_path):
+	model = FakeModel()
+	path = str(tmp_path / "batch.sock")
+
+	async def run():
+		processor = BatchProcessor(model, batch_size=2, timeout=10)
+		requested = []
+
+		async def get_processor(name, version, variant):
+			requested.append((name, version, variant))
+			return processor
+
+		server = asyncio.create_task(serve(path, get_processor))
+		while not (tmp_path / "batch.sock").exists():
+			await asyncio.sleep(0.01)
+		remote = RemoteProcessor(path, "fake", 1, variant="fp16")
+
+		async def submit(value):
+			timings = start_timings("fake")
+			result = await remote.submit(np.full((1, 3, 4, 4), value, dtype=np.float32))
+			return result, timings.totals()
+
+		try:
+			results = await asyncio.gather(submit(1), submit(2))
+			bad = np.full((1, 3, 4, 4), np.nan, dtype=np.float32)
+			try:
+				await asyncio.gather(remote.submit(bad), remote.submit(bad))
+				error = None
+			except Exception as e:
+				error = str(e)
+		finally:
+			server.cancel()
+		return results, requested, error
+
+	[(a, a_stages), (b, b_stages)], requested, error = asyncio.run(run())
+	assert model.batches[0] == (2, 3, 4, 4)  # both clients in one batch
+	assert (a == 2).all() and (b == 4).all() and a.shape == (3, 4, 4)
+	assert "batch_wait" in a_stages and "inference" in b_stages
+	assert requested[0] == ("fake", 1, "fp16")
+	assert error == "nan in batch"
+
+
+def test_remote_errors_keep_their_type(tmp_path):
+	path = str(tmp_path / "batch.sock")
+
+	async def run():
+		async def get_processor(name, version, variant):
+			raise QueueFullError("Inference queue for model fake is full")
+
+		server = asyncio.create_task(serve(path, get_processor))
+		while not (tmp_path / "batch.sock").exists():
+			await asyncio.sleep(0.01)
+		try:
+			with pytest.raises(QueueFullError):  # a 503, as in a single process
+				await RemoteProcessor(path, "fake", 1).submit(np.zeros((1, 3, 4, 4), dtype=np.float32))
+		finally:
+			server.cancel()
+
+	asyncio.run(run())
@@ -0,0 +1,23 @@
+import json
+import pytest
+
+pytest.importorskip("onnx")
+
+from api import benchmark
+
+
+def test_report_and_compare(tmp_path):
+	output = tmp_path / "report.json"
+	args = ["--batch-sizes", "2", "--image-sizes", "32", "--concurrency", "2", "--requests", "4", "--layers", "1"]
+	assert benchmark.main(args + ["--output", str(output)]) == 0
+	report = json.loads(output.read_text())
+	assert [result["task"] for result in report["results"]] == ["classification", "segmentation"]
+	for result in report["results"]:
+		assert set(result["stages"]) == set(benchmark.STAGES)
+		assert result["stages"]["total"]["count"] == 4 and result["throughput_rps"] > 0
+	assert benchmark.compare(report, report) == []
+	slower = json.loads(output.read_text())
+	slower["results"][0]["stages"]["inference"]["p50_ms"] *= 2
+	(tmp_path / "slower.json").write_text(json.dumps(slower))
+	assert [r["stage"] for r in benchmark.compare(report, slower)] == ["inference"]
+	assert benchmark.main(["--compare", str(output), str(tmp_path / "slower.json")]) == 1
@@ -0,0 +1,55 @@
+import asyncio
+import numpy as np
+import pytest
+
+pytest.importorskip("onnx")
+
+from api.src.buffers import BufferPool
+from api.src.batch import BatchProcessor
+from api.src.eotdl_wrapper import ModelWrapper
+from api.src.synthetic import make_model, make_index
+
+
+@pytest.fixture
+def model(tmp_path):
+	# tiny segmentation model (mean over bands) with its catalog, served without EOTDL
+	make_model(str(tmp_path), "mean", "segmentation")
+	make_index(str(tmp_path), ["mean"])
+	return ModelWrapper("mean", path=str(tmp_path), verbose=False)
+
+
+def test_buffer_pool_reuses_arrays():
+	pool = BufferPool(max_free=1)
+	a = pool.acquire((2, 3), np.float32)
+	pool.release(a)
+	assert pool.acquire((2, 3), np.float32) is a
+	assert pool.acquire((2, 3), np.float32) is not a
+	pool.release(np.empty((2, 3), np.float32))
+	pool.release(np.empty((2, 3), np.float32))
+	assert pool.nbytes() == 24
+
+
+def test_predict_into_bound_output(model):
+	x = np.random.rand(2, 3, 32, 32).astype(np.float32)
+	out = np.empty((2, 1, 32, 32), dtype=np.float32)
+	result = model.predict(x, out)
+	assert result is out
+	np.testing.assert_allclose(out, x.mean(axis=1, keepdims=True), rtol=1e-5)
+	assert model.output_shape((4, 3, 32, 32)) == (4, 1, 32, 32)
+	assert model.output_shape((4, 3, 64, 64)) is None
+
+
+def test_batches_reuse_buffers(model):
+	pool = BufferPool()
+	processor = BatchProcessor(model, batch_size=2, timeout=10, buffers=pool)
+	images = [np.random.rand(1, 3, 32, 32).astype(np.float32) for _ in range(6)]
+	async def run():
+		results = []
+		for i in range(0, 6, 2):
+			results += await asyncio.gather(processor.submit(images[i]), processor.submit(images[i + 1]))
+		return results
+	results = asyncio.run(run())
+	for image, result in zip(images, results):
+		np.testing.assert_allclose(result, image[0].mean(axis=0, keepdims=True), rtol=1e-5)
+	# one input and one output buffer, reused by every batch
+	assert pool.nbytes() == 2 * 3 * 32 * 32 * 4 + 2 * 1 * 32 * 32 * 4
@@ -0,0 +1,80 @@
+import io
+import asyncio
+import tarfile
+import pytest
+
+from api.src.bulk import as_completed_bounded, discard_on_cancel, tar_bytes, tar_file, tar_end, parse_locations, manifest_location
+
+
+def test_bounded_concurrency_and_errors():
+	in_flight, peak = 0, 0
+	async def run(item):
+		nonlocal in_flight, peak
+		in_flight += 1
+		peak = max(peak, in_flight)
+		await asyncio.sleep(0.01 * (item % 3))
+		in_flight -= 1
+		if item == 5:
+			raise ValueError("bad item")
+		return item * 2
+	async def collect():
+		return [result async for result in as_completed_bounded(range(10), run, concurrency=3)]
+	results = asyncio.run(collect())
+	assert peak == 3
+	assert sorted(index for index, *_ in results) == list(range(10))
+	for index, item, result, error in results:
+		if item == 5:
+			assert isinstance(error, ValueError)
+		else:
+			assert result == item * 2 and error is None
+
+
+def test_unsent_results_are_discarded():
+	discarded = []
+	async def run(item):
+		if item >= 2:
+			await asyncio.sleep(10)
+		return item  # items 0 and 1 complete together
+	async def consume():
+		results = as_completed_bounded(range(4), run, concurrency=4, discard=discarded.append)
+		first = await results.__anext__()
+		await results.aclose()  # e.g. the client disconnected
+		return first
+	first = asyncio.run(consume())
+	assert discarded == [1 - first[2]]  # finished but not sent, the others were cancelled
+
+	async def cancelled():
+		write = asyncio.ensure_future(discard_on_cancel(asyncio.sleep(0.01, "mask.tif"), discarded.append))
+		await asyncio.sleep(0)
+		write.cancel()
+		await asyncio.sleep(0.05)
+	discarded.clear()
+	asyncio.run(cancelled())
+	assert discarded == ["mask.tif"]  # removed once written
+
+
+def test_tar_stream(tmp_path):
+	path = tmp_path / "mask.tif"
+	path.write_bytes(b"x" * 1000)
+	stream = tar_bytes("a.json", b"{}") + b"".join(tar_file("b.tif", str(path))) + tar_end()
+	assert not path.exists()
+	with tarfile.open(fileobj=io.BytesIO(stream)) as tar:
+		assert [(m.name, m.size) for m in tar.getmembers()] == [("a.json", 2), ("b.tif", 1000)]
+		assert tar.extractfile("b.tif").read() == b"x" * 1000
+
+
+def test_manifest_locations(tmp_path):
+	allowed = parse_locations("s3://bucket, https://data.example.com")
+	assert manifest_location("s3://bucket/scene.tif", allowed=allowed) == "s3://bucket/scene.tif"
+	assert manifest_location("scene.tif", str(tmp_path)) == str(tmp_path / "scene.tif")
+	for item in [
+		"s3://other/scene.tif",
+		"https://evil.example.com/scene.tif",
+		"http://169.254.169.254/latest",
+		"file:///tmp/x.tif",
+		"/vsisubfile/0_0,/tmp/x.tif",
+		"/vsis3/bucket/scene.tif",
+		"../x.tif",
+	]:
+		with pytest.raises(Exception, match="not allowed"):
+			manifest_location(item, str(tmp_path), allowed)
@@ -0,0 +1,87 @@
+import asyncio
+import numpy as np
+import pytest
+
+from api.src.cache import ResultCache, cache_key
+from api.src.deadlines import DeadlineExceededError
+
+
+def test_cache_key():
+	x = np.arange(12, dtype=np.float32).reshape(1, 3, 2, 2)
+	assert cache_key("model", 1, x) == cache_key("model", 1, x.copy())
+	assert cache_key("model", 1, x) != cache_key("model", 2, x)
+	assert cache_key("model", 1, x) != cache_key("model", 1, x.reshape(1, 3, 4, 1))
+	assert cache_key("model", 1, x) != cache_key("model", 1, x.astype(np.float64))
+
+
+def test_coalesce_and_evict():
+	cache = ResultCache(max_bytes=2 * 8 * 4)
+	calls = []
+	async def compute(value):
+		calls.append(value)
+		await asyncio.sleep(0.01)
+		return np.full(8, value, dtype=np.float32)
+	async def run():
+		results = await asyncio.gather(*[cache.get_or_compute("a", lambda: compute(1), "model") for _ in range(5)])
+		assert calls == [1] and all((result == 1).all() for result in results)
+		await cache.get_or_compute("b", lambda: compute(2), "model")
+		await cache.get_or_compute("a", lambda: compute(1), "model")  # hit, "b" is now the oldest
+		await cache.get_or_compute("c", lambda: compute(3), "model")
+		assert list(cache.entries) == ["a", "c"] and cache.nbytes == 2 * 8 * 4
+		with pytest.raises(ValueError):
+			cache.entries["a"][0] = 0  # shared between requests
+	asyncio.run(run())
+	assert calls == [1, 2, 3]
+
+
+def test_errors_are_not_cached():
+	cache = ResultCache(max_bytes=1024)
+	async def fail():
+		raise RuntimeError("inference failed")
+	async def run():
+		with pytest.raises(RuntimeError):
+			await cache.get_or_compute("a", fail, "model")
+		assert not cache.pending and not cache.entries
+	asyncio.run(run())
+
+
+def test_request_errors_are_not_shared():
+	cache = ResultCache(max_bytes=1024)
+	calls = []
+	async def compute(error=None):
+		calls.append(error)
+		await asyncio.sleep(0.01)
+		if error is not None:
+			raise error
+		return np.ones(2, dtype=np.float32)
+	async def run():
+		leader = asyncio.ensure_future(cache.get_or_compute("a", lambda: compute(DeadlineExceededError("expired")), "model"))
+		await asyncio.sleep(0)
+		waiter = asyncio.ensure_future(cache.get_or_compute("a", compute, "model"))
+		with pytest.raises(DeadlineExceededError):
+			await leader
+		assert (await waiter == 1).all()  # computed again for the waiting request
+		# inference errors are shared
+		leader = asyncio.ensure_future(cache.get_or_compute("b", lambda: compute(RuntimeError("failed")), "model"))
+		await asyncio.sleep(0)
+		waiter = asyncio.ensure_future(cache.get_or_compute("b", compute, "model"))
+		for future in (leader, waiter):
+			with pytest.raises(RuntimeError):
+				await future
+	asyncio.run(run())
+	assert len(calls) == 3
+
+
+def test_disk_tier(tmp_path):
+	async def compute():
+		return np.ones((2, 4, 4), dtype=np.float32)
+	async def fail():
+		raise AssertionError("should be cached")
+	cache = ResultCache(max_bytes=1024, path=str(tmp_path), max_disk_bytes=500)
+	asyncio.run(cache.get_or_compute("a", compute, "model"))
+	assert (tmp_path / "a.npy").exists()
+	# a new cache (e.g. after a restart) finds results on disk
+	cache = ResultCache(max_bytes=1024, path=str(tmp_path), max_disk_bytes=500)
+	assert (asyncio.run(cache.get_or_compute("a", fail, "model")) == 1).all()
+	asyncio.run(cache.get_or_compute("b", compute, "model"))
+	assert not (tmp_path / "a.npy").exists() and (tmp_path / "b.npy").exists()
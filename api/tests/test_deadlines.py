@@ -0,0 +1,94 @@
+import time
+import asyncio
+import numpy as np
+import pytest
+
+from api.src.batch import BatchProcessor
+from api.src.executor import InferenceExecutor
+from api.src.deadlines import start_deadline, parse_deadline, cancel_on_disconnect, DeadlineExceededError, ClientDisconnectedError, InvalidDeadlineError, INTERACTIVE, BULK
+
+
+class FakeModel:
+	model_name = "fake"
+	version = 1
+
+	def __init__(self):
+		self.batches = []
+
+	def predict(self, x):
+		self.batches.append(x[:, 0, 0, 0].tolist())
+		return x * 2
+
+
+def image(value=1.0):
+	return np.full((1, 3, 4, 4), value, dtype=np.float32)
+
+
+def test_expired_requests_are_dropped_before_batching():
+	model = FakeModel()
+	processor = BatchProcessor(model, batch_size=4, timeout=0.2)
+	async def request(value, timeout):
+		start_deadline(timeout)
+		return await processor.submit(image(value))
+	async def run():
+		return await asyncio.gather(request(1, 0.05), request(2, None), return_exceptions=True)
+	expired, result = asyncio.run(run())
+	assert isinstance(expired, DeadlineExceededError)
+	assert (result == 4).all()
+	assert model.batches == [[2.0]]  # flushed early for the expiring request, which was not inferred
+
+
+def test_requests_that_cannot_meet_their_deadline_are_shed():
+	processor = BatchProcessor(FakeModel(), batch_size=1, timeout=0.01)
+	processor.inference_time = 0.5
+	async def run():
+		start_deadline(0.1)
+		return await processor.submit(image())
+	with pytest.raises(DeadlineExceededError, match="cannot complete"):
+		asyncio.run(run())
+	assert processor.queue_depth() == 0
+
+
+def test_interactive_requests_are_batched_first():
+	class SlowModel(FakeModel):
+		def predict(self, x):
+			time.sleep(0.05)
+			return super().predict(x)
+
+	model = SlowModel()
+	processor = BatchProcessor(model, InferenceExecutor("fake", max_workers=1), batch_size=2, timeout=0.01)
+	async def request(value, priority):
+		start_deadline(priority=priority)
+		return await processor.submit(image(value))
+	async def run():
+		first = asyncio.ensure_future(request(1, BULK))
+		await asyncio.sleep(0.02)  # its batch occupies the only inference slot, the next ones wait
+		return await asyncio.gather(first, request(2, BULK), request(3, BULK), request(4, "interactive"))
+	asyncio.run(run())
+	assert model.batches[:2] == [[1.0], [4.0, 2.0]]
+
+
+def test_disconnected_clients_are_dropped():
+	class Request:
+		async def is_disconnected(self):
+			return True
+
+	model = FakeModel()
+	processor = BatchProcessor(model, batch_size=2, timeout=0.05)
+	async def run():
+		with pytest.raises(ClientDisconnectedError):
+			await cancel_on_disconnect(Request(), processor.submit(image()), interval=0.01)
+		await asyncio.sleep(0.1)
+	asyncio.run(run())
+	assert model.batches == [] and processor.queue_depth() == 0
+
+
+def test_parse_deadline():
+	deadline = parse_deadline("1.5", "interactive")
+	assert 0 < deadline.remaining() <= 1.5 and deadline.priority == INTERACTIVE
+	assert parse_deadline(None).remaining() is None
+	assert parse_deadline("", BULK).priority == BULK
+	assert parse_deadline(None, INTERACTIVE, cap=BULK).priority == BULK  # bulk endpoints stay bulk
+	for timeout, priority in [("soon", INTERACTIVE), ("-1", INTERACTIVE), ("nan", INTERACTIVE), ("1", "urgent")]:
+		with pytest.raises(InvalidDeadlineError):
+			parse_deadline(timeout, priority)
@@ -0,0 +1,60 @@
+import io
+import tempfile
+import numpy as np
+import pytest
+import rasterio as rio
+
+from api.src.decode import (
+	spool_upload, open_raster, open_tensor, read_tensor, encode_tensor, is_tensor, InputTooLargeError, NPY_MEDIA_TYPE
+)
+
+
+def geotiff(data):
+	file = tempfile.SpooledTemporaryFile(max_size=1024)
+	with rio.MemoryFile() as memfile:
+		with memfile.open(driver="GTiff", count=data.shape[0], height=data.shape[1], width=data.shape[2], dtype=data.dtype) as dst:
+			dst.write(data)
+		file.write(memfile.read())
+	return file
+
+
+@pytest.mark.parametrize("size", [4, 64])  # in memory and rolled to disk
+def test_windowed_read(size):
+	data = np.arange(3 * size * size, dtype=np.uint16).reshape(3, size, size)
+	file = geotiff(data)
+	with spool_upload(file) as path, open_raster(path) as source:
+		assert source.shape == data.shape
+		np.testing.assert_array_equal(source[:, 1:3, 2:size], data[:, 1:3, 2:size])
+		np.testing.assert_array_equal(source.read(), data)
+
+
+def test_oversized_input_is_rejected():
+	file = geotiff(np.zeros((1, 32, 32), dtype=np.uint8))
+	with spool_upload(file) as path:
+		with pytest.raises(InputTooLargeError):
+			with open_raster(path, max_pixels=100):
+				pass
+
+
+def test_tensor_roundtrip():
+	array = np.arange(2 * 3 * 4, dtype=np.uint16).reshape(2, 3, 4)
+	for data in (array, np.asfortranarray(array)):
+		f = io.BytesIO()
+		np.save(f, data)
+		with open_tensor(f) as source:
+			assert source.shape == (2, 3, 4) and source.profile is None
+			np.testing.assert_array_equal(source.read(), array)
+			np.testing.assert_array_equal(source[:, 1:, :2], array[:, 1:, :2])
+	np.testing.assert_array_equal(np.load(io.BytesIO(encode_tensor(array[:, ::2]))), array[:, ::2])
+	assert is_tensor("image.npy") and is_tensor("blob", NPY_MEDIA_TYPE) and not is_tensor("image.tif", "image/tiff")
+
+
+def test_tensor_rejected_before_reading():
+	f = io.BytesIO()
+	np.save(f, np.zeros((3, 100, 100), dtype=np.uint8))
+	with pytest.raises(InputTooLargeError):
+		read_tensor(f, max_pixels=100)
+	f = io.BytesIO()
+	np.save(f, np.array([None, 1], dtype=object), allow_pickle=True)
+	with pytest.raises(ValueError):
+		read_tensor(f)
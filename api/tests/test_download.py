@@ -0,0 +1,102 @@
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+from api.src import utils
+from api.src.utils import download_file_url, download_files, verify_checksum
+
+CONTENT = bytes(range(256)) * 4096
+
+
+class StandIn(BaseHTTPRequestHandler):
+	# minimal EOTDL API + object storage with Range support
+	ranges = []
+	stalls = 0  # responses that stop sending data halfway
+
+	def do_GET(self):
+		if "/stage/" in self.path:
+			name = self.path.split("/stage/")[-1]
+			body = json.dumps({"presigned_url": f"http://{self.headers['Host']}/files/{name}"}).encode()
+			self.send_response(200)
+		else:
+			start = 0
+			if "Range" in self.headers:
+				start = int(self.headers["Range"].split("=")[1].split("-")[0])
+				StandIn.ranges.append(start)
+			body = CONTENT[start:]
+			self.send_response(206 if start else 200)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		if "/files/" in self.path and StandIn.stalls:
+			StandIn.stalls -= 1
+			self.wfile.write(body[:len(body) // 2])
+			self.wfile.flush()
+			time.sleep(5)
+			return
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+@pytest.fixture
+def server():
+	server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	StandIn.ranges, StandIn.stalls = [], 0
+	yield f"http://127.0.0.1:{server.server_port}"
+	server.shutdown()
+
+
+def test_download_with_checksum(server, tmp_path):
+	checksum = hashlib.sha1(CONTENT).hexdigest()
+	path = download_file_url(f"{server}/models/1/stage/model.onnx", tmp_path, checksum)
+	assert open(path, "rb").read() == CONTENT
+	assert not (tmp_path / "model.onnx.part").exists()
+
+
+def test_resume_partial_download(server, tmp_path):
+	(tmp_path / "model.onnx.part").write_bytes(CONTENT[:1000])
+	path = download_file_url(f"{server}/models/1/stage/model.onnx", tmp_path)
+	assert StandIn.ranges == [1000]
+	assert open(path, "rb").read() == CONTENT
+
+
+def test_stalled_download_is_retried(server, tmp_path, monkeypatch):
+	monkeypatch.setattr(utils, "EOTDL_TIMEOUT", (1, 0.2))
+	StandIn.stalls = 1
+	start = time.monotonic()
+	path = download_file_url(f"{server}/models/1/stage/model.onnx", tmp_path, hashlib.sha1(CONTENT).hexdigest(), chunk_size=1024)
+	assert time.monotonic() - start < 2  # did not wait for the stalled response
+	assert StandIn.ranges == [len(CONTENT) // 2]  # resumed after the read timeout
+	assert open(path, "rb").read() == CONTENT
+
+
+def test_checksum_mismatch(server, tmp_path):
+	with pytest.raises(Exception, match="Checksum mismatch"):
+		download_file_url(f"{server}/models/1/stage/model.onnx", tmp_path, "0" * 40, retries=1)
+	assert not (tmp_path / "model.onnx").exists()
+
+
+def test_parallel_downloads(server, tmp_path):
+	urls = [(f"{server}/models/1/stage/{name}", None) for name in ["a.onnx", "b/c.onnx"]]
+	paths = download_files(urls, tmp_path, verbose=False)
+	assert [open(path, "rb").read() == CONTENT for path in paths] == [True, True]
+
+
+def test_verify_multihash(tmp_path):
+	file = tmp_path / "file"
+	file.write_bytes(CONTENT)
+	assert verify_checksum(file, "1220" + hashlib.sha256(CONTENT).hexdigest())
+	assert not verify_checksum(file, hashlib.md5(b"").hexdigest())
+	# the hash code and digest length are varints, e.g. md5 (0xd5) is "d501" and blake2b-256 (0xb220) "a0e402"
+	assert verify_checksum(file, "d50110" + hashlib.md5(CONTENT).hexdigest())
+	assert verify_checksum(file, "a0e40220" + hashlib.blake2b(CONTENT, digest_size=32).hexdigest())
+	assert verify_checksum(file, "e0e40220" + hashlib.blake2s(CONTENT).hexdigest())
+	with pytest.raises(ValueError):
+		verify_checksum(file, "1210" + hashlib.sha256(CONTENT).hexdigest())  # wrong digest length
+	with pytest.raises(ValueError):
+		verify_checksum(file, "8080041220" + hashlib.sha256(CONTENT).hexdigest())  # unsupported code
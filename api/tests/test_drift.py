@@ -0,0 +1,78 @@
+import json
+import numpy as np
+
+from api.src.drift import DriftDetector, BandStats, subsample, psi, ks
+
+
+def images(n, low=0, high=256, bands=3, seed=0):
+	rng = np.random.default_rng(seed)
+	return [rng.integers(low, high, (bands, 100, 80), dtype=np.uint8) for _ in range(n)]
+
+
+def test_subsample():
+	view = subsample(np.zeros((3, 1000, 500), dtype=np.uint8), max_size=64)
+	assert view.shape[0] == 3 and max(view.shape[1:]) <= 64
+	assert subsample(np.zeros((3, 10, 10)), max_size=64).shape == (3, 10, 10)
+
+
+def test_band_stats_moments():
+	x = np.random.default_rng(0).normal(5, 2, (2, 1000))
+	x[1, :10] = np.nan
+	stats = BandStats(2, np.linspace(-5, 15, 41))
+	for chunk in np.split(x, 4, axis=1):
+		stats.update(chunk)
+	np.testing.assert_allclose(stats.mean, np.nanmean(x, axis=1))
+	np.testing.assert_allclose(stats.std, np.nanstd(x, axis=1))
+	assert stats.histograms.sum(axis=1).tolist() == [1000, 990]
+	restored = BandStats.from_dict(json.loads(json.dumps(stats.to_dict())))
+	np.testing.assert_allclose(restored.std, stats.std)
+
+
+def test_drift_scores():
+	reference = np.array([[10, 20, 30, 40]], dtype=float)
+	assert psi(reference, reference * 3)[0] < 1e-9 and ks(reference, reference * 3)[0] < 1e-9
+	shifted = np.array([[40, 30, 20, 10]], dtype=float)
+	assert psi(reference, shifted)[0] > 0.2 and abs(ks(reference, shifted)[0] - 0.4) < 1e-9
+
+
+def test_detector_builds_reference_and_reports_drift(tmp_path):
+	path = tmp_path / "drift.v1.json"
+	detector = DriftDetector("model", window_size=5, reference_path=str(path), reference_size=5, queue_size=100)
+	for image in images(5):
+		detector.add_sample(image)
+	detector.flush()
+	assert path.exists()  # built from the first samples and saved next to the catalog
+	for image in images(5, seed=1):
+		detector.add_sample(image)
+	detector.flush()
+	assert (detector.drift_metrics["psi"] < 0.05).all()
+	assert detector.drift_metrics["height"] == 100
+	# a new detector (e.g. after a restart) reuses the saved reference
+	detector = DriftDetector("model", window_size=5, reference_path=str(path), queue_size=100)
+	for image in images(5, low=200):  # brighter images
+		detector.add_sample(image)
+	detector.flush()
+	assert (detector.drift_metrics["psi"] > 0.2).all() and (detector.drift_metrics["ks"] > 0.5).all()
+	detector.close()
+
+
+def test_samples_are_dropped_when_busy():
+	detector = DriftDetector("model", queue_size=1)
+	detector.close()  # stop the background thread so the queue fills up
+	detector.thread.join()
+	detector.add_sample(images(1)[0])
+	assert detector.queue.full()
+
+
+def test_sample_views_read_beforehand():
+	class Source:
+		shape = (3, 1000, 1000)
+
+		def thumbnail(self, max_size):
+			raise AssertionError("the scene must not be read again")
+	detector = DriftDetector("model", queue_size=1)
+	detector.close()
+	detector.thread.join()
+	view = subsample(np.zeros(Source.shape, dtype=np.uint8), max_size=detector.sample_size)
+	detector.add_sample(Source(), view)
+	assert detector.queue.get_nowait() == (Source.shape, view)
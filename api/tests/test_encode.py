@@ -0,0 +1,35 @@
+import io
+import os
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from api.src.encode import encode_cog, quantize
+
+
+def test_quantize():
+	logits = np.array([-10.0, 0.0, 10.0], dtype=np.float32)
+	assert quantize(logits, "probability").tolist() == [0, 128, 255]
+	assert quantize(logits, "class").tolist() == [0, 0, 1]
+	assert quantize(logits) is logits
+	probabilities = np.array([4.5e-05, 0.5, 0.99995], dtype=np.float32)
+	assert quantize(probabilities, "probability", activated=True).tolist() == [0, 128, 255]
+	assert quantize(probabilities, "class", activated=True).tolist() == [0, 0, 1]
+	with pytest.raises(ValueError):
+		quantize(logits, "int4")
+
+
+def test_cog_keeps_georeferencing(tmp_path):
+	profile = {"crs": CRS.from_epsg(32631), "transform": from_origin(300000, 4600000, 10, 10)}
+	outputs = np.random.randn(1024, 1024).astype(np.float32)
+	chunks = list(encode_cog(outputs, profile=profile, directory=tmp_path, quantization="probability"))
+	assert len(chunks) > 0
+	assert os.listdir(tmp_path) == []  # temporary file is removed once streamed
+	with rio.open(io.BytesIO(b"".join(chunks))) as src:
+		assert src.crs == profile["crs"]
+		assert src.transform == profile["transform"]
+		assert src.dtypes[0] == "uint8"
+		assert src.profile["tiled"]
+		assert src.overviews(1)
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+
+from api.src.executor import InferenceExecutor, QueueFullError
+from api.src.preprocessing import Pipeline
+
+
+class FakeModel:
+	model_name = "fake"
+	version = 1
+
+	def __init__(self):
+		self.threads = set()
+
+	def predict(self, x):
+		self.threads.add(threading.current_thread().name)
+		return x * 2
+
+
+def test_predict_runs_off_event_loop():
+	model = FakeModel()
+	executor = InferenceExecutor("fake", max_workers=2)
+	async def run():
+		return await asyncio.gather(*[executor.predict(model, np.ones(2)) for _ in range(4)])
+	results = asyncio.run(run())
+	assert all((r == 2).all() for r in results)
+	assert threading.main_thread().name not in model.threads
+	executor.shutdown()
+
+
+def test_admit_rejects_when_saturated():
+	executor = InferenceExecutor("fake", max_queue=1)
+	with executor.admit():
+		with pytest.raises(QueueFullError):
+			with executor.admit():
+				pass
+	with executor.admit():
+		assert executor.in_flight == 1
+	assert executor.in_flight == 0
+	executor.shutdown()
+
+
+def test_preprocess_returns_each_input_size():
+	model = FakeModel()
+	model.pipeline = Pipeline({"input": {"data_type": "float32", "shape": [-1, 3, -1, -1]}})
+	executor = InferenceExecutor("fake")
+	sizes = [(32, 32), (40, 70), (64, 100)]
+	async def run():
+		return await asyncio.gather(*[executor.preprocess(model, np.zeros((3, *size), dtype=np.uint8)) for size in sizes])
+	results = asyncio.run(run())
+	assert [size for _, size in results] == sizes
+	assert [x.shape[2:] for x, _ in results] == [(32, 32), (32, 64), (64, 96)]
+	executor.shutdown()
+
+
+def test_close_waits_for_requests_in_flight():
+	model = FakeModel()
+	executor = InferenceExecutor("fake")
+	async def run():
+		with executor.use():
+			executor.close()  # e.g. the model was evicted while the request was running
+			return await executor.predict(model, np.ones(2))
+	assert (asyncio.run(run()) == 2).all()
+	assert executor.users == 0
+	with pytest.raises(RuntimeError):
+		asyncio.run(executor.predict(model, np.ones(2)))  # shut down once the last request is done
+
+
+def test_unsupported_kind():
+	with pytest.raises(ValueError):
+		InferenceExecutor("fake", kind="gpu")
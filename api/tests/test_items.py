@@ -0,0 +1,74 @@
+import os
+from fastapi.testclient import TestClient
+
+from api import main
+from api.src.items import ItemsCache, etag_matches
+
+
+class FakeCatalog:
+	def __init__(self, path):
+		self.path = str(path)
+		self.calls = 0
+
+	def items(self):
+		self.calls += 1
+		with open(self.path) as f:
+			return [{"id": "fake", "properties": {"catalog": f.read()}}]
+
+
+def test_items_are_encoded_once_per_catalog(tmp_path):
+	catalog = FakeCatalog(tmp_path / "catalog.v1.parquet")
+	with open(catalog.path, "w") as f:
+		f.write("a")
+	cache = ItemsCache()
+	body, etag = cache.get(catalog.path, catalog.items)
+	assert cache.get(catalog.path, catalog.items) == (body, etag)
+	assert catalog.calls == 1
+	assert body == b'[{"id":"fake","properties":{"catalog":"a"}}]'
+	with open(catalog.path, "w") as f:
+		f.write("bb")
+	os.utime(catalog.path, ns=(0, 0))
+	body, new_etag = cache.get(catalog.path, catalog.items)
+	assert catalog.calls == 2 and new_etag != etag and b'"bb"' in body
+	cache.invalidate(catalog.path)
+	cache.get(catalog.path, catalog.items)
+	assert catalog.calls == 3
+
+
+def test_etag_matches():
+	assert etag_matches('"a"', '"a"')
+	assert etag_matches('"b", W/"a"', '"a"')
+	assert etag_matches("*", '"a"')
+	assert not etag_matches('"b"', '"a"')
+	assert not etag_matches(None, '"a"')
+
+
+class FakeMetadata:
+	def __init__(self, path):
+		self.path = str(path)
+
+	def get(self, name):
+		return {"name": name, "id": None, "versions": [{"version_id": 1}, {"version_id": 2}]}
+
+	def catalog_path(self, name, version):
+		return f"{self.path}/{name}/catalog.v{version}.parquet"
+
+
+def test_metadata_endpoint_revalidates(tmp_path, monkeypatch):
+	catalog = FakeCatalog(tmp_path / "fake" / "catalog.v2.parquet")
+	os.makedirs(tmp_path / "fake")
+	with open(catalog.path, "w") as f:
+		f.write("a")
+	monkeypatch.setattr(main, "get_metadata_cache", lambda path: FakeMetadata(tmp_path))
+	monkeypatch.setattr(main, "read_items", lambda path: catalog.items())
+	monkeypatch.setattr(main.registry, "get", None)  # models are not loaded to be described
+	monkeypatch.setattr(main, "model_items", ItemsCache())
+	client = TestClient(main.app)
+	response = client.get("/fake")  # latest version
+	assert response.status_code == 200
+	assert response.json() == [{"id": "fake", "properties": {"catalog": "a"}}]
+	etag = response.headers["etag"]
+	response = client.get("/fake", headers={"If-None-Match": etag})
+	assert response.status_code == 304 and response.content == b""
+	assert catalog.calls == 1
+	assert client.get("/fake?version=3").status_code == 409
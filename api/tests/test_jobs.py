@@ -0,0 +1,107 @@
+import os
+import time
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+
+from api import main
+from api.src.jobs import JobQueue, SQLiteJobQueue, QUEUED, RUNNING, DONE, FAILED
+from api.src.worker import run_worker, run_job
+
+
+def submit(queue, model="model"):
+	job = queue.new_job(model, None)
+	open(job["input_path"], "wb").close()
+	return queue.submit(job)
+
+
+def test_claim_in_order_once(tmp_path):
+	queue = SQLiteJobQueue(str(tmp_path))
+	ids = [submit(queue)["id"] for _ in range(3)]
+	assert queue.get(ids[0])["status"] == QUEUED
+	claimed = queue.claim(2)
+	assert [job["id"] for job in claimed] == ids[:2]
+	assert queue.get(ids[0])["status"] == RUNNING
+	assert [job["id"] for job in queue.claim(2)] == ids[2:]
+	assert queue.claim(2) == []
+	queue.complete(ids[0], "result.json", "application/json")
+	queue.fail(ids[1], "boom")
+	assert queue.get(ids[0])["status"] == DONE and queue.get(ids[0])["result_path"] == "result.json"
+	assert queue.get(ids[1])["status"] == FAILED and queue.get(ids[1])["error"] == "boom"
+	assert queue.get("missing") is None
+
+
+def test_lost_jobs_are_requeued(tmp_path):
+	queue = SQLiteJobQueue(str(tmp_path), timeout=0.05)
+	job = submit(queue)
+	assert len(queue.claim()) == 1
+	assert queue.claim() == []
+	time.sleep(0.1)
+	assert [j["id"] for j in queue.claim()] == [job["id"]]
+
+
+def test_worker_runs_jobs_concurrently(tmp_path):
+	queue = SQLiteJobQueue(str(tmp_path))
+	jobs = [submit(queue, model) for model in ["ok"] * 4 + ["bad"]]
+	in_flight, peak = 0, 0
+	async def process(job):
+		nonlocal in_flight, peak
+		in_flight += 1
+		peak = max(peak, in_flight)
+		await asyncio.sleep(0.02)
+		in_flight -= 1
+		if job["model"] == "bad":
+			raise ValueError("bad input")
+		return job["input_path"], "application/json"
+	async def run():
+		worker = asyncio.ensure_future(run_worker(queue, process, concurrency=4, poll_interval=0.01))
+		while any(queue.get(job["id"])["status"] in (QUEUED, RUNNING) for job in jobs):
+			await asyncio.sleep(0.01)
+		worker.cancel()
+	asyncio.run(run())
+	assert peak == 4
+	assert [queue.get(job["id"])["status"] for job in jobs] == [DONE] * 4 + [FAILED]
+	assert queue.get(jobs[-1]["id"])["error"] == "bad input"
+
+
+def test_heartbeat_keeps_running_jobs(tmp_path):
+	queue = SQLiteJobQueue(str(tmp_path), timeout=0.15)
+	job = submit(queue)
+	async def process(job):
+		await asyncio.sleep(0.4)  # longer than the timeout, heartbeats every 0.05s
+		assert queue.claim() == []
+		return job["input_path"], "application/json"
+	async def run():
+		await run_job(queue, process, queue.claim()[0])
+	asyncio.run(run())
+	assert queue.get(job["id"])["status"] == DONE
+
+
+def test_finished_jobs_are_cleaned_up(tmp_path):
+	queue = SQLiteJobQueue(str(tmp_path))
+	done, running = submit(queue), submit(queue)
+	queue.claim(2)
+	queue.complete(done["id"], done["input_path"], "application/json")
+	assert queue.cleanup(ttl=60) == 0
+	assert queue.cleanup(ttl=0) == 1
+	assert queue.get(done["id"]) is None and not os.path.exists(queue.job_path(done["id"]))
+	assert queue.get(running["id"])["status"] == RUNNING
+	assert queue.update(done["id"], status=FAILED) is None
+
+
+def test_incomplete_backends_fail_early(tmp_path):
+	class PartialQueue(JobQueue):
+		def submit(self, job):
+			return job
+	with pytest.raises(TypeError):
+		PartialQueue(str(tmp_path))
+
+
+def test_expired_results_are_gone(tmp_path, monkeypatch):
+	queue = SQLiteJobQueue(str(tmp_path))
+	monkeypatch.setattr(main, "job_queue", queue)
+	job = submit(queue)
+	queue.claim()
+	queue.complete(job["id"], queue.job_path(job["id"]) + "/result.json", "application/json")
+	response = TestClient(main.app).get(f"/jobs/{job['id']}/result")
+	assert response.status_code == 410
@@ -0,0 +1,67 @@
+import time
+import pytest
+
+from api.src.metadata import MetadataCache
+
+
+class FakeFetch:
+	def __init__(self, versions=(1,)):
+		self.versions = list(versions)
+		self.calls = 0
+		self.error = None
+
+	def __call__(self, name):
+		self.calls += 1
+		if self.error:
+			return None, self.error
+		return {"id": "123", "name": name, "versions": [{"version_id": v} for v in self.versions]}, None
+
+
+def download(tmp_path, name, version):
+	(tmp_path / name).mkdir(exist_ok=True)
+	(tmp_path / name / f"catalog.v{version}.parquet").touch()
+
+
+def test_served_from_cache(tmp_path):
+	fetch = FakeFetch()
+	cache = MetadataCache(str(tmp_path), ttl=60, fetch=fetch)
+	assert cache.get("model")["id"] == "123"
+	cache.get("model")
+	assert fetch.calls == 1
+	# the index is persisted on disk
+	assert MetadataCache(str(tmp_path), ttl=60, fetch=fetch).get("model")["id"] == "123"
+	assert fetch.calls == 1
+
+
+def test_stale_while_revalidate(tmp_path):
+	fetch = FakeFetch()
+	cache = MetadataCache(str(tmp_path), ttl=0, fetch=fetch)
+	cache.get("model")
+	fetch.versions = [1, 2]
+	assert cache.get("model")["versions"] == [{"version_id": 1}]  # stale entry served immediately
+	for _ in range(100):
+		if len(cache.get("model")["versions"]) == 2:
+			break
+		time.sleep(0.01)
+	assert cache.get("model")["versions"] == [{"version_id": 1}, {"version_id": 2}]
+
+
+def test_api_errors_fall_back_to_disk(tmp_path):
+	fetch = FakeFetch()
+	fetch.error = "API unavailable"
+	cache = MetadataCache(str(tmp_path), fetch=fetch)
+	with pytest.raises(Exception, match="API unavailable"):
+		cache.get("model")
+	download(tmp_path, "model", 3)
+	assert cache.get("model")["versions"] == [{"version_id": 3}]
+
+
+def test_offline_mode(tmp_path):
+	fetch = FakeFetch()
+	cache = MetadataCache(str(tmp_path), offline=True, fetch=fetch)
+	with pytest.raises(Exception, match="not available offline"):
+		cache.get("model")
+	download(tmp_path, "model", 1)
+	download(tmp_path, "model", 2)
+	assert cache.get("model")["versions"] == [{"version_id": 1}, {"version_id": 2}]
+	assert fetch.calls == 0
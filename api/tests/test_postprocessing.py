@@ -0,0 +1,47 @@
+import numpy as np
+
+from api.src.postprocessing import Postprocessing
+from api.src.preprocessing import nearest
+
+CLASSES = [{"value": 0, "name": "background"}, {"value": 3, "name": "road"}, {"value": 7, "name": "water"}]
+
+
+def test_outputs_without_metadata_are_unchanged():
+	postprocessing = Postprocessing({"tasks": ["classification"]})
+	assert not postprocessing.enabled
+	x = np.array([[1.0, 2.0]], dtype=np.float32)
+	assert postprocessing.labels(postprocessing(x)[0]) == [1.0, 2.0]
+
+
+def test_classification_top_classes():
+	postprocessing = Postprocessing([{"tasks": ["classification"], "classification:classes": CLASSES}])
+	scores = postprocessing(np.array([[0.0, 2.0, 1.0], [5.0, 0.0, 0.0]], dtype=np.float32))
+	np.testing.assert_allclose(scores.sum(axis=1), 1, rtol=1e-6)
+	labels = postprocessing.labels(scores[0], k=2)
+	assert [label["class"] for label in labels] == ["road", "water"]
+	assert labels[0]["value"] == 3 and labels[0]["score"] > labels[1]["score"]
+
+
+def test_activation_from_post_processing_function():
+	output = {"tasks": ["segmentation"], "post_processing_function": {"format": "python", "expression": "torch.sigmoid"}}
+	postprocessing = Postprocessing(output)
+	np.testing.assert_allclose(postprocessing(np.zeros((1, 1, 2, 2), dtype=np.float32)), 0.5)
+
+
+def test_segmentation_class_maps():
+	postprocessing = Postprocessing({"tasks": ["segmentation"], "classification:classes": CLASSES})
+	logits = np.zeros((2, 3, 4, 4), dtype=np.float32)
+	logits[0, 1] = 1
+	logits[1, 2, :2] = 1
+	classes = postprocessing(logits)
+	assert classes.shape == (2, 4, 4) and classes.dtype == np.uint8
+	assert (classes[0] == 3).all() and (classes[1, :2] == 7).all() and (classes[1, 2:] == 0).all()
+	# a single channel is thresholded at sigmoid(x) > 0.5
+	binary = Postprocessing({"tasks": ["segmentation"], "classification:classes": CLASSES[:2]})
+	assert binary(np.array([[[[-1.0, 1.0]]]], dtype=np.float32)).tolist() == [[[0, 3]]]
+
+
+def test_nearest_keeps_class_values():
+	mask = np.array([[1, 2], [3, 4]], dtype=np.uint8)
+	up = nearest(mask, (4, 3))
+	assert up.dtype == np.uint8 and up.tolist() == [[1, 1, 2], [1, 1, 2], [3, 3, 4], [3, 3, 4]]
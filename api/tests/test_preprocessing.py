@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from api.src.preprocessing import Pipeline
+
+
+def metadata(**kwargs):
+	return {
+		"bands": ["red", "green", "blue"],
+		"input": {"data_type": "float32", "shape": [-1, 3, -1, -1]},
+		**kwargs,
+	}
+
+
+def test_default_scaling_is_8bit():
+	x = np.full((3, 64, 64), 255, dtype=np.uint8)
+	out, size = Pipeline(metadata())(x)
+	assert out.shape == (1, 3, 64, 64) and out.dtype == np.float32
+	assert size == (64, 64)
+	np.testing.assert_allclose(out, 1)
+
+
+def test_value_scaling_per_band():
+	scaling = [
+		{"type": "z-score", "mean": 10, "stddev": 2},
+		{"type": "z-score", "mean": 20, "stddev": 4},
+		{"type": "z-score", "mean": 30, "stddev": 5},
+	]
+	x = np.stack([np.full((32, 32), v, dtype=np.uint16) for v in (12, 28, 30)])
+	out, _ = Pipeline(metadata(value_scaling=scaling))(x)
+	np.testing.assert_allclose(out[0, :, 0, 0], [1, 2, 0])
+
+
+def test_min_max_and_clip():
+	scaling = [{"type": "clip", "minimum": 0, "maximum": 4000}, {"type": "min-max", "minimum": 0, "maximum": 4000}]
+	x = np.array([0, 2000, 10000], dtype=np.uint16).reshape(1, 1, 3).repeat(3, axis=0).repeat(32, axis=1)
+	x = np.pad(x, ((0, 0), (0, 0), (0, 29)))
+	out, _ = Pipeline(metadata(value_scaling=scaling))(x)
+	np.testing.assert_allclose(out[0, 0, 0, :3], [0, 0.5, 1])
+
+
+def test_band_selection_by_name():
+	x = np.stack([np.full((32, 32), v, dtype=np.uint8) for v in range(5)])
+	out, _ = Pipeline(metadata())(x, band_names=("nir", "blue", "green", "red", "swir"))
+	assert (out[0, :, 0, 0] * 255).round().tolist() == [3, 2, 1]
+
+
+def test_alpha_band_is_dropped():
+	out, _ = Pipeline(metadata())(np.zeros((4, 32, 32), dtype=np.uint8))
+	assert out.shape == (1, 3, 32, 32)
+	with pytest.raises(Exception):
+		Pipeline(metadata())(np.zeros((2, 32, 32), dtype=np.uint8))
+
+
+@pytest.mark.parametrize("resize_type,shape", [("crop", (32, 64)), ("pad", (64, 96)), ("interpolation-nearest", (32, 64))])
+def test_resize_to_multiple_of_32(resize_type, shape):
+	pipeline = Pipeline(metadata(resize_type=resize_type))
+	out, size = pipeline(np.zeros((3, 50, 70), dtype=np.uint8))
+	assert out.shape[2:] == shape
+	assert pipeline.restore_size(out[0, 0], size).shape == (50, 70)
+
+
+def test_batches():
+	out, _ = Pipeline(metadata())(np.zeros((4, 3, 32, 32), dtype=np.uint8))
+	assert out.shape == (4, 3, 32, 32)
@@ -0,0 +1,89 @@
+import time
+import pytest
+
+from api.src.registry import ModelRegistry, parse_model_list
+
+
+class FakeWrapper:
+	def __init__(self, model_name, version, size=10):
+		self.model_name = model_name
+		self.version = version
+		self.size = size
+		self.loaded = False
+
+	def load(self):
+		self.loaded = True
+
+	def preload(self):
+		self.load()
+
+	def unload(self):
+		self.loaded = False
+
+
+class FakeLoader:
+	def __init__(self, latest=1):
+		self.latest = latest
+		self.calls = []
+
+	def __call__(self, model, version):
+		self.calls.append((model, version))
+		return FakeWrapper(model, version if version is not None else self.latest)
+
+
+def test_parse_model_list():
+	assert parse_model_list("") == []
+	assert parse_model_list("a, b:2") == [("a", None), ("b", 2)]
+
+
+def test_wrapper_is_cached():
+	loader = FakeLoader()
+	registry = ModelRegistry(loader)
+	first = registry.get("model")
+	assert registry.get("model") is first
+	assert registry.get("model", 1) is first
+	assert loader.calls == [("model", None)]
+
+
+def test_lru_eviction_by_count():
+	evicted = []
+	registry = ModelRegistry(FakeLoader(), max_models=2, on_evict=evicted.append)
+	registry.get("a", 1)
+	registry.get("b", 1)
+	registry.get("a", 1)  # a becomes most recently used
+	registry.get("c", 1)
+	assert evicted == [("b", 1)]
+	assert list(registry.entries) == [("a", 1), ("c", 1)]
+
+
+def test_eviction_by_size():
+	registry = ModelRegistry(FakeLoader(), max_bytes=25)
+	registry.get("a", 1)
+	registry.get("b", 1)
+	registry.get("c", 1)
+	assert registry.size() == 20
+	assert ("a", 1) not in registry.entries
+
+
+def test_preload_warms_sessions():
+	registry = ModelRegistry(FakeLoader())
+	registry.preload([("a", None), ("b", 3)])
+	assert all(wrapper.loaded for wrapper in registry.entries.values())
+	assert set(registry.entries) == {("a", 1), ("b", 3)}
+
+
+def test_hot_reload_new_version():
+	loader = FakeLoader(latest=1)
+	evicted = []
+	registry = ModelRegistry(loader, reload_interval=0.01, on_evict=evicted.append)
+	assert registry.get("model").version == 1
+	loader.latest = 2
+	time.sleep(0.02)
+	# stale: the current version is served while the new one loads in the background
+	assert registry.get("model").version == 1
+	for _ in range(100):
+		if ("model", 2) in registry.entries:
+			break
+		time.sleep(0.01)
+	assert registry.get("model").version == 2
+	assert evicted == [("model", 1)]
@@ -0,0 +1,83 @@
+import json
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip("onnx")
+from onnx import helper, TensorProto
+
+import onnxruntime
+
+from api.src import session
+
+
+def test_cpu_quota(tmp_path, monkeypatch):
+	monkeypatch.setattr(session.os, "sched_getaffinity", lambda pid: set(range(8)), raising=False)
+	assert session.cpu_quota(str(tmp_path)) == 8  # no cgroup limits
+	(tmp_path / "cpu.max").write_text("max 100000\n")
+	assert session.cpu_quota(str(tmp_path)) == 8
+	(tmp_path / "cpu.max").write_text("150000 100000\n")
+	assert session.cpu_quota(str(tmp_path)) == 2
+	(tmp_path / "cpu.max").unlink()
+	(tmp_path / "cpu").mkdir()
+	(tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("50000\n")
+	(tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+	assert session.cpu_quota(str(tmp_path)) == 1
+
+
+def test_session_config(tmp_path, monkeypatch):
+	monkeypatch.setenv("ONNX_INTRA_OP_THREADS", "3")
+	monkeypatch.setenv("ONNX_PROVIDERS", "OpenVINOExecutionProvider, CPUExecutionProvider")
+	path = tmp_path / "sessions.json"
+	path.write_text(json.dumps({"default": {"inter_op_threads": 2}, "model": {"intra_op_threads": 1}}))
+	config = session.session_config("model", str(path))
+	assert config["providers"] == ["OpenVINOExecutionProvider", "CPUExecutionProvider"]
+	assert (config["intra_op_threads"], config["inter_op_threads"]) == (1, 2)
+	assert session.session_config("other", str(path))["intra_op_threads"] == 3
+	# providers not available in this build are skipped
+	assert session.session_providers(config["providers"]) == ["CPUExecutionProvider"]
+
+
+def test_sessions_share_the_cpu_quota(tmp_path, monkeypatch):
+	from api.src.synthetic import build_model
+	monkeypatch.delenv("ONNX_INTRA_OP_THREADS", raising=False)
+	monkeypatch.setattr(session, "cpu_quota", lambda: 4)
+	monkeypatch.setenv("ONNX_SESSIONS", "2")
+	sessions = []
+	for name in ("a", "b"):
+		path = str(tmp_path / f"{name}.onnx")
+		onnx.save(build_model("segmentation", layers=1, width=8), path)
+		sessions.append(session.create_session(path, name))
+	assert sum(s.get_session_options().intra_op_num_threads for s in sessions) <= 4
+	monkeypatch.setenv("ONNX_THREAD_BUDGET", "1")  # e.g. one of several process pool workers
+	assert session.default_config()["intra_op_threads"] == 1
+
+
+def test_optimized_model_is_cached(tmp_path):
+	x = helper.make_tensor_value_info("x", TensorProto.FLOAT, ["N", 3])
+	y = helper.make_tensor_value_info("y", TensorProto.FLOAT, ["N", 3])
+	one = helper.make_tensor("one", TensorProto.FLOAT, [1], [1.0])
+	nodes = [helper.make_node("Mul", ["x", "one"], ["t"]), helper.make_node("Relu", ["t"], ["y"])]
+	graph = helper.make_graph(nodes, "g", [x], [y], initializer=[one])
+	path = str(tmp_path / "model.onnx")
+	onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8), path)
+	first = session.create_session(path, "model")
+	cached = [f for f in tmp_path.iterdir() if f.name.endswith(".optimized.onnx")]
+	assert len(cached) == 1 and not [f for f in tmp_path.iterdir() if f.name.endswith(".part")]
+	second = session.create_session(path, "model")
+	data = np.array([[-1, 0, 2]], dtype=np.float32)
+	assert (first.run(None, {"x": data})[0] == second.run(None, {"x": data})[0]).all()
+
+
+def test_shared_weights_are_memory_mapped(tmp_path, monkeypatch):
+	from api.src.synthetic import build_model
+	monkeypatch.setenv("SHARED_WEIGHTS", "true")
+	path = str(tmp_path / "model.onnx")
+	onnx.save(build_model("segmentation", layers=2, width=32), path)
+	data = np.random.default_rng(0).standard_normal((1, 3, 8, 8)).astype(np.float32)
+	expected = onnxruntime.InferenceSession(path).run(None, {"x": data})[0]
+	shared = session.create_session(path, "model")
+	assert (tmp_path / "model.onnx.shared.onnx").exists() and (tmp_path / "model.onnx.weights").exists()
+	assert not [f for f in tmp_path.iterdir() if f.name.endswith(".optimized.onnx")]
+	assert np.allclose(shared.run(None, {"x": data})[0], expected, atol=1e-5)
+	with open("/proc/self/maps") as f:
+		assert str(tmp_path / "model.onnx.weights") in f.read()
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import subprocess
+from fastapi.testclient import TestClient
+
+from api import main
+from api.src.warmup import Warmup, HEAVY_MODULES
+
+# importing the API must stay fast for pods scaled from zero, heavy modules are loaded by the warmup
+IMPORT_TIME_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", 1.5))  # seconds
+
+
+def test_import_time_budget(tmp_path):
+	code = (
+		"import sys, time, json; start = time.perf_counter(); import api.main; "
+		"print(json.dumps([time.perf_counter() - start, sorted(m for m in %r if m in sys.modules)]))" % HEAVY_MODULES
+	)
+	root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	env = {**os.environ, "EOTDL_DOWNLOAD_PATH": str(tmp_path), "PYTHONWARNINGS": "ignore"}
+	result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=root, env=env, check=True)
+	seconds, imported = json.loads(result.stdout.strip().splitlines()[-1])
+	assert imported == []
+	assert seconds < IMPORT_TIME_BUDGET
+
+
+def test_readiness_follows_warmup(monkeypatch):
+	loaded = []
+	warmup = Warmup([("good", None), ("bad", 2)], modules=["json"], attempts=3, backoff=0)
+	monkeypatch.setattr(main, "warmup", warmup)
+	client = TestClient(main.app)
+	assert client.get("/health/live").status_code == 200
+	response = client.get("/health/ready")
+	assert response.status_code == 503 and response.json()["models"] == {"good": "pending", "bad:2": "pending"}
+
+	def load(model, version):
+		loaded.append(model)
+		if model == "bad":
+			raise Exception("not found")
+	warmup.run(load)
+	response = client.get("/health/ready")
+	assert response.status_code == 503 and response.json()["models"]["bad:2"] == "error: not found"
+	assert loaded == ["good", "bad", "bad", "bad"] and response.json()["imports"] == "loaded"
+	assert client.get("/health/live").status_code == 503
+
+	# transient errors are retried
+	attempts = []
+	warmup = Warmup([("flaky", None)], modules=["json"], attempts=3, backoff=0)
+	monkeypatch.setattr(main, "warmup", warmup)
+
+	def flaky(model, version):
+		attempts.append(model)
+		if len(attempts) < 2:
+			raise Exception("unavailable")
+	warmup.run(flaky)
+	assert len(attempts) == 2 and client.get("/health/ready").status_code == 200
+	assert client.get("/health/live").status_code == 200
+
+	warmup = Warmup([("good", None)], modules=["json"])
+	monkeypatch.setattr(main, "warmup", warmup)
+	warmup.run(lambda model, version: None)
+	assert client.get("/health/ready").json()["ready"] is True
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+
+from api.src.batch import BatchProcessor
+from api.src.tiling import tile_windows, blend_weights, predict_tiled, check_tiling
+
+
+class IdentityModel:
+	model_name = "identity"
+	version = 1
+
+	def __init__(self):
+		self.batches = []
+
+	def predict(self, x):
+		self.batches.append(x.shape[0])
+		return x[:, :1]  # first band as mask
+
+
+def test_windows_cover_image():
+	windows = tile_windows(100, 70, tile_size=32, overlap=8)
+	covered = np.zeros((100, 70), dtype=bool)
+	for row, col in windows:
+		covered[row:row + 32, col:col + 32] = True
+	assert covered.all()
+	assert max(row for row, _ in windows) == 100 - 32
+
+
+def test_blend_weights_never_zero():
+	weights = blend_weights(16, 4)
+	assert weights.shape == (16, 16)
+	assert weights.min() > 0 and weights.max() == 1
+
+
+def test_predict_tiled_reconstructs_scene():
+	image = np.random.rand(3, 100, 70).astype(np.float32)
+	model = IdentityModel()
+	processor = BatchProcessor(model, batch_size=4, timeout=0.01)
+	async def preprocess(tile):
+		return tile[None]
+	async def run():
+		return await predict_tiled(image, processor.submit, preprocess, tile_size=32, overlap=8, max_in_flight=8)
+	output = asyncio.run(run())
+	assert output.shape == (1, 100, 70)
+	np.testing.assert_allclose(output[0], image[0], rtol=1e-5)
+	assert max(model.batches) == 4  # tiles of the same scene are batched together
+
+
+def test_tiles_are_read_off_the_event_loop():
+	class Source:
+		def __init__(self, array):
+			self.array, self.shape, self.threads = array, array.shape, set()
+
+		def __getitem__(self, index):
+			self.threads.add(threading.current_thread().name)
+			return self.array[index]
+	source = Source(np.random.rand(1, 64, 64).astype(np.float32))
+	async def predict(tile):
+		return tile
+	async def preprocess(tile):
+		return tile[None]
+	output = asyncio.run(predict_tiled(source, predict, preprocess, tile_size=32, overlap=0))
+	np.testing.assert_allclose(output, source.array, rtol=1e-5)
+	assert source.threads and threading.main_thread().name not in source.threads
+
+
+def test_tiles_must_match_the_model_stride():
+	check_tiling(512, 64, 32)
+	for tile_size, overlap in [(500, 64), (512, 50), (512, 512)]:
+		with pytest.raises(ValueError):
+			check_tiling(tile_size, overlap, 32)
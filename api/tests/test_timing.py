@@ -0,0 +1,67 @@
+import asyncio
+import numpy as np
+from starlette.requests import Request
+
+from api import main
+
+from api.src.batch import BatchProcessor
+from api.src.timing import Timings, Profiler, start_timings, stage
+
+
+class FakeModel:
+	model_name = "fake"
+	version = 1
+
+	def predict(self, x):
+		return x * 2
+
+
+def test_server_timing_sums_repeated_stages():
+	timings = Timings("model")
+	timings.add("preprocess", 0.002)
+	timings.add("inference", 0.010)
+	timings.add("preprocess", 0.003)
+	assert list(timings.totals()) == ["preprocess", "inference"]
+	header = timings.server_timing()
+	assert header.startswith("preprocess;dur=5.00, inference;dur=10.00, total;dur=")
+	assert [span["stage"] for span in timings.report()["stages"]] == ["preprocess", "inference", "preprocess"]
+
+
+def test_batch_stages_are_recorded_per_request():
+	processor = BatchProcessor(FakeModel(), batch_size=2, timeout=10)
+	async def request(value):
+		timings = start_timings("fake")
+		with stage("preprocess"):
+			x = np.full((1, 3, 4, 4), value, dtype=np.float32)
+		await processor.submit(x)
+		return timings
+	async def run():
+		return await asyncio.gather(request(1), request(2))
+	for timings in asyncio.run(run()):
+		assert [stage for stage, *_ in timings.spans] == ["preprocess", "batch_wait", "inference"]
+
+
+def test_profiler():
+	profiler = Profiler(max_profiles=2)
+	assert not profiler.should_profile("model")
+	assert profiler.should_profile("model", requested=True)
+	profiler.arm("model", 2)
+	assert profiler.should_profile("model") and profiler.should_profile("model")
+	assert not profiler.should_profile("model") and not profiler.should_profile("other")
+	assert Profiler(sample_rate=1).should_profile("model")
+	saved = [Timings("model", profile=True) for _ in range(3)]
+	for timings in saved:
+		profiler.save(timings)
+	assert list(profiler.profiles) == [timings.id for timings in saved[1:]]
+	assert profiler.get(saved[0].id) is None
+
+
+def test_profile_header_needs_the_token(monkeypatch):
+	def request(value):
+		return Request({"type": "http", "headers": [(b"x-profile", value.encode())]})
+
+	monkeypatch.setattr(main, "PROFILE_TOKEN", None)
+	assert not main.profile_requested(request("true"))
+	monkeypatch.setattr(main, "PROFILE_TOKEN", "secret")
+	assert not main.profile_requested(request("true"))
+	assert main.profile_requested(request("secret"))
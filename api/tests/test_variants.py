@@ -0,0 +1,62 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("onnx")
+
+from api.src.synthetic import make_model, make_index
+from api.src.eotdl_wrapper import ModelWrapper
+from api.src import variants
+
+
+@pytest.fixture
+def model(tmp_path):
+	make_index(str(tmp_path), ["seg"])
+	make_model(str(tmp_path), "seg", "segmentation", layers=2)
+	return ModelWrapper("seg", path=str(tmp_path), verbose=False)
+
+
+def test_variants_are_built_next_to_the_model(model):
+	rng = np.random.default_rng(0)
+	calibration = [rng.random((1, 3, 32, 32), dtype=np.float32) for _ in range(4)]
+	for variant in variants.VARIANTS:
+		path = variants.build_variant(model.model_path, variant, calibration)
+		assert path == f"{model.model_path}.{variant}.onnx" and os.path.exists(path)
+	assert not [name for name in os.listdir(model.download_path) if name.endswith(".part")]
+	with pytest.raises(ValueError):
+		variants.variant_path(model.model_path, "int4")
+
+
+def test_with_variant_has_its_own_session(model):
+	variants.build_variant(model.model_path, "fp16")
+	fp16 = model.with_variant("fp16")
+	assert fp16 is model.with_variant("fp16") and model.with_variant(None) is model
+	assert fp16.variant == "fp16" and model.variant == "original"
+	x = np.random.default_rng(0).random((1, 3, 32, 32), dtype=np.float32)
+	np.testing.assert_allclose(fp16.predict(x), model.predict(x), atol=1e-2)
+	assert fp16.session is not model.session
+	model.unload()
+	assert fp16.session is None
+
+
+def test_compare_variants_report(model):
+	inputs = [np.random.default_rng(i).random((1, 3, 32, 32), dtype=np.float32) for i in range(2)]
+	variants.build_variant(model.model_path, "fp16")
+	report = variants.compare_variants(model, ["fp16"], inputs, runs=1)
+	assert list(report) == ["original", "fp16"]
+	assert report["fp16"]["agreement"] > 0.95 and report["fp16"]["max_abs_error"] < 1e-2
+	assert report["original"]["size_bytes"] > report["fp16"]["size_bytes"]
+
+
+def test_variants_are_only_built_when_preloading(model, monkeypatch):
+	monkeypatch.setattr("api.src.eotdl_wrapper.MODEL_VARIANTS_BUILD", "true")
+	for variant in ("fp16", "int4"):
+		with pytest.raises(variants.VariantNotFoundError):
+			model.with_variant(variant)
+	assert not os.path.exists(variants.variant_path(model.model_path, "fp16"))
+	default = ModelWrapper("seg", path=model.path, verbose=False, variant="fp16")
+	with pytest.raises(variants.VariantNotFoundError):
+		default.load()
+	default.preload()
+	assert os.path.exists(default.session_path) and default.session is not None
+	assert model.with_variant("fp16").variant == "fp16"
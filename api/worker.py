@@ -0,0 +1,14 @@
+# Standalone inference worker: processes the jobs submitted to the API, so API pods and
+# inference workers can be scaled independently (the API does not process jobs unless JOBS_WORKER=true).
+#
+#   python -m api.worker
+#
+# It shares JOBS_PATH/JOBS_QUEUE_URL (and the rest of the configuration) with the API.
+import asyncio
+
+from api.main import get_job_queue, process_job, JOBS_CONCURRENCY, JOBS_TTL
+from api.src.worker import run_worker
+
+
+if __name__ == "__main__":
+	asyncio.run(run_worker(get_job_queue(), process_job, JOBS_CONCURRENCY, ttl=JOBS_TTL))